@@ -2,21 +2,25 @@ import json
 import time
 import logging
 import uuid
-import math
-import paho.mqtt.client as mqtt
+import os
+
+from common.geometry import INTERSECTION_CENTER, projection_for
+from common.mqtt_transport import shared_transport
 
 # === Configuration ===
 MQTT_BROKER = "192.168.98.20"
 MQTT_PORT = 1883
 CAM_MQTT_TOPIC = "vanetza/in/cam"
-CAM_FILE_PATH = "obu_cam.json"
+OBU_DIR = os.path.dirname(os.path.abspath(__file__))
+CAM_FILE_PATH = os.path.join(OBU_DIR, "obu_cam.json")
 DENM_MQTT_TOPIC = "vanetza/in/denm"
-DENM_FILE_PATH = "obu_denm.json"
-LANE_FILE_PATH = "lane_coordinates_with_n.json"
+DENM_FILE_PATH = os.path.join(OBU_DIR, "obu_denm.json")
+LANE_FILE_PATH = os.path.join(OBU_DIR, "lane_coordinates_with_n.json")
 PUBLISH_INTERVAL = 0.7
+CAM_MAX_AGE = 1.0  # seconds a CAM may wait for the broker before it is dropped as stale
 
 
-INTERSECTION_CENTER = {"lat": 40.6329, "lng": -8.6585}
+INTERSECTION = projection_for(INTERSECTION_CENTER)
 DENM_THRESHOLD = 100  # when within X sends denm
 
 # === Tracking ===
@@ -25,34 +29,23 @@ current_lane = 2
 lane_point = 0
 
 # === Compute Start Positions ===
-def meters_to_lat(dm):
-    return (dm / 6371000) * (180 / math.pi)
-
-def meters_to_lng(dm, lat):
-    return (dm / (6371000 * math.cos(math.radians(lat)))) * (180 / math.pi)
-
 NS_START = 300   # north/south roads
 EW_START = 500   # east/west roads
 
-position = {
-    1: {  # Northbound starts north of intersection
-        "lat": INTERSECTION_CENTER["lat"] + meters_to_lat(NS_START),
-        "lng": INTERSECTION_CENTER["lng"]
-    },
-    3: {  # Southbound starts south of intersection
-        "lat": INTERSECTION_CENTER["lat"] - meters_to_lat(NS_START),
-        "lng": INTERSECTION_CENTER["lng"]
-    },
-    2: {  # Eastbound starts east of intersection
-        "lat": INTERSECTION_CENTER["lat"],
-        "lng": INTERSECTION_CENTER["lng"] + meters_to_lng(EW_START, INTERSECTION_CENTER["lat"])
-    },
-    4: {  # Westbound starts west of intersection
-        "lat": INTERSECTION_CENTER["lat"],
-        "lng": INTERSECTION_CENTER["lng"] - meters_to_lng(EW_START, INTERSECTION_CENTER["lat"])
-    }
+# Lane -> start (x east, y north) in meters from the intersection center
+LANE_START = {
+    1: (0, NS_START),    # Northbound starts north of intersection
+    3: (0, -NS_START),   # Southbound starts south of intersection
+    2: (EW_START, 0),    # Eastbound starts east of intersection
+    4: (-EW_START, 0),   # Westbound starts west of intersection
 }
 
+def start_position(lane):
+    lat, lng = INTERSECTION.to_gps(*LANE_START[lane])
+    return {"lat": lat, "lng": lng}
+
+position = {lane: start_position(lane) for lane in LANE_START}
+
 speed_delta = 0.000150
 last_dist = None
 denm_sent = False
@@ -63,15 +56,9 @@ def load_json(filepath):
     with open(filepath, "r") as file:
         return json.load(file)
 
-def haversine_distance(lat1, lon1, lat2, lon2):
-    # Calculate distance in meters between two lat/lon pairs
-    R = 6371000
-    phi1, phi2 = math.radians(lat1), math.radians(lat2)
-    dphi = math.radians(lat2 - lat1)
-    dlambda = math.radians(lon2 - lon1)
-    a = math.sin(dphi/2)**2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda/2)**2
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
-    return R * c
+def distance_to_intersection(pos):
+    # Meters from the intersection center, in its cached local projection
+    return INTERSECTION.distance(pos["lat"], pos["lng"])
 
 # === CAM ===
 
@@ -117,9 +104,8 @@ def publish_cam():
 
     payload = json.dumps(cam_msg)
 
-    info = client.publish(CAM_MQTT_TOPIC, payload, qos=0)
-    
-    if info.rc == mqtt.MQTT_ERR_SUCCESS:
+    # A newer CAM of this station replaces one still waiting for the broker
+    if transport.publish(CAM_MQTT_TOPIC, payload, qos=0, key=("cam", cam_msg.get("stationID")), max_age=CAM_MAX_AGE):
         print(f"Sent CAM message to `{CAM_MQTT_TOPIC}`: pos=({cam_msg['latitude']:.7f}, {cam_msg['longitude']:.7f})")
 
 # === DENM ===
@@ -142,40 +128,31 @@ def publish_denm():
             }
     
     payload = json.dumps(denm_msg)
-    info = client.publish(DENM_MQTT_TOPIC, payload, qos=0)
-    if info.rc == mqtt.MQTT_ERR_SUCCESS:
+    if transport.publish(DENM_MQTT_TOPIC, payload, qos=0):
         print(f"Sent DENM to `{DENM_MQTT_TOPIC}` (heading={heading})")
     else:
-        print(f"Failed to send DENM to `{DENM_MQTT_TOPIC}` (rc={info.rc})")
+        print(f"Failed to send DENM to `{DENM_MQTT_TOPIC}`")
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s: %(message)s')
 
 # === MQTT Setup ===
 
-client = mqtt.Client(client_id="ambulance_obu_1", clean_session=False)
-
-def on_connect(client, userdata, flags, rc):
-    if rc == 0:
-        logging.info("Connected to MQTT Broker")
-    else:
-        logging.error(f"Failed to connect to broker, return code {rc}")
-
-client.on_connect = on_connect
-client.connect(MQTT_BROKER, MQTT_PORT, keepalive=60)
+# Connects on start() and keeps reconnecting with backoff; a DENM sent while the
+# broker is unreachable is queued and goes out on reconnect
+transport = shared_transport("ambulance_obu_1", MQTT_BROKER, MQTT_PORT, clean_session=False)
 
 # === Main Loop ===        
 last_dist = None
 
 if __name__ == "__main__":
     print("====================== OBU Ambulance 1 ======================")
-    client.loop_start()
+    transport.start()
     try:
         while True:
             publish_cam()
             # compute distance
             cam_pos = position[current_lane]
-            dist = haversine_distance(cam_pos["lat"], cam_pos["lng"],
-                                      INTERSECTION_CENTER["lat"], INTERSECTION_CENTER["lng"])
+            dist = distance_to_intersection(cam_pos)
             print(f"Distance from intersection: {dist:.1f} m (lane {current_lane})")
 
             # end-of-street threshold by lane orientation
@@ -207,5 +184,5 @@ if __name__ == "__main__":
     except KeyboardInterrupt:
         print("Stopped by user")
     finally:
-        client.loop_stop()
-        client.disconnect()
+        transport.log_stats()
+        transport.stop()
@@ -0,0 +1,108 @@
+"""
+Columnar binary lane geometry.
+
+A bundle is a directory of plain .npy files:
+
+    points.npy      float64 (4, N): rows x, y (meters east/north), lat, lon
+    offsets.npy     int64 (lanes + 1): lane i is points[:, offsets[i]:offsets[i + 1]]
+    names.npy       unicode (lanes,): lane names
+    reference.npy   float64 (2,): lat, lon of the local origin
+
+Every column is one contiguous array, so LaneGeometry.load() memory-maps the
+points and hands out per-lane views without parsing or copying anything.
+
+    python3 -m common.lane_geometry rsu/lane_coordinates.json rsu/lane_geometry
+"""
+import json
+import os
+import numpy as np
+from common.geometry import INTERSECTION_CENTER, LocalProjection
+
+class LaneGeometry:
+    """Points of many lanes in flat x/y/lat/lon columns, split by offsets"""
+
+    def __init__(self, names, offsets, points, reference):
+        self.names = [str(name) for name in names]
+        self.offsets = offsets
+        self.points = points
+        self.reference = reference
+        self._lane_numbers = {name: i for i, name in enumerate(self.names)}
+
+    @classmethod
+    def from_lanes(cls, lanes, reference=INTERSECTION_CENTER):
+        """
+        Bundle from lane name -> points in local meters, given as (N, 2) arrays or
+        lists of {"x", "y"} dicts. lat/lon are projected around reference.
+        """
+        names, arrays = [], []
+        for name, points in lanes.items():
+            if len(points) and isinstance(points[0], dict):
+                points = [(p["x"], p["y"]) for p in points]
+            names.append(name)
+            arrays.append(np.asarray(points, dtype=np.float64).reshape(-1, 2))
+        offsets = np.zeros(len(arrays) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(a) for a in arrays])
+
+        xy = np.concatenate(arrays) if arrays else np.empty((0, 2))
+        points = np.empty((4, len(xy)), dtype=np.float64)
+        points[0], points[1] = xy[:, 0], xy[:, 1]
+        points[2], points[3] = LocalProjection.around(reference).to_gps(points[0], points[1])
+        return cls(names, offsets, points, np.array([reference["lat"], reference["lng"]], dtype=np.float64))
+
+    @classmethod
+    def from_json(cls, filepath, reference=INTERSECTION_CENTER):
+        """Bundle from a lane_coordinates JSON file (lane name -> list of {x, y} dicts)"""
+        with open(filepath, "r") as file:
+            return cls.from_lanes(json.load(file), reference)
+
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, "points.npy"), np.ascontiguousarray(self.points))
+        np.save(os.path.join(directory, "offsets.npy"), self.offsets)
+        np.save(os.path.join(directory, "names.npy"), np.array(self.names, dtype=np.str_))
+        np.save(os.path.join(directory, "reference.npy"), self.reference)
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        """Bundle saved by save(); with mmap the points stay on disk until touched"""
+        return cls(
+            np.load(os.path.join(directory, "names.npy")),
+            np.load(os.path.join(directory, "offsets.npy")),
+            np.load(os.path.join(directory, "points.npy"), mmap_mode="r" if mmap else None),
+            np.load(os.path.join(directory, "reference.npy")),
+        )
+
+    @property
+    def reference_point(self):
+        return {"lat": float(self.reference[0]), "lng": float(self.reference[1])}
+
+    def __len__(self):
+        return len(self.names)
+
+    def lane(self, name):
+        """(4, n) view of one lane: rows x, y, lat, lon"""
+        i = self._lane_numbers[name]
+        return self.points[:, self.offsets[i]:self.offsets[i + 1]]
+
+    def xy(self, name):
+        """(x, y) views of one lane"""
+        lane = self.lane(name)
+        return lane[0], lane[1]
+
+    def latlon(self, name):
+        """(lat, lon) views of one lane"""
+        lane = self.lane(name)
+        return lane[2], lane[3]
+
+    def lanes(self):
+        """lane name -> (n, 2) x/y array, the input format of LaneIndex"""
+        return {name: np.column_stack(self.xy(name)) for name in self.names}
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) != 3:
+        print("usage: python3 -m common.lane_geometry <lane_coordinates.json> <bundle directory>")
+        sys.exit(1)
+    geometry = LaneGeometry.from_json(sys.argv[1])
+    geometry.save(sys.argv[2])
+    print(f"Saved {len(geometry)} lanes, {geometry.points.shape[1]} points to {sys.argv[2]}")
@@ -0,0 +1,194 @@
+"""
+Point-to-lane matching over lane node polylines.
+
+Lanes are polylines in local meters (x east, y north), e.g. the lists of
+{x, y, n} dicts of lane_coordinates_with_n.json. All segments are bucketed in a
+uniform grid at load time, so a query only measures the segments near its
+cell. nearest() answers one position, nearest_many() a whole batch of
+positions in a single vectorized pass.
+
+    python3 -m common.lane_index rsu/lane_geometry   # timings, JSON files work too
+"""
+import json
+import math
+import time
+from collections import namedtuple
+import numpy as np
+
+DEFAULT_MAX_DISTANCE = 5.0  # meters from a lane centerline for a match
+
+# lane: lane name, node: index of the nearest node of that lane, along: distance
+# from the lane's first node, remaining: distance left to its last node,
+# distance: from the queried point to the lane centerline
+LaneMatch = namedtuple("LaneMatch", ["lane", "node", "along", "remaining", "distance"])
+
+def load_lane_coordinates(filepath):
+    """lane name -> (N, 2) array of x/y, from a lane_coordinates JSON file"""
+    with open(filepath, "r") as file:
+        data = json.load(file)
+    return {name: np.array([(p["x"], p["y"]) for p in points], dtype=np.float64)
+            for name, points in data.items()}
+
+class LaneIndex:
+    """
+    Grid index over the segments of many lanes. Every occupied grid cell keeps
+    the segments that can be within max_distance of any point inside it, padded
+    to a fixed width, so a batch of queries is one gather and one dense
+    point-to-segment distance computation. Queries may use a smaller
+    max_distance than the index was built for, never a larger one.
+    """
+
+    def __init__(self, lanes, max_distance=DEFAULT_MAX_DISTANCE, cell_size=None):
+        self.names = []
+        starts, ends, lane_of, node_of, along = [], [], [], [], []
+        lengths = []
+        for name, points in lanes.items():
+            points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+            if len(points) < 2:
+                continue
+            seg = np.hypot(*(points[1:] - points[:-1]).T)
+            cumulative = np.concatenate(([0.0], np.cumsum(seg)))
+            starts.append(points[:-1])
+            ends.append(points[1:])
+            lane_of.append(np.full(len(seg), len(self.names), dtype=np.int64))
+            node_of.append(np.arange(len(seg), dtype=np.int64))
+            along.append(cumulative[:-1])
+            self.names.append(name)
+            lengths.append(cumulative[-1])
+        if not self.names:
+            raise ValueError("LaneIndex needs at least one lane with two nodes")
+
+        # Flat segment arrays: start point, direction vector, owner lane and node
+        a = np.concatenate(starts)
+        b = np.concatenate(ends)
+        self.ax, self.ay = a[:, 0].copy(), a[:, 1].copy()
+        self.dx, self.dy = b[:, 0] - self.ax, b[:, 1] - self.ay
+        self.length_sq = np.maximum(self.dx ** 2 + self.dy ** 2, 1e-12)
+        self.length = np.sqrt(self.length_sq)
+        # Compass direction of travel along each segment, degrees clockwise from north
+        self.direction = np.degrees(np.arctan2(self.dx, self.dy)) % 360
+        self.lane_of = np.concatenate(lane_of)
+        self.node_of = np.concatenate(node_of)
+        self.along = np.concatenate(along)
+        self.lengths = np.array(lengths)
+
+        self.max_distance = float(max_distance)
+        # Half the match radius: the 5x5 cells around a point cover the whole radius
+        # with fewer candidate segments than 3x3 cells of the full radius
+        self.cell_size = float(cell_size or self.max_distance / 2)
+        self.rings = max(1, math.ceil(self.max_distance / self.cell_size))
+        self.origin = np.minimum(a, b).min(axis=0)
+        self._build_grid(a, b)
+
+    def _cell(self, x, y):
+        """Integer cell key of each point, -1 for points far off the map"""
+        cx = np.floor((x - self.origin[0]) / self.cell_size).astype(np.int64) + self.rings + 1
+        cy = np.floor((y - self.origin[1]) / self.cell_size).astype(np.int64) + self.rings + 1
+        # Rows wider than the map would alias onto the next column
+        return np.where((cy >= 0) & (cy < self._stride), cx * self._stride + cy, -1)
+
+    def _build_grid(self, a, b):
+        lo = np.minimum(a, b)
+        hi = np.maximum(a, b)
+        self._stride = int((hi[:, 1].max() - self.origin[1]) // self.cell_size) + 2 * self.rings + 3
+        x0 = np.floor((lo[:, 0] - self.origin[0]) / self.cell_size).astype(np.int64)
+        y0 = np.floor((lo[:, 1] - self.origin[1]) / self.cell_size).astype(np.int64)
+        x1 = np.floor((hi[:, 0] - self.origin[0]) / self.cell_size).astype(np.int64)
+        y1 = np.floor((hi[:, 1] - self.origin[1]) / self.cell_size).astype(np.int64)
+        segment = np.arange(len(x0))
+
+        # (cell, segment) pairs for every cell within rings of a cell the segment touches
+        cells, owners = [], []
+        r = self.rings
+        for i in range(-r, int((x1 - x0).max()) + r + 1):
+            for j in range(-r, int((y1 - y0).max()) + r + 1):
+                mask = (x0 + i <= x1 + r) & (y0 + j <= y1 + r)
+                cells.append((x0[mask] + i + r + 1) * self._stride + y0[mask] + j + r + 1)
+                owners.append(segment[mask])
+        pairs = np.unique(np.concatenate(cells) * len(segment) + np.concatenate(owners))
+        cells, owners = pairs // len(segment), pairs % len(segment)
+
+        # Dense (cells, width) candidate table, padded with segment -1
+        self.cell_keys, first, counts = np.unique(cells, return_index=True, return_counts=True)
+        rank = np.arange(len(cells)) - np.repeat(first, counts)
+        self.candidates = np.full((len(self.cell_keys), int(counts.max())), -1, dtype=np.int64)
+        self.candidates[np.repeat(np.arange(len(self.cell_keys)), counts), rank] = owners
+
+    def nearest_many(self, x, y, max_distance=None, heading=None, heading_tolerance=60):
+        """
+        Nearest lane of many points at once. x, y (and optionally heading, degrees)
+        are arrays; segments running against the heading by more than
+        heading_tolerance are skipped. Returns arrays (lane, node, along, remaining,
+        distance) with lane -1 and distance inf where nothing is within max_distance.
+        lane indexes self.names.
+        """
+        if max_distance is None:
+            max_distance = self.max_distance
+        elif max_distance > self.max_distance:
+            raise ValueError(f"max_distance {max_distance} exceeds the index radius {self.max_distance}")
+        x = np.atleast_1d(np.asarray(x, dtype=np.float64))
+        y = np.atleast_1d(np.asarray(y, dtype=np.float64))
+        n = len(x)
+
+        key = self._cell(x, y)
+        row = np.minimum(np.searchsorted(self.cell_keys, key), len(self.cell_keys) - 1)
+        occupied = self.cell_keys[row] == key
+        segment = np.where(occupied[:, None], self.candidates[row], -1)   # (n, width)
+        valid = segment >= 0
+        segment = np.maximum(segment, 0)
+
+        px, py = x[:, None], y[:, None]
+        dx, dy = self.dx[segment], self.dy[segment]
+        t = np.clip(((px - self.ax[segment]) * dx + (py - self.ay[segment]) * dy) / self.length_sq[segment], 0.0, 1.0)
+        distance = np.hypot(self.ax[segment] + t * dx - px, self.ay[segment] + t * dy - py)
+        if heading is not None:
+            heading = np.broadcast_to(np.asarray(heading, dtype=np.float64), (n,))[:, None]
+            valid &= np.abs((self.direction[segment] - heading + 180) % 360 - 180) <= heading_tolerance
+        distance = np.where(valid & (distance <= max_distance), distance, np.inf)
+
+        best = np.argmin(distance, axis=1)
+        rows = np.arange(n)
+        best_distance = distance[rows, best]
+        found = np.isfinite(best_distance)
+        seg = segment[rows, best]
+        best_t = t[rows, best]
+        lane = np.where(found, self.lane_of[seg], -1)
+        node = np.where(found, self.node_of[seg] + (best_t > 0.5), -1)
+        along = np.where(found, self.along[seg] + best_t * self.length[seg], np.nan)
+        remaining = np.where(found, self.lengths[self.lane_of[seg]] - along, np.nan)
+        return lane, node, along, remaining, best_distance
+
+    def nearest(self, x, y, max_distance=None, heading=None, heading_tolerance=60):
+        """LaneMatch of the nearest lane within max_distance of (x, y), or None"""
+        lane, node, along, remaining, distance = self.nearest_many(
+            [x], [y], max_distance, None if heading is None else [heading], heading_tolerance)
+        if lane[0] < 0:
+            return None
+        return LaneMatch(self.names[lane[0]], int(node[0]), float(along[0]), float(remaining[0]), float(distance[0]))
+
+if __name__ == "__main__":
+    import os
+    import sys
+    from common.lane_geometry import LaneGeometry
+    path = sys.argv[1] if len(sys.argv) > 1 else "rsu/lane_geometry"
+    lanes = LaneGeometry.load(path).lanes() if os.path.isdir(path) else load_lane_coordinates(path)
+    started = time.perf_counter()
+    index = LaneIndex(lanes)
+    print(f"{len(index.names)} lanes, {len(index.lane_of)} segments, {len(index.cell_keys)} cells of "
+          f"{index.cell_size:.1f} m, up to {index.candidates.shape[1]} candidates per cell, "
+          f"built in {(time.perf_counter() - started) * 1000:.1f} ms")
+
+    rng = np.random.default_rng(1)
+    points = np.concatenate(list(lanes.values()))
+    lo, hi = points.min(axis=0) - index.max_distance, points.max(axis=0) + index.max_distance
+    x = rng.uniform(lo[0], hi[0], 100000)
+    y = rng.uniform(lo[1], hi[1], 100000)
+    started = time.perf_counter()
+    for i in range(1000):
+        index.nearest(x[i], y[i])
+    print(f"nearest:      {(time.perf_counter() - started) * 1000:.1f} us per query")
+    started = time.perf_counter()
+    lane = index.nearest_many(x, y)[0]
+    elapsed = time.perf_counter() - started
+    print(f"nearest_many: {elapsed / len(x) * 1e6:.2f} us per point, {len(x) / elapsed:,.0f} points/s, "
+          f"{np.count_nonzero(lane >= 0)} matched")
@@ -0,0 +1,336 @@
+"""
+Shared MQTT transport for the RSU, OBU and dashboard processes.
+
+MqttTransport owns one paho client and its network thread, the only thread
+that touches the client. Connecting and reconnecting happen there, with
+exponential backoff plus jitter, cycling through the configured brokers, so
+neither the callers nor the paho callbacks ever sleep or block on the broker.
+publish() never blocks either: it puts the message in a bounded outbound queue
+and wakes the network thread, which hands it to paho as soon as the connection
+is up and the socket has drained what was written before.
+
+A message published with a key, e.g. ("spatem", intersection id) or
+("cam", station id), supersedes the unsent message with the same topic and key,
+so after a stall only the freshest state of each station goes out. With
+max_age a queued message is dropped instead of being sent late. Messages
+without a key (DENMs) are all kept, in order. When the queue is full, the
+policy decides what is lost:
+
+    drop-oldest   the oldest queued message makes room (default)
+    drop-newest   the new message is dropped
+    coalesce      as drop-oldest, and messages without a key are keyed by topic
+
+Subscriptions are registered once with a callback(topic, payload) and renewed
+on every connect. shared_transport() pools transports per broker so several
+components of one process share a single connection.
+"""
+import logging
+import random
+import select
+import socket
+import threading
+import time
+from collections import OrderedDict
+import paho.mqtt.client as mqtt
+
+DROP_OLDEST = "drop-oldest"
+DROP_NEWEST = "drop-newest"
+COALESCE = "coalesce"
+
+MAX_QUEUE = 1000        # messages waiting for the broker
+RECONNECT_MIN_DELAY = 1
+RECONNECT_MAX_DELAY = 30
+LOOP_TIMEOUT = 0.1      # seconds the network thread waits for socket activity or a wakeup
+
+logger = logging.getLogger("mqtt_transport")
+
+class MqttTransport:
+    """One auto-reconnecting MQTT connection with a bounded outbound queue"""
+
+    def __init__(self, client_id, hosts, port=1883, keepalive=60, clean_session=True,
+                 max_queue=MAX_QUEUE, policy=DROP_OLDEST,
+                 min_delay=RECONNECT_MIN_DELAY, max_delay=RECONNECT_MAX_DELAY):
+        if policy not in (DROP_OLDEST, DROP_NEWEST, COALESCE):
+            raise ValueError(f"Unknown queue policy {policy}")
+        self.client_id = client_id
+        self.hosts = [hosts] if isinstance(hosts, str) else list(hosts)
+        self.port = port
+        self.keepalive = keepalive
+        self.max_queue = max_queue
+        self.policy = policy
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+
+        self.client = mqtt.Client(client_id=client_id, clean_session=clean_session)
+        self.client.on_connect = self._on_connect
+        self.client.on_disconnect = self._on_disconnect
+        self.client.on_message = self._on_message
+
+        self._subscriptions = []    # (topic filter, qos, callback)
+        self._pending_subscriptions = []    # (topic filter, qos) added while connected
+        self._lock = threading.Lock()
+        # queue key -> (topic, payload, qos, expiry time or None); the queue key is
+        # (topic, key) for keyed messages and a sequence number for the others
+        self._queue = OrderedDict()
+        self._sequence = 0
+        self._connected = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._host_index = 0
+        # publish() wakes the network thread through this socket pair
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._wake_w.setblocking(False)
+        self._wake_pending = False
+
+        self.counters = {
+            "published": 0,     # handed to paho
+            "queued": 0,        # accepted into the outbound queue
+            "dropped": 0,       # lost to a full queue
+            "coalesced": 0,     # replaced by a newer message with the same key
+            "expired": 0,       # older than their max_age when they could be sent
+            "failed": 0,        # rejected by paho
+            "received": 0,
+            "connects": 0,
+            "disconnects": 0,
+            "max_queue": 0,
+        }
+
+    # === Subscriptions ===
+
+    def subscribe(self, topic, callback, qos=0):
+        """Call callback(topic, payload) for messages matching topic, from now on and after every reconnect"""
+        with self._lock:
+            self._subscriptions.append((topic, qos, callback))
+            if self._connected.is_set():
+                self._pending_subscriptions.append((topic, qos))
+                self._wake()
+
+    def _on_connect(self, client, userdata, flags, rc):
+        if rc != 0:
+            logger.error(f"{self.client_id} Failed to connect, return code {rc}")
+            return
+        logger.info(f"{self.client_id} Connected to MQTT Broker at {self.hosts[self._host_index]}:{self.port}")
+        self.counters["connects"] += 1
+        with self._lock:
+            self._pending_subscriptions = []
+            subscriptions = list(self._subscriptions)
+        for topic, qos, _ in subscriptions:
+            client.subscribe(topic, qos)
+        self._connected.set()
+
+    def _on_disconnect(self, client, userdata, rc):
+        self._connected.clear()
+        self.counters["disconnects"] += 1
+        if rc != 0:
+            logger.warning(f"{self.client_id} Disconnected from broker with code {rc}")
+
+    def _on_message(self, client, userdata, msg):
+        self.counters["received"] += 1
+        for topic, _, callback in self._subscriptions:
+            if mqtt.topic_matches_sub(topic, msg.topic):
+                try:
+                    callback(msg.topic, msg.payload)
+                except Exception as e:
+                    logger.error(f"{self.client_id} Error processing message on {msg.topic}: {e}")
+
+    # === Publishing ===
+
+    def is_connected(self):
+        return self._connected.is_set()
+
+    def publish(self, topic, payload, qos=0, key=None, max_age=None):
+        """
+        Queue a message for the network thread, which sends it right away when
+        the broker is reachable. A queued message is replaced by a newer one with
+        the same topic and key, and dropped once older than max_age seconds.
+        Returns False when the message was dropped.
+        """
+        if key is None and self.policy == COALESCE:
+            key = topic
+        with self._lock:
+            queued = self._enqueue(topic, payload, qos, key, max_age)
+            if queued:
+                self._wake()
+            return queued
+
+    def _enqueue(self, topic, payload, qos, key, max_age):
+        now = time.monotonic()
+        expiry = None if max_age is None else now + max_age
+        if key is not None:
+            queue_key = (topic, key)
+            if queue_key in self._queue:
+                # The newer message takes the place of the unsent one, at the back of the queue
+                del self._queue[queue_key]
+                self._queue[queue_key] = (topic, payload, qos, expiry)
+                self.counters["coalesced"] += 1
+                return True
+        else:
+            self._sequence += 1
+            queue_key = self._sequence
+        if len(self._queue) >= self.max_queue:
+            self._expire(now)
+        if len(self._queue) >= self.max_queue:
+            self.counters["dropped"] += 1
+            if self.policy == DROP_NEWEST:
+                return False
+            self._queue.popitem(last=False)
+        self._queue[queue_key] = (topic, payload, qos, expiry)
+        self.counters["queued"] += 1
+        self.counters["max_queue"] = max(self.counters["max_queue"], len(self._queue))
+        return True
+
+    def _expire(self, now):
+        expired = [queue_key for queue_key, entry in self._queue.items() if entry[3] is not None and entry[3] <= now]
+        for queue_key in expired:
+            del self._queue[queue_key]
+        self.counters["expired"] += len(expired)
+
+    def _flush(self):
+        """Send queued messages in order while paho can write them out; runs on the network thread"""
+        with self._lock:
+            self._expire(time.monotonic())
+            while self._queue and self._connected.is_set() and not self.client.want_write():
+                queue_key, entry = self._queue.popitem(last=False)
+                result = self.client.publish(entry[0], entry[1], entry[2])
+                if result.rc == mqtt.MQTT_ERR_SUCCESS:
+                    self.counters["published"] += 1
+                elif result.rc == mqtt.MQTT_ERR_NO_CONN:
+                    # The connection dropped before on_disconnect ran; keep the message
+                    self._queue[queue_key] = entry
+                    self._queue.move_to_end(queue_key, last=False)
+                    self._connected.clear()
+                else:
+                    self.counters["failed"] += 1
+                    logger.warning(f"{self.client_id} Failed to send message to topic `{entry[0]}` (rc={result.rc})")
+
+    def _wake(self):
+        """Interrupt the network thread's wait; called with the lock held"""
+        if not self._wake_pending:
+            self._wake_pending = True
+            try:
+                self._wake_w.send(b"\0")
+            except OSError:
+                pass
+
+    def _drain_wakeups(self):
+        with self._lock:
+            self._wake_pending = False
+            try:
+                while self._wake_r.recv(4096):
+                    pass
+            except OSError:
+                pass
+            subscriptions, self._pending_subscriptions = self._pending_subscriptions, []
+        for topic, qos in subscriptions:
+            self.client.subscribe(topic, qos)
+
+    # === Network Thread ===
+
+    def start(self):
+        if self._thread is None:
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name=f"mqtt {self.client_id}", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self.client.disconnect()
+
+    def _backoff(self, attempt):
+        """Exponential delay with jitter, so many clients do not reconnect in lockstep"""
+        delay = min(self.max_delay, self.min_delay * 2 ** attempt)
+        return delay * random.uniform(0.5, 1.0)
+
+    def _run(self):
+        attempt = 0
+        while not self._stopping.is_set():
+            host = self.hosts[self._host_index]
+            try:
+                self.client.connect(host, self.port, self.keepalive)
+            except (OSError, ValueError) as e:
+                delay = self._backoff(attempt)
+                logger.warning(f"{self.client_id} Cannot reach broker {host}:{self.port} ({e}), retrying in {delay:.1f} s")
+                # The next attempt tries the next broker
+                self._host_index = (self._host_index + 1) % len(self.hosts)
+                attempt += 1
+                self._stopping.wait(delay)
+                continue
+
+            rc = mqtt.MQTT_ERR_SUCCESS
+            established = False
+            while rc == mqtt.MQTT_ERR_SUCCESS and not self._stopping.is_set():
+                rc = self._loop()
+                if self._connected.is_set():
+                    attempt = 0
+                    established = True
+            self._connected.clear()
+            if not established:
+                self._host_index = (self._host_index + 1) % len(self.hosts)
+            if not self._stopping.is_set():
+                delay = self._backoff(attempt)
+                logger.info(f"{self.client_id} Connection lost (rc={rc}), reconnecting in {delay:.1f} s")
+                attempt += 1
+                self._stopping.wait(delay)
+
+    def _loop(self):
+        """
+        One pass of the network loop: wait for the socket or a wakeup, read,
+        hand the queued messages to paho and write out what it could not send
+        """
+        sock = self.client.socket()
+        if sock is None:
+            return mqtt.MQTT_ERR_NO_CONN
+        wlist = [sock] if self.client.want_write() else []
+        try:
+            readable, writable, _ = select.select([sock, self._wake_r], wlist, [], LOOP_TIMEOUT)
+        except (OSError, ValueError):
+            return mqtt.MQTT_ERR_CONN_LOST
+        if self._wake_r in readable:
+            self._drain_wakeups()
+        if sock in readable:
+            rc = self.client.loop_read()
+            if rc != mqtt.MQTT_ERR_SUCCESS:
+                return rc
+        if self._queue and self._connected.is_set():
+            self._flush()
+        if sock in writable:
+            rc = self.client.loop_write()
+            if rc != mqtt.MQTT_ERR_SUCCESS:
+                return rc
+        return self.client.loop_misc()
+
+    # === Statistics ===
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, queue=len(self._queue), connected=self.is_connected())
+
+    def log_stats(self):
+        stats = self.stats()
+        logger.info(f"{self.client_id} MQTT published {stats['published']}, queued {stats['queued']} "
+                    f"(now {stats['queue']}, max {stats['max_queue']}), dropped {stats['dropped']}, "
+                    f"coalesced {stats['coalesced']}, expired {stats['expired']}, failed {stats['failed']}, received {stats['received']}, "
+                    f"connects {stats['connects']}, disconnects {stats['disconnects']}")
+
+# === Pool ===
+
+_pool = {}
+_pool_lock = threading.Lock()
+
+def shared_transport(client_id, hosts, port=1883, **options):
+    """
+    The transport of this process for the given brokers, created on first use
+    with this client_id and options. Components subscribe and publish on it and
+    the process starts and stops it once.
+    """
+    key = (tuple([hosts] if isinstance(hosts, str) else hosts), port)
+    with _pool_lock:
+        transport = _pool.get(key)
+        if transport is None:
+            transport = _pool[key] = MqttTransport(client_id, hosts, port, **options)
+        return transport
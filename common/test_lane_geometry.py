@@ -0,0 +1,44 @@
+import os
+
+import numpy as np
+
+from common.geometry import INTERSECTION_CENTER, LocalProjection
+from common.lane_geometry import LaneGeometry
+
+BUNDLE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "rsu", "lane_geometry")
+
+LANES = {
+    "a": [{"x": 0.0, "y": 0.0}, {"x": 0.0, "y": 10.0}, {"x": 5.0, "y": 20.0}],
+    "b": np.array([[-30.0, 2.0], [30.0, 2.0]]),
+}
+
+def test_from_lanes():
+    geometry = LaneGeometry.from_lanes(LANES)
+    assert len(geometry) == 2 and geometry.names == ["a", "b"]
+    assert list(geometry.offsets) == [0, 3, 5]
+    x, y = geometry.xy("a")
+    assert list(x) == [0.0, 0.0, 5.0] and list(y) == [0.0, 10.0, 20.0]
+    lat, lon = geometry.latlon("b")
+    expected = LocalProjection.around(INTERSECTION_CENTER).to_gps(np.array([-30.0, 30.0]), np.array([2.0, 2.0]))
+    assert np.allclose(lat, expected[0]) and np.allclose(lon, expected[1])
+
+def test_save_and_load(tmp_path):
+    geometry = LaneGeometry.from_lanes(LANES, reference={"lat": 41.0, "lng": -8.0})
+    geometry.save(tmp_path)
+    loaded = LaneGeometry.load(tmp_path)
+    # Memory-mapped, lanes are views of the one points array
+    assert isinstance(loaded.points, np.memmap)
+    assert loaded.lane("a").base is not None
+    assert loaded.names == geometry.names
+    assert loaded.reference_point == {"lat": 41.0, "lng": -8.0}
+    assert np.array_equal(loaded.points, geometry.points)
+    for name in geometry.names:
+        assert np.array_equal(loaded.lanes()[name], geometry.lanes()[name])
+
+def test_committed_bundle():
+    geometry = LaneGeometry.load(BUNDLE_DIR)
+    assert geometry.reference_point == INTERSECTION_CENTER
+    assert geometry.offsets[-1] == geometry.points.shape[1]
+    # lat/lon columns are the projection of the x/y columns
+    lat, lon = LocalProjection.around(INTERSECTION_CENTER).to_gps(geometry.points[0], geometry.points[1])
+    assert np.allclose(geometry.points[2], lat) and np.allclose(geometry.points[3], lon)
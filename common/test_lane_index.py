@@ -0,0 +1,93 @@
+import os
+
+import numpy as np
+import pytest
+
+from common.lane_geometry import LaneGeometry
+from common.lane_index import LaneIndex
+
+BUNDLE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "rsu", "lane_geometry")
+
+def brute_force(lanes, x, y, max_distance, heading=None, heading_tolerance=60):
+    """(lane, distance, remaining) of the nearest segment over every segment of every lane"""
+    best = (None, np.inf, None)
+    for name, points in lanes.items():
+        points = np.asarray(points, dtype=np.float64)
+        lengths = np.hypot(*np.diff(points, axis=0).T)
+        total = lengths.sum()
+        along = 0.0
+        for (ax, ay), (bx, by), length in zip(points[:-1], points[1:], lengths):
+            dx, dy = bx - ax, by - ay
+            if heading is not None:
+                direction = np.degrees(np.arctan2(dx, dy)) % 360
+                if abs((direction - heading + 180) % 360 - 180) > heading_tolerance:
+                    along += length
+                    continue
+            t = np.clip(((x - ax) * dx + (y - ay) * dy) / max(dx * dx + dy * dy, 1e-12), 0.0, 1.0)
+            distance = np.hypot(ax + t * dx - x, ay + t * dy - y)
+            if distance <= max_distance and distance < best[1]:
+                best = (name, distance, total - along - t * length)
+            along += length
+    return best
+
+@pytest.fixture(scope="module")
+def lanes():
+    return LaneGeometry.load(BUNDLE_DIR).lanes()
+
+@pytest.fixture(scope="module")
+def queries(lanes):
+    rng = np.random.default_rng(7)
+    points = np.concatenate(list(lanes.values()))
+    lo, hi = points.min(axis=0) - 10, points.max(axis=0) + 10
+    # Random points over the map, and points close to the lane nodes
+    near = points[rng.integers(0, len(points), 200)] + rng.normal(0, 2.0, (200, 2))
+    return np.concatenate([rng.uniform(lo, hi, (200, 2)), near])
+
+def test_nearest_matches_brute_force(lanes, queries):
+    index = LaneIndex(lanes, max_distance=5.0)
+    matched = 0
+    for x, y in queries:
+        name, distance, remaining = brute_force(lanes, x, y, 5.0)
+        match = index.nearest(x, y)
+        if name is None:
+            assert match is None
+            continue
+        matched += 1
+        assert match is not None
+        # Equidistant lanes may be picked either way, the distance is the same
+        assert match.distance == pytest.approx(distance, abs=1e-9)
+        if match.lane == name:
+            assert match.remaining == pytest.approx(remaining, abs=1e-6)
+    assert matched > 50
+
+def test_nearest_with_heading_matches_brute_force(lanes, queries):
+    index = LaneIndex(lanes, max_distance=5.0)
+    rng = np.random.default_rng(3)
+    for (x, y), heading in zip(queries, rng.uniform(0, 360, len(queries))):
+        name, distance, _ = brute_force(lanes, x, y, 5.0, heading)
+        match = index.nearest(x, y, heading=heading)
+        assert (match is None) == (name is None)
+        if match is not None:
+            assert match.distance == pytest.approx(distance, abs=1e-9)
+
+def test_nearest_many_matches_nearest(lanes, queries):
+    index = LaneIndex(lanes, max_distance=5.0)
+    lane, node, along, remaining, distance = index.nearest_many(queries[:, 0], queries[:, 1], max_distance=3.0)
+    for i, (x, y) in enumerate(queries):
+        match = index.nearest(x, y, max_distance=3.0)
+        if match is None:
+            assert lane[i] == -1 and np.isinf(distance[i])
+        else:
+            assert (index.names[lane[i]], node[i]) == (match.lane, match.node)
+            assert distance[i] == pytest.approx(match.distance)
+
+def test_query_radius_is_bounded_by_the_index():
+    index = LaneIndex({"a": [(0, 0), (0, 10)]}, max_distance=2.0)
+    with pytest.raises(ValueError):
+        index.nearest(0, 0, max_distance=3.0)
+    assert index.nearest(1.5, 5.0).lane == "a"
+    assert index.nearest(2.5, 5.0) is None
+
+def test_needs_a_lane():
+    with pytest.raises(ValueError):
+        LaneIndex({"a": [(0, 0)]})
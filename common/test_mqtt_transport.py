@@ -0,0 +1,76 @@
+import select
+
+import pytest
+
+from common import mqtt_transport
+from common.mqtt_transport import COALESCE, DROP_NEWEST, DROP_OLDEST, MqttTransport, shared_transport
+
+def queued(transport):
+    return [(entry[0], entry[1]) for entry in transport._queue.values()]
+
+def test_drop_oldest_makes_room():
+    transport = MqttTransport("test", "127.0.0.1", max_queue=3, policy=DROP_OLDEST)
+    assert all(transport.publish("denm", str(i).encode()) for i in range(4))
+    assert queued(transport) == [("denm", b"1"), ("denm", b"2"), ("denm", b"3")]
+    assert transport.counters["dropped"] == 1
+
+def test_drop_newest_rejects_new_message():
+    transport = MqttTransport("test", "127.0.0.1", max_queue=3, policy=DROP_NEWEST)
+    results = [transport.publish("denm", str(i).encode()) for i in range(4)]
+    assert results == [True, True, True, False]
+    assert queued(transport) == [("denm", b"0"), ("denm", b"1"), ("denm", b"2")]
+    assert transport.counters["dropped"] == 1
+
+def test_keyed_message_replaces_unsent_one():
+    transport = MqttTransport("test", "127.0.0.1")
+    transport.publish("cam", b"a1", key=("cam", 1))
+    transport.publish("cam", b"b1", key=("cam", 2))
+    transport.publish("denm", b"d")
+    transport.publish("cam", b"a2", key=("cam", 1))
+    # The newer CAM of station 1 goes to the back, unkeyed messages are all kept
+    assert queued(transport) == [("cam", b"b1"), ("denm", b"d"), ("cam", b"a2")]
+    assert transport.counters["coalesced"] == 1
+
+def test_coalesce_keys_by_topic():
+    transport = MqttTransport("test", "127.0.0.1", policy=COALESCE)
+    for payload in (b"1", b"2", b"3"):
+        transport.publish("spatem", payload)
+    transport.publish("mapem", b"m")
+    assert queued(transport) == [("spatem", b"3"), ("mapem", b"m")]
+    assert transport.counters["coalesced"] == 2
+
+def test_max_age_expires_queued_messages(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(mqtt_transport.time, "monotonic", lambda: now[0])
+    transport = MqttTransport("test", "127.0.0.1", max_queue=2)
+    transport.publish("cam", b"old", key=("cam", 1), max_age=1.0)
+    transport.publish("denm", b"d")
+    now[0] += 2.0
+    # A full queue first drops what expired, so nothing fresh is lost
+    transport.publish("cam", b"new", key=("cam", 2), max_age=1.0)
+    assert queued(transport) == [("denm", b"d"), ("cam", b"new")]
+    assert transport.counters["expired"] == 1
+    assert transport.counters["dropped"] == 0
+    # Expired messages are not sent once the broker is back either
+    now[0] += 2.0
+    transport._flush()
+    assert queued(transport) == [("denm", b"d")]
+    assert transport.counters["expired"] == 2
+
+def test_publish_wakes_network_thread():
+    transport = MqttTransport("test", "127.0.0.1")
+    assert not select.select([transport._wake_r], [], [], 0)[0]
+    transport.publish("cam", b"c")
+    transport.publish("cam", b"c")
+    assert select.select([transport._wake_r], [], [], 0)[0]
+    transport._drain_wakeups()
+    assert not select.select([transport._wake_r], [], [], 0)[0]
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        MqttTransport("test", "127.0.0.1", policy="drop-all")
+
+def test_shared_transport_per_broker():
+    transport = shared_transport("one", "test-broker", 1884)
+    assert shared_transport("two", ["test-broker"], 1884) is transport
+    assert shared_transport("three", "test-broker", 1885) is not transport
@@ -47,6 +47,70 @@ const VehicleMarker = ({ position, vehicle }) => {
 
 
 
+// Live updates arrive as server-sent events from /api/stream (see dashboard/push.py).
+// /api/traffic is still fetched at start, when the server asks for a resync and
+// every RESYNC_INTERVAL as a safety net (the simulation runs on the server on its
+// own); after the first snapshot only the changes since the last version seen
+// are requested.
+const RESYNC_INTERVAL = 5000;
+
+const camToVanetzaVehicle = (msg) => ({
+  id: msg.stationID,
+  position: {
+    lat: msg.latitude,
+    lng: msg.longitude
+  },
+  heading: msg.heading,
+  speed: msg.speed,
+  type: msg.stationType === 5 ? 'vehicle' : 'rsu'
+});
+
+const denmToVanetzaEvent = (msg) => ({
+  id: msg.eventID,
+  position: {
+    lat: msg.latitude,
+    lng: msg.longitude
+  },
+  type: msg.eventType,
+  description: msg.description
+});
+
+// Apply the entity changes of one delta frame to a /api/traffic snapshot
+const applyTrafficEvents = (prev, events) => {
+  const vehicles = new Map(prev.vehicles.map(v => [v.id, v]));
+  const lights = new Map(prev.traffic_lights.map(l => [l.id, l]));
+  const rsus = new Map((prev.rsu_nodes || []).map(r => [r.id, r]));
+  const next = { ...prev };
+  events.forEach(event => {
+    if (event.type === 'vehicle') {
+      vehicles.set(event.vehicle.id, event.vehicle);
+    } else if (event.type === 'vehicle_removed') {
+      vehicles.delete(event.id);
+    } else if (event.type === 'traffic_light') {
+      lights.set(event.light.id, event.light);
+    } else if (event.type === 'rsu') {
+      rsus.set(event.rsu.id, event.rsu);
+    } else if (event.type === 'emergency') {
+      next.emergency_mode = event.emergency_mode;
+      next.emergency_vehicle = event.emergency_vehicle;
+    }
+  });
+  next.vehicles = Array.from(vehicles.values());
+  next.traffic_lights = Array.from(lights.values());
+  next.rsu_nodes = Array.from(rsus.values());
+  next.timestamp = Math.floor(Date.now() / 1000);
+  return next;
+};
+
+// The same for a /api/traffic?since=<version> response
+const deltaToEvents = (delta) => [
+  ...delta.vehicles.map(vehicle => ({ type: 'vehicle', vehicle })),
+  ...delta.removed_vehicles.map(id => ({ type: 'vehicle_removed', id })),
+  ...delta.traffic_lights.map(light => ({ type: 'traffic_light', light })),
+  ...delta.rsu_nodes.map(rsu => ({ type: 'rsu', rsu })),
+  { type: 'emergency', emergency_mode: delta.emergency_mode, emergency_vehicle: delta.emergency_vehicle }
+];
+
 const TrafficMap = () => {
   const [data, setData] = useState(null);
   const [vanetzaEvents, setVanetzaEvents] = useState([]);
@@ -71,22 +135,25 @@ const TrafficMap = () => {
   // Fetch traffic data
   useEffect(() => {
     let isMounted = true;
+    let version = null;  // state version the map is up to date with
     
     const fetchData = async () => {
       try {
-        const response = await fetch(`${serverUrl}/api/traffic`);
+        const since = version === null ? '' : `?since=${version}`;
+        const response = await fetch(`${serverUrl}/api/traffic${since}`);
         if (!response.ok) {
           throw new Error('Network response was not ok');
         }
         const data = await response.json();
-        // console.log("Traffic data received:", data);
-        // console.log("Traffic light states:", data.traffic_lights.map(light => 
-        // `${light.id}: ${light.state} (${light.countdown}s)`));
         // setTrafficData(data);
         // setLoading(false);
         if (isMounted) {  // Only update state if component is still mounted
-          console.log("Traffic light states:", data.traffic_lights.map(l => `${l.id}: ${l.state}`));
-          setTrafficData(data);
+          if (data.full === false) {
+            setTrafficData(prev => (prev ? applyTrafficEvents(prev, deltaToEvents(data)) : prev));
+          } else {
+            setTrafficData(data);
+          }
+          version = data.version;
           setLoading(false);
         }
       } catch (err) {
@@ -101,9 +168,6 @@ const TrafficMap = () => {
       }
     };
 
-    fetchData();
-    const trafficInterval = setInterval(fetchData, 1000);
-
     const fetchVanetzaData = async () => {
     try {
       const response = await fetch(`${serverUrl}/api/vanetza_messages`);
@@ -114,16 +178,7 @@ const TrafficMap = () => {
       
       // Process CAM messages to show vehicles
       if (data.cam && data.cam.length > 0) {
-        const vehicles = data.cam.map(msg => ({
-          id: msg.stationID,
-          position: {
-            lat: msg.latitude,
-            lng: msg.longitude
-          },
-          heading: msg.heading,
-          speed: msg.speed,
-          type: msg.stationType === 5 ? 'vehicle' : 'rsu'
-        }));
+        const vehicles = data.cam.map(camToVanetzaVehicle);
         
         // Update your state with these vehicles
         setVanetzaVehicles(vehicles);
@@ -132,15 +187,7 @@ const TrafficMap = () => {
       // Process DENM messages for events
       if (data.denm && data.denm.length > 0) {
         // Extract events from DENM messages
-        const events = data.denm.map(msg => ({
-          id: msg.eventID,
-          position: {
-            lat: msg.latitude,
-            lng: msg.longitude
-          },
-          type: msg.eventType,
-          description: msg.description
-        }));
+        const events = data.denm.map(denmToVanetzaEvent);
         // Update your state with these events
         setVanetzaEvents(events);
       }
@@ -150,12 +197,46 @@ const TrafficMap = () => {
     }
   };
 
+    fetchData();
     fetchVanetzaData();
-    const vanetzaInterval = setInterval(fetchVanetzaData, 1000);
+    const resyncInterval = setInterval(fetchData, RESYNC_INTERVAL);
+
+    const handleMessages = (messages) => {
+      const cams = messages.filter(m => m.message_type === 'cam');
+      if (cams.length > 0) {
+        setVanetzaVehicles(prev => {
+          const byStation = new Map(prev.map(v => [v.id, v]));
+          cams.forEach(m => byStation.set(m.message.stationID, camToVanetzaVehicle(m.message)));
+          return Array.from(byStation.values());
+        });
+      }
+      const denms = messages.filter(m => m.message_type === 'denm');
+      if (denms.length > 0) {
+        setVanetzaEvents(prev => prev.concat(denms.map(m => denmToVanetzaEvent(m.message))).slice(-100));
+      }
+    };
+
+    const stream = new EventSource(`${serverUrl}/api/stream`);
+    stream.addEventListener('delta', (e) => {
+      if (!isMounted) return;
+      const { events, version: frameVersion } = JSON.parse(e.data);
+      if (version !== null) {
+        version = Math.max(version, frameVersion);
+      }
+      setTrafficData(prev => (prev ? applyTrafficEvents(prev, events) : prev));
+      handleMessages(events.filter(event => event.type === 'message'));
+    });
+    // Too far behind for deltas: start again from a full snapshot
+    stream.addEventListener('resync', () => {
+      version = null;
+      fetchData();
+      fetchVanetzaData();
+    });
     
     return () => {
-      clearInterval(trafficInterval);
-      clearInterval(vanetzaInterval);
+      isMounted = false;
+      stream.close();
+      clearInterval(resyncInterval);
     };
   }, [serverUrl]);
 
@@ -0,0 +1,125 @@
+"""
+Background DENM dispatch for the dashboard.
+
+submit() only puts the DENM on a bounded queue and returns at once; a small
+pool of worker threads posts it with a persistent HTTP session per worker, a
+timeout on every request and a few retries with backoff. A DENM whose actionID
+(originatingStationID, sequenceNumber) was already submitted recently is
+dropped, as is any DENM submitted while the queue is full, so a slow or
+missing endpoint never holds up the caller.
+"""
+import logging
+import queue
+import threading
+import time
+import requests
+
+WORKERS = 2
+MAX_QUEUED = 100     # DENMs waiting to be sent before new ones are dropped
+TIMEOUT = 2.0        # seconds, for connecting and for the response
+RETRIES = 3          # attempts after the first one
+RETRY_BACKOFF = 0.5  # seconds before the first retry, doubled on each one
+DEDUP_WINDOW = 60.0  # seconds an actionID is remembered
+
+logger = logging.getLogger("denm")
+
+def action_id(denm):
+    """(originatingStationID, sequenceNumber) of a DENM, None when it has no actionID"""
+    action = denm.get('management', {}).get('actionID')
+    if not action:
+        return None
+    return (action.get('originatingStationID'), action.get('sequenceNumber'))
+
+class DenmDispatcher:
+    """Posts DENMs to a URL from worker threads"""
+
+    def __init__(self, url, workers=WORKERS, max_queued=MAX_QUEUED, timeout=TIMEOUT,
+                 retries=RETRIES, retry_backoff=RETRY_BACKOFF, dedup_window=DEDUP_WINDOW):
+        self.url = url
+        self.workers = workers
+        self.timeout = timeout
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self.dedup_window = dedup_window
+        self.queue = queue.Queue(maxsize=max_queued)
+        self.lock = threading.Lock()
+        self.recent = {}            # actionID -> time submitted
+        self._stopping = threading.Event()
+        self._threads = []
+        self.counters = {"submitted": 0, "sent": 0, "failed": 0, "retries": 0,
+                         "duplicates": 0, "dropped": 0}
+
+    def submit(self, denm):
+        """Queue a DENM for sending; False when it is a duplicate or the queue is full"""
+        key = action_id(denm)
+        now = time.monotonic()
+        with self.lock:
+            if key is not None:
+                # Forget the actionIDs that left the window
+                for old_key in [k for k, t in self.recent.items() if now - t > self.dedup_window]:
+                    del self.recent[old_key]
+                if key in self.recent:
+                    self.counters["duplicates"] += 1
+                    return False
+            try:
+                self.queue.put_nowait(denm)
+            except queue.Full:
+                self.counters["dropped"] += 1
+                logger.warning(f"DENM queue full, dropped DENM {key}")
+                return False
+            if key is not None:
+                self.recent[key] = now
+            self.counters["submitted"] += 1
+        return True
+
+    def start(self):
+        if not self._threads:
+            self._stopping.clear()
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f"denm sender {i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+        return self
+
+    def stop(self):
+        self._stopping.set()
+        for thread in self._threads:
+            thread.join(timeout=self.timeout * 2)
+        self._threads = []
+
+    def _count(self, counter):
+        with self.lock:
+            self.counters[counter] += 1
+
+    def _post(self, session, denm):
+        """Send one DENM, retrying failures; True once the endpoint accepted it"""
+        for attempt in range(self.retries + 1):
+            if attempt:
+                self._count("retries")
+                if self._stopping.wait(self.retry_backoff * 2 ** (attempt - 1)):
+                    return False
+            try:
+                response = session.post(self.url, json=denm, timeout=self.timeout)
+            except requests.RequestException as e:
+                logger.warning(f"DENM {action_id(denm)} not sent (attempt {attempt + 1}): {e}")
+                continue
+            if response.status_code < 500:
+                logger.info(f"DENM {action_id(denm)} response: {response.status_code}")
+                return True
+            logger.warning(f"DENM {action_id(denm)} rejected (attempt {attempt + 1}): {response.status_code}")
+        logger.error(f"Giving up on DENM {action_id(denm)} after {self.retries + 1} attempts")
+        return False
+
+    def _run(self):
+        # requests sessions are not shared between threads
+        with requests.Session() as session:
+            while not self._stopping.is_set():
+                try:
+                    denm = self.queue.get(timeout=0.5)
+                except queue.Empty:
+                    continue
+                self._count("sent" if self._post(session, denm) else "failed")
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, pending=self.queue.qsize())
@@ -0,0 +1,154 @@
+"""
+Kinematics of the simulated vehicles as a struct of arrays.
+
+The dashboard vehicles are dicts (see vehicle_registry.py), but moving them one
+dict at a time tops out at a few hundred vehicles per tick. SimulatedFleet
+mirrors the simulated ones in NumPy arrays, one row per vehicle, and step()
+moves the whole fleet at once: red-light stopping, movement along the four
+approaches and wrap-around at the edges of the map. Only the vehicles that
+changed are written back to their dicts.
+
+Rows are kept in step with the dicts through sync(vehicle), called whenever a
+vehicle changes outside the simulation, and remove(vehicle_id). Vehicles driven
+by CAMs (cam_source) are never simulated.
+"""
+import numpy as np
+
+from common.geometry import projection_for
+
+DEGREES_PER_SECOND = 0.000065 / 30  # degrees moved per second, per unit of speed
+LANE_OFFSET = 0.0001     # degrees from the road axis to the right lane
+EDGE = 0.008             # degrees from the center where vehicles wrap around
+STOP_RADIUS = 40         # meters: vehicles closer than this stop at a red light...
+CLEAR_RADIUS = 15        # ...unless already this close, inside the intersection
+
+# Heading (degrees) -> traffic light direction, movement axis and sign
+APPROACHES = [
+    (0, 'NORTH', 'lat', 1),
+    (90, 'EAST', 'lng', 1),
+    (180, 'SOUTH', 'lat', -1),
+    (270, 'WEST', 'lng', -1),
+]
+
+class SimulatedFleet:
+    """Positions, headings, speeds and flags of the simulated vehicles, one row each"""
+
+    def __init__(self, center, capacity=64):
+        self.center = center
+        self.projection = projection_for(center)
+        self.size = 0
+        self.vehicles = []          # row -> vehicle dict
+        self.rows = {}              # dashboard id -> row
+        self.lat = np.zeros(capacity)
+        self.lng = np.zeros(capacity)
+        self.heading = np.zeros(capacity)
+        self.speed = np.zeros(capacity)
+        self.emergency = np.zeros(capacity, dtype=bool)
+        self.waiting = np.zeros(capacity, dtype=bool)
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, vehicle_id):
+        return vehicle_id in self.rows
+
+    def _grow(self):
+        capacity = len(self.lat) * 2
+        for name in ('lat', 'lng', 'heading', 'speed', 'emergency', 'waiting'):
+            old = getattr(self, name)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, name, new)
+
+    def sync(self, vehicle):
+        """Add or refresh the row of a vehicle after it changed outside the simulation"""
+        if vehicle.get('cam_source', False):
+            self.remove(vehicle['id'])
+            return
+        row = self.rows.get(vehicle['id'])
+        if row is None:
+            if self.size == len(self.lat):
+                self._grow()
+            row = self.size
+            self.size += 1
+            self.rows[vehicle['id']] = row
+            self.vehicles.append(vehicle)
+        self.vehicles[row] = vehicle
+        self.lat[row] = vehicle['position']['lat']
+        self.lng[row] = vehicle['position']['lng']
+        self.heading[row] = vehicle.get('heading') or 0
+        self.speed[row] = vehicle.get('speed') or 0
+        self.emergency[row] = bool(vehicle.get('emergency', False))
+        self.waiting[row] = bool(vehicle.get('waiting', False))
+
+    def remove(self, vehicle_id):
+        """Drop the row of a vehicle, moving the last row into its place"""
+        row = self.rows.pop(vehicle_id, None)
+        if row is None:
+            return
+        last = self.size - 1
+        if row != last:
+            moved = self.vehicles[last]
+            self.vehicles[row] = moved
+            self.rows[moved['id']] = row
+            for column in (self.lat, self.lng, self.heading, self.speed, self.emergency, self.waiting):
+                column[row] = column[last]
+        self.vehicles.pop()
+        self.size = last
+
+    def step(self, dt, traffic_lights):
+        """
+        Move the fleet by dt seconds and write the new state back to the vehicle
+        dicts. Returns the vehicles whose position or waiting flag changed.
+        """
+        n = self.size
+        if n == 0:
+            return []
+        lat, lng, heading = self.lat[:n], self.lng[:n], self.heading[:n]
+        red = {light['direction'] for light in traffic_lights if light['state'] == 'RED'}
+
+        # Squared distances to the center, without a square root or haversine per vehicle
+        distance2 = self.projection.distance2(lat, lng)
+        at_stop_line = (distance2 < STOP_RADIUS ** 2) & (distance2 >= CLEAR_RADIUS ** 2)
+
+        waiting = np.zeros(n, dtype=bool)
+        for approach_heading, direction, _, _ in APPROACHES:
+            if direction in red:
+                waiting |= heading == approach_heading
+        waiting &= at_stop_line & ~self.emergency[:n]
+
+        step = DEGREES_PER_SECOND * self.speed[:n] * dt
+        new_lat, new_lng = lat.copy(), lng.copy()
+        center_lat, center_lng = self.center['lat'], self.center['lng']
+        for approach_heading, _, axis, sign in APPROACHES:
+            moving = (heading == approach_heading) & ~waiting
+            if not moving.any():
+                continue
+            # Drive along one axis and keep to the right lane on the other
+            if axis == 'lat':
+                along, center_along = new_lat, center_lat
+                new_lng[moving] = center_lng + sign * LANE_OFFSET
+            else:
+                along, center_along = new_lng, center_lng
+                new_lat[moving] = center_lat - sign * LANE_OFFSET
+            along[moving] += sign * step[moving]
+            # Past the far edge: back to the near one
+            wrapped = moving & (sign * (along - center_along) > EDGE)
+            along[wrapped] = center_along - sign * EDGE
+
+        changed = np.flatnonzero((new_lat != lat) | (new_lng != lng) | (waiting != self.waiting[:n]))
+        lat[:] = new_lat
+        lng[:] = new_lng
+        self.waiting[:n] = waiting
+
+        # Write back only the changed rows; tolist() avoids a NumPy scalar per field
+        vehicles = self.vehicles
+        changed_vehicles = []
+        for row, row_lat, row_lng, row_waiting in zip(changed.tolist(), new_lat[changed].tolist(),
+                                                      new_lng[changed].tolist(), waiting[changed].tolist()):
+            vehicle = vehicles[row]
+            vehicle['position']['lat'] = row_lat
+            vehicle['position']['lng'] = row_lng
+            vehicle['waiting'] = row_waiting
+            changed_vehicles.append(vehicle)
+        return changed_vehicles
@@ -0,0 +1,98 @@
+"""
+Batched MQTT ingestion for the dashboard.
+
+The MQTT callback only puts the raw (topic, payload) on a SimpleQueue, so
+paho's network thread keeps up with the broker however busy the dashboard is.
+One worker thread drains the queue in batches, decodes the JSON outside the
+state lock and applies the whole batch to the state store in a single write.
+"""
+import json
+import logging
+import queue
+import threading
+import time
+
+BATCH_SIZE = 500     # messages applied under one state write
+BATCH_WAIT = 0.02    # seconds to wait for more messages once the first arrived
+
+logger = logging.getLogger("ingestion")
+
+class IngestionPipeline:
+    """Queue of raw MQTT messages applied to a StateStore by one worker thread"""
+
+    def __init__(self, store, apply, batch_size=BATCH_SIZE, batch_wait=BATCH_WAIT):
+        self.store = store
+        self.apply = apply          # apply(topic, message, raw payload), called with the store write lock held
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.queue = queue.SimpleQueue()
+        self._stopping = threading.Event()
+        self._thread = None
+        self.counters = {"received": 0, "applied": 0, "invalid": 0, "errors": 0, "batches": 0, "max_batch": 0}
+
+    def submit(self, topic, payload):
+        """MQTT callback: hand the message to the worker without decoding it"""
+        self.queue.put((topic, payload))
+        self.counters["received"] += 1
+
+    def start(self):
+        if self._thread is None:
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name="ingestion", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _next_batch(self):
+        try:
+            batch = [self.queue.get(timeout=0.5)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.batch_wait
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+        return batch
+
+    def _decode(self, batch):
+        messages = []
+        for topic, payload in batch:
+            try:
+                messages.append((topic, json.loads(payload), payload))
+            except ValueError as e:
+                self.counters["invalid"] += 1
+                logger.error(f"Invalid JSON on {topic}: {e}")
+        return messages
+
+    def _run(self):
+        while not self._stopping.is_set():
+            batch = self._next_batch()
+            if not batch:
+                continue
+            messages = self._decode(batch)
+            with self.store.write():
+                for topic, message, payload in messages:
+                    try:
+                        self.apply(topic, message, payload)
+                        self.counters["applied"] += 1
+                    except Exception as e:
+                        self.counters["errors"] += 1
+                        logger.error(f"Error processing MQTT message on {topic}: {e}", exc_info=True)
+            self.counters["batches"] += 1
+            self.counters["max_batch"] = max(self.counters["max_batch"], len(batch))
+
+    def stats(self):
+        return dict(self.counters, pending=self.queue.qsize())
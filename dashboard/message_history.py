@@ -0,0 +1,61 @@
+"""
+Recent V2X messages received by the dashboard, per message type.
+
+Each type keeps its last N messages in a ring buffer (a deque with maxlen), as
+the raw JSON bytes received from MQTT, so adding a message never shifts the
+others and serving them never re-encodes them. Every message gets a sequence
+number, increasing across all types, and its arrival time; clients pass back
+the last sequence number they saw (or a time) to get only newer messages.
+"""
+import time
+from collections import deque
+
+DEFAULT_CAPACITY = 100
+
+class MessageHistory:
+    """Ring buffers of (seq, time, raw payload) per message type"""
+
+    def __init__(self, capacities, default_capacity=DEFAULT_CAPACITY):
+        self.default_capacity = default_capacity
+        self.buffers = {message_type: deque(maxlen=capacity) for message_type, capacity in capacities.items()}
+        self.seq = 0
+
+    def __contains__(self, message_type):
+        return message_type in self.buffers
+
+    def types(self):
+        return list(self.buffers)
+
+    def append(self, message_type, payload, timestamp=None):
+        """Store the raw JSON payload (bytes or str) of a message and return its sequence number"""
+        buffer = self.buffers.get(message_type)
+        if buffer is None:
+            buffer = self.buffers[message_type] = deque(maxlen=self.default_capacity)
+        if isinstance(payload, str):
+            payload = payload.encode()
+        self.seq += 1
+        buffer.append((self.seq, time.time() if timestamp is None else timestamp, payload))
+        return self.seq
+
+    def entries(self, message_type, since=None, since_time=None):
+        """(seq, time, payload) of the messages of one type after seq since and time since_time, oldest first"""
+        newer = []
+        # Walk back from the newest entry, so the cost is the number of new messages
+        for entry in reversed(self.buffers.get(message_type, ())):
+            if (since is not None and entry[0] <= since) or (since_time is not None and entry[1] <= since_time):
+                break
+            newer.append(entry)
+        newer.reverse()
+        return newer
+
+    def to_json(self, message_types=None, since=None, since_time=None):
+        """
+        {"<type>": [payload, ...], ..., "seq": latest sequence number} as JSON text,
+        with the stored payloads copied in as they are
+        """
+        parts = []
+        for message_type in (message_types or self.buffers):
+            payloads = b",".join(entry[2] for entry in self.entries(message_type, since, since_time))
+            parts.append(b'"%s": [%s]' % (message_type.encode(), payloads))
+        parts.append(b'"seq": %d' % self.seq)
+        return b"{" + b", ".join(parts) + b"}"
@@ -0,0 +1,120 @@
+"""
+Server-sent events for the dashboard.
+
+Every change a writer reports with StateStore.emit() is queued for each
+connected client. Pending changes are keyed by entity (vehicle, traffic light,
+RSU, emergency state), so a client that is slower than the updates only gets
+the latest state of each entity. Received messages are all delivered. Each
+client gets at most one "delta" frame per interval, with the entities
+serialized when the frame is sent, under the store read lock:
+
+    event: delta
+    data: {"version": 42, "events": [{"type": "vehicle", "vehicle": {...}}, ...]}
+
+A client that falls more than max_pending changes behind gets a "resync" event
+instead and should fetch /api/traffic again.
+"""
+import json
+import threading
+import time
+
+from dashboard.state_store import event_key
+
+DEFAULT_INTERVAL = 0.1  # seconds between frames to one client
+MIN_INTERVAL = 0.05     # fastest rate a client may ask for
+HEARTBEAT = 15.0        # seconds of silence before a keepalive comment
+MAX_PENDING = 2000      # changes queued for one client before it must resync
+
+class Subscriber:
+    """Changes waiting to be sent to one client"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.pending = {}           # entity key -> latest event
+        self.version = 0
+        self.overflow = False
+        self.ready = threading.Event()
+        self._sequence = 0
+
+    def add(self, version, event, key):
+        if self.overflow:
+            return
+        if key is None:
+            self._sequence += 1
+            key = ('message', self._sequence)
+        else:
+            # Move a replaced entity to the back so events stay in order of their last change
+            self.pending.pop(key, None)
+        self.pending[key] = event
+        self.version = version
+        if len(self.pending) > MAX_PENDING:
+            self.overflow = True
+            self.pending.clear()
+        self.ready.set()
+
+    def take(self):
+        events, overflow = list(self.pending.values()), self.overflow
+        self.pending.clear()
+        self.overflow = False
+        self.ready.clear()
+        return events, self.version, overflow
+
+class PushHub:
+    """Fans the events of a StateStore out to rate-limited SSE streams"""
+
+    def __init__(self, store):
+        self.store = store
+        self.subscribers = set()
+        self.lock = threading.Lock()
+        self.counters = {"events": 0, "frames": 0, "resyncs": 0}
+        store.add_listener(self.on_event)
+
+    def on_event(self, version, event):
+        """StateStore listener, called by writers with the store write lock held"""
+        key = event_key(event)
+        with self.lock:
+            self.counters["events"] += 1
+            for subscriber in self.subscribers:
+                subscriber.add(version, event, key)
+
+    def subscribe(self, interval=DEFAULT_INTERVAL):
+        subscriber = Subscriber(max(MIN_INTERVAL, interval))
+        with self.lock:
+            subscriber.version = self.store.version
+            self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers.discard(subscriber)
+
+    def stream(self, subscriber):
+        """SSE text of a subscriber's changes, until the client goes away"""
+        try:
+            yield f"retry: 2000\nevent: hello\ndata: {json.dumps({'version': subscriber.version})}\n\n"
+            last_frame = 0
+            while True:
+                if not subscriber.ready.wait(HEARTBEAT):
+                    yield ": keepalive\n\n"
+                    continue
+                # Rate limit: changes arriving meanwhile are merged into the next frame
+                delay = last_frame + subscriber.interval - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                with self.lock:
+                    events, version, overflow = subscriber.take()
+                last_frame = time.monotonic()
+                if overflow:
+                    self.counters["resyncs"] += 1
+                    yield f"event: resync\ndata: {json.dumps({'version': version})}\n\n"
+                    continue
+                with self.store.read():
+                    data = json.dumps({'version': version, 'events': events})
+                self.counters["frames"] += 1
+                yield f"event: delta\ndata: {data}\n\n"
+        finally:
+            self.unsubscribe(subscriber)
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, clients=len(self.subscribers))
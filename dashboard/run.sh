@@ -1,7 +1,8 @@
 #!/bin/bash
 
 # This script is used to run the dashboard application backend.
-gnome-terminal -- bash -c "python3 server.py; exec bash"
+# The server is run as a module from the repository root, so it can import common/
+gnome-terminal -- bash -c "cd .. && python3 -m dashboard.server; exec bash"
 
 # Wait 10 seconds.
 sleep 5
@@ -1,12 +1,19 @@
 from flask import Flask, jsonify, request, render_template, send_from_directory
 from flask_cors import CORS
 import time
-import json
-import math
-import threading
 import logging
-import requests
-import paho.mqtt.client as mqtt
+import threading
+
+from common.geometry import projection_for
+from common.mqtt_transport import shared_transport
+from dashboard.denm_dispatcher import DenmDispatcher
+from dashboard.fleet import SimulatedFleet
+from dashboard.ingestion import IngestionPipeline
+from dashboard.message_history import MessageHistory
+from dashboard.push import DEFAULT_INTERVAL, PushHub
+from dashboard.simulation_engine import SimulationEngine
+from dashboard.state_store import StateStore
+from dashboard.vehicle_registry import VehicleRegistry
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -17,15 +24,21 @@ CORS(app)
 
 INTERSECTION_RADIUS = 15  # meters
 LANE_WIDTH = 2.0 # meters
-
-vanetza_messages = {
-    'cam': [],
-    'denm': [],
-    'spatem': [],
-    'mapem': [],
-    'cpm': [],
-    'vam': []
+VEHICLE_TTL = 10.0  # seconds without a CAM before a CAM-sourced vehicle is removed
+SWEEP_INTERVAL = 0.5  # seconds between checks for expired vehicles
+SIMULATION_INTERVAL = 0.1  # seconds between simulation ticks
+DENM_URL = "http://localhost:3000/api/denm"
+
+# Last messages kept per type for /api/vanetza_messages
+MESSAGE_HISTORY = {
+    'cam': 100,
+    'denm': 100,
+    'spatem': 100,
+    'mapem': 10,
+    'cpm': 100,
+    'vam': 100
 }
+message_history = MessageHistory(MESSAGE_HISTORY)
 
 last_spatem_update = 0
 
@@ -34,104 +47,68 @@ rsu_position = {
     'lng': -8.6585
 }
 
+# Docker network broker first, the local one as fallback
+MQTT_BROKERS = ["192.168.98.10", "127.0.0.1"]
+MQTT_PORT = 1883
+MQTT_TOPICS = [
+    "vanetza/out/cam",      # To receive OBU CAM messages
+    "vanetza/time/spatem",  # To receive RSU SPATEM messages, for the semaphore state
+    "vanetza/time/cam",     # If needed, to receive RSU CAM messages
+]
+
 def setup_mqtt_client():
-    client = mqtt.Client(client_id=f"rsu_server_1")
-    
-    def on_connect(client, userdata, flags, rc):
-        logger.info("Connected to MQTT broker with result code " + str(rc))
-        # Subscribe to all Vanetza topics
-        client.subscribe("vanetza/out/cam") # To receive OBU CAM messages
-        client.subscribe("vanetza/time/spatem") # To receive RSU SPATEM messages, for the semaphore state
-        client.subscribe("vanetza/time/cam") # If needed, to receive RSU CAM messages
-
-    def on_message(client, userdata, msg):
-        try:
-            topic = msg.topic
-            payload = json.loads(msg.payload.decode())
-            
-            if topic == "vanetza/time/spatem":
-                logger.info(f"Received SPATEM message on {topic}")
-                print(f"SPATEM MESSAGE: {json.dumps(payload, indent=2)}")
-                if 'spatem' in vanetza_messages:
-                    vanetza_messages['spatem'].append(payload)
-                    if len(vanetza_messages['spatem']) > 100:
-                        vanetza_messages['spatem'].pop(0)
-                handle_spatem_message(payload)
-                
-            elif topic == "vanetza/time/cam":
-                logger.info(f"Received CAM message on {topic}")
-                logger.info(f"CAM message type: {payload.get('stationType')}")
-                # Check for emergency vehicle (ambulance)
-                if payload.get("stationType") == 10:
-                    logger.info("Processing emergency CAM message from ambulance")
-                    handle_ambulance_cam(payload)
-                elif payload.get("stationType") == 15:  # RSU station type
-                    logger.info(f"Processing RSU CAM: {json.dumps(payload, indent=2)}")
-                    handle_rsu_cam_message(payload)
-                elif payload.get("stationType") == 5:  # Regular vehicle
-                    logger.info("Processing regular vehicle CAM message")
-                    handle_cam_message(payload)
-                else:
-                    logger.info("Processing regular CAM message")
-                    handle_cam_message(payload)
-            
-            # Handle input CAM messages specifically
-            elif topic == "vanetza/out/cam":
-                logger.info(f"Received CAM message on {topic}")
-                station_type = payload.get("stationType", 0)
-                if station_type == 10:  # Emergency vehicle (ambulance)
-                    logger.info("Processing emergency CAM message from ambulance")
-                    handle_ambulance_cam(payload)
-                elif station_type == 5:  # Normal vehicle
-                    logger.info("Processing normal vehicle CAM message")
-                    handle_cam_message(payload)
-                else:
-                    handle_cam_message(payload)
-                
-            # Continue handling output messages as before
-            elif "out" in topic:
-                message_type = topic.split('/')[-1]
-                if message_type in vanetza_messages:
-                    max_msgs = 100
-                    vanetza_messages[message_type].append(payload)
-                    if len(vanetza_messages[message_type]) > max_msgs:
-                        vanetza_messages[message_type].pop(0)
-                    logger.info(f"Received output {message_type} message")
-                    
-        except Exception as e:
-            logger.error(f"Error processing MQTT message: {str(e)}")
-            logger.error(f"Message payload: {msg.payload.decode()}")
-    
-    client.on_connect = on_connect
-    client.on_message = on_message
-    
-    try:
-        logger.info("Trying to connect to MQTT broker at 192.168.98.10...")
-        client.connect("192.168.98.10", 1883, 60)
+    # The transport connects on its own thread, falls back between the brokers
+    # and resubscribes after every reconnect. Messages only get queued on the
+    # network thread; the ingestion worker decodes and applies them.
+    transport = shared_transport("rsu_server_1", MQTT_BROKERS, MQTT_PORT)
+    for topic in MQTT_TOPICS:
+        transport.subscribe(topic, ingestion.submit)
+    transport.start()
+    logger.info(f"MQTT client started, brokers: {', '.join(MQTT_BROKERS)}")
+    return transport
+
+def apply_message(topic, payload, raw_payload):
+    """Apply one decoded MQTT message to the dashboard state; runs on the ingestion worker"""
+    if topic == "vanetza/time/spatem":
+        logger.debug(f"SPATEM message: {payload}")
+        emit_message('spatem', message_history.append('spatem', raw_payload), payload)
+        handle_spatem_message(payload)
         
-        mqtt_thread = threading.Thread(target=client.loop_forever)
-        mqtt_thread.daemon = True
-        mqtt_thread.start()
-        logger.info("MQTT client started successfully using Docker network")
-    except Exception as e:
-        logger.error(f"Failed to connect to Docker MQTT broker: {str(e)}")
-        try:
-            logger.info("Trying to connect to local MQTT broker...")
-            client.connect("127.0.0.1", 1883, 60)
-            
-            mqtt_thread = threading.Thread(target=client.loop_forever)
-            mqtt_thread.daemon = True
-            mqtt_thread.start()
-            logger.info("MQTT client started successfully with local connection")
-        except Exception as e2:
-            logger.error(f"Failed to connect to any MQTT broker: {str(e2)}")
+    elif topic == "vanetza/time/cam":
+        logger.debug(f"Received CAM message on {topic}, station type {payload.get('stationType')}")
+        # Check for emergency vehicle (ambulance)
+        if payload.get("stationType") == 10:
+            handle_ambulance_cam(payload)
+        elif payload.get("stationType") == 15:  # RSU station type
+            handle_rsu_cam_message(payload)
+        elif payload.get("stationType") == 5:  # Regular vehicle
+            handle_cam_message(payload)
+        else:
+            handle_cam_message(payload)
+    
+    # Handle input CAM messages specifically
+    elif topic == "vanetza/out/cam":
+        logger.debug(f"Received CAM message on {topic}")
+        station_type = payload.get("stationType", 0)
+        if station_type == 10:  # Emergency vehicle (ambulance)
+            handle_ambulance_cam(payload)
+        elif station_type == 5:  # Normal vehicle
+            handle_cam_message(payload)
+        else:
+            handle_cam_message(payload)
+        
+    # Continue handling output messages as before
+    elif "out" in topic:
+        message_type = topic.split('/')[-1]
+        if message_type in message_history:
+            emit_message(message_type, message_history.append(message_type, raw_payload), payload)
+            logger.debug(f"Received output {message_type} message")
 
 def handle_spatem_message(spatem_payload):
     """Process incoming SPATEM messages and update traffic light states"""
     try:
         global last_spatem_update
-        logger.info("Processing SPATEM message to update traffic lights")
-        logger.info(f"SPATEM keys: {list(spatem_payload.keys())}")
+        logger.debug(f"Processing SPATEM message, keys: {list(spatem_payload.keys())}")
         
         last_spatem_update = int(time.time())
 
@@ -178,7 +155,8 @@ def handle_spatem_message(spatem_payload):
                                 if light['direction'] == direction:
                                     light['state'] = color
                                     light['countdown'] = sts.get("timing", {}).get("minEndTime", 30) % 100
-                                    logger.info(f"Updated traffic light {light['id']} to {color}")
+                                    emit_traffic_light(light)
+                                    logger.debug(f"Updated traffic light {light['id']} to {color}")
                                     break
     
     except Exception as e:
@@ -207,7 +185,7 @@ def handle_rsu_cam_message(cam_payload):
                 # Update the RSU position
                 rsu_position['lat'] = latitude
                 rsu_position['lng'] = longitude
-                logger.info(f"Updated RSU position: ID={station_id}, lat={latitude}, lng={longitude}")
+                logger.debug(f"Updated RSU position: ID={station_id}, lat={latitude}, lng={longitude}")
                 
                 # Add RSU to traffic_data if not already present
                 rsu = next((item for item in traffic_data.get('rsu_nodes', []) if item['id'] == f'rsu_{station_id}'), None)
@@ -218,11 +196,13 @@ def handle_rsu_cam_message(cam_payload):
                     if 'rsu_nodes' not in traffic_data:
                         traffic_data['rsu_nodes'] = []
                         
-                    traffic_data['rsu_nodes'].append({
+                    rsu = {
                         'id': f'rsu_{station_id}',
                         'type': 'rsu',
                         'position': {'lat': latitude, 'lng': longitude},
-                    })
+                    }
+                    traffic_data['rsu_nodes'].append(rsu)
+                store.emit({'type': 'rsu', 'rsu': rsu})
     
     except Exception as e:
         logger.error(f"Error processing RSU CAM message: {str(e)}", exc_info=True)
@@ -241,19 +221,22 @@ def handle_ambulance_cam(cam_message):
             logger.warning("Ambulance CAM message missing coordinates")
             return
         
-        # Try to update an existing ambulance vehicle
-        vehicle = next((v for v in traffic_data['vehicles']
-                        if v.get('station_id') == station_id and v.get('type') == 'ambulance'), None)
+        # Try to update the vehicle of this station, which is an ambulance from now on
+        vehicles = traffic_data['vehicles']
+        vehicle = vehicles.by_station(station_id)
         
         if vehicle:
             vehicle['position'] = {'lat': latitude, 'lng': longitude}
             vehicle['heading'] = heading
             vehicle['speed'] = speed
-            vehicle['emergency'] = True
-            logger.info(f"Updated ambulance vehicle: ID={station_id}")
+            if vehicle.get('type') != 'ambulance' or not vehicle.get('emergency', False):
+                vehicles.update(vehicle, type='ambulance', emergency=True)
+            vehicles.touch(vehicle, time.time())
+            emit_vehicle(vehicle)
+            logger.debug(f"Updated ambulance vehicle: ID={station_id}")
         else:
             new_vehicle = {
-                'id': f'v_ambulance_{len(traffic_data["vehicles"]) + 1}',
+                'id': vehicles.new_id('v_ambulance_'),
                 'station_id': station_id,
                 'type': 'ambulance',
                 'position': {'lat': latitude, 'lng': longitude},
@@ -262,7 +245,9 @@ def handle_ambulance_cam(cam_message):
                 'emergency': True,
                 'waiting': False
             }
-            traffic_data['vehicles'].append(new_vehicle)
+            vehicles.add(new_vehicle)
+            vehicles.touch(new_vehicle, time.time())
+            emit_vehicle(new_vehicle)
             logger.info(f"Added new ambulance vehicle: ID={station_id}")
     except Exception as e:
         logger.error(f"Error handling ambulance CAM message: {str(e)}", exc_info=True)
@@ -274,8 +259,7 @@ def handle_cam_message(cam_message):
         station_id = str(cam_message.get("stationID", "unknown"))
         
         # Log the full message for debugging
-        logger.info(f"Processing CAM message: {station_id}")
-        logger.debug(f"CAM message content: {cam_message}")
+        logger.debug(f"Processing CAM message: {station_id}: {cam_message}")
         
         # Extract GPS coordinates from CAM message
         latitude = cam_message.get("latitude")
@@ -299,7 +283,8 @@ def handle_cam_message(cam_message):
         else:
             speed = 50  # Default value
 
-        vehicle = next((v for v in traffic_data['vehicles'] if v.get('station_id') == station_id), None)
+        vehicles = traffic_data['vehicles']
+        vehicle = vehicles.by_station(station_id)
         
         if vehicle:
             # Update existing vehicle
@@ -311,11 +296,13 @@ def handle_cam_message(cam_message):
                 vehicle['heading'] = heading
             if speed is not None:
                 vehicle['speed'] = speed
+            vehicles.touch(vehicle, time.time())
+            emit_vehicle(vehicle)
                 
-            logger.info(f"Updated vehicle position: ID={station_id}, lat={latitude}, lng={longitude}")
+            logger.debug(f"Updated vehicle position: ID={station_id}, lat={latitude}, lng={longitude}")
         else:
             new_vehicle = {
-                'id': f'v_cam_{len(traffic_data["vehicles"]) + 1}',
+                'id': vehicles.new_id('v_cam_'),
                 'station_id': station_id,
                 'type': 'car',  # Default type
                 'position': {'lat': latitude, 'lng': longitude},
@@ -329,49 +316,18 @@ def handle_cam_message(cam_message):
             if vehicle_type == 10:
                 new_vehicle['type'] = 'ambulance'
                 
-            # Add vehicle to the list
-            traffic_data['vehicles'].append(new_vehicle)
+            # Add vehicle to the registry
+            vehicles.add(new_vehicle)
+            vehicles.touch(new_vehicle, time.time())
+            emit_vehicle(new_vehicle)
             logger.info(f"Added new vehicle from CAM: ID={station_id}, lat={latitude}, lng={longitude}")
             
     except Exception as e:
         logger.error(f"Error handling CAM message: {str(e)}", exc_info=True)
 
-# Convert GPS coordinates to meters
-def gps_to_meters(lat1, lon1, lat2, lon2):
-    R = 6371000
-    phi1 = math.radians(lat1)
-    phi2 = math.radians(lat2)
-    delta_phi = math.radians(lat2 - lat1)
-    delta_lambda = math.radians(lon2 - lon1)
-    
-    a = (math.sin(delta_phi/2) * math.sin(delta_phi/2) + 
-         math.cos(phi1) * math.cos(phi2) * 
-         math.sin(delta_lambda/2) * math.sin(delta_lambda/2))
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
-    
-    return R * c
-
 def local_to_gps(x, y, center_lat, center_lng):
-    R = 6371000
-    
-    # Calculate latitude change
-    lat_change = (y / R) * (180 / math.pi)
-    # Calculate longitude change (accounting for latitude)
-    lng_change = (x / R) * (180 / math.pi) / math.cos(math.radians(center_lat))
-    
-    return {
-        'lat': center_lat + lat_change,
-        'lng': center_lng + lng_change
-    }
-
-def gps_to_local(lat, lng, center_lat, center_lng):
-    R = 6371000
-    # Calculate x (longitude) change
-    x = math.cos(math.radians(center_lat)) * R * math.radians(lng - center_lng)
-    # Calculate y (latitude) change 
-    y = R * math.radians(lat - center_lat)
-    
-    return (x, y)
+    lat, lng = projection_for({'lat': center_lat, 'lng': center_lng}).to_gps(x, y)
+    return {'lat': lat, 'lng': lng}
 
 # Traffic light states
 traffic_data = {
@@ -408,7 +364,9 @@ traffic_data = {
             'countdown': 20
         }
     ],
-    'vehicles': [
+    # Vehicle dicts by id and station id, sent to the frontend as a list (see traffic_json).
+    # Vehicles known from CAMs are removed VEHICLE_TTL seconds after their last CAM.
+    'vehicles': VehicleRegistry(ttl=VEHICLE_TTL, vehicles=[
         # {
         #     'id': 'v_1',
         #     'type': 'car',
@@ -427,12 +385,17 @@ traffic_data = {
         #     'denm_sent': False,
         #     'waiting': False
         # }
-    ],
+    ]),
     'rsu_nodes': [],
     'emergency_mode': False,
     'emergency_vehicle': None
 }
 
+# Kinematics of the vehicles not driven by CAMs, as arrays (see fleet.py)
+fleet = SimulatedFleet(traffic_data['center'])
+for vehicle in traffic_data['vehicles']:
+    fleet.sync(vehicle)
+
 # Road network model
 road_network = {
     'intersection': {
@@ -467,6 +430,122 @@ road_network = {
     }
 }
 
+# === Push Events ===
+# Changes reported to the SSE clients (see push.py); entities are serialized when sent
+
+def emit_vehicle(vehicle):
+    # Every change to a vehicle is reported here, which keeps the simulated fleet in step
+    fleet.sync(vehicle)
+    store.emit({'type': 'vehicle', 'vehicle': vehicle})
+
+def emit_traffic_light(light):
+    store.emit({'type': 'traffic_light', 'light': light})
+
+def emit_emergency():
+    store.emit({'type': 'emergency', 'emergency_mode': traffic_data['emergency_mode'],
+                'emergency_vehicle': traffic_data['emergency_vehicle']})
+
+def emit_message(message_type, seq, message):
+    store.emit({'type': 'message', 'message_type': message_type, 'seq': seq, 'message': message})
+
+def copy_entity(entity):
+    """Copy of a vehicle, traffic light or RSU dict, with its own position dict"""
+    if 'position' in entity:
+        return dict(entity, position=dict(entity['position']))
+    return dict(entity)
+
+def freeze_traffic(data):
+    """
+    Copy of traffic_data for a store snapshot, called by the writer after each new
+    version: vehicles, traffic lights and RSU nodes by id, nothing shared with the
+    dicts the writers keep changing
+    """
+    vehicles = {vehicle['id']: copy_entity(vehicle) for vehicle in data['vehicles']}
+    emergency_vehicle = data['emergency_vehicle']
+    if emergency_vehicle is not None:
+        emergency_vehicle = vehicles.get(emergency_vehicle['id']) or copy_entity(emergency_vehicle)
+    return dict(
+        data,
+        center=dict(data['center']),
+        vehicles=vehicles,
+        traffic_lights={light['id']: copy_entity(light) for light in data['traffic_lights']},
+        rsu_nodes={rsu['id']: copy_entity(rsu) for rsu in data.get('rsu_nodes', [])},
+        emergency_vehicle=emergency_vehicle,
+    )
+
+def traffic_json(snapshot):
+    """The traffic state of a snapshot as the JSON the frontend expects"""
+    state = snapshot.state
+    return dict(state,
+                vehicles=list(state['vehicles'].values()),
+                traffic_lights=list(state['traffic_lights'].values()),
+                rsu_nodes=list(state['rsu_nodes'].values()),
+                version=snapshot.version, full=True)
+
+def traffic_delta(snapshot, since, changes):
+    """
+    The entities changed after version since, from snapshot.changes_since():
+    current vehicles, traffic lights and RSU nodes, the ids of removed
+    vehicles, and the emergency state
+    """
+    state = snapshot.state
+    delta = {
+        'version': snapshot.version,
+        'since': since,
+        'full': False,
+        'timestamp': state['timestamp'],
+        'vehicles': [],
+        'removed_vehicles': [],
+        'traffic_lights': [],
+        'rsu_nodes': [],
+        'emergency_mode': state['emergency_mode'],
+        'emergency_vehicle': state['emergency_vehicle'],
+    }
+    for key in changes:
+        if key[0] == 'vehicle':
+            vehicle = state['vehicles'].get(key[1])
+            if vehicle is None:
+                delta['removed_vehicles'].append(key[1])
+            else:
+                delta['vehicles'].append(vehicle)
+        elif key[0] == 'traffic_light' and key[1] in state['traffic_lights']:
+            delta['traffic_lights'].append(state['traffic_lights'][key[1]])
+        elif key[0] == 'rsu' and key[1] in state['rsu_nodes']:
+            delta['rsu_nodes'].append(state['rsu_nodes'][key[1]])
+    return delta
+
+# MQTT updates are applied by the ingestion worker in batches under the store
+# lock; request handlers that change the state take the same lock, those that
+# only read use the snapshot the writers publish
+store = StateStore(traffic_data, freeze=freeze_traffic)
+ingestion = IngestionPipeline(store, apply_message)
+push_hub = PushHub(store)
+
+def sweep_expired_vehicles(now=None):
+    """Remove the vehicles whose CAMs stopped and report each removal as an event"""
+    if now is None:
+        now = time.time()
+    with store.write():
+        for vehicle in traffic_data['vehicles'].expire(now):
+            if traffic_data['emergency_vehicle'] is vehicle:
+                traffic_data['emergency_mode'] = False
+                traffic_data['emergency_vehicle'] = None
+                emit_emergency()
+            fleet.remove(vehicle['id'])
+            end_denm_event(vehicle['id'])
+            store.emit({'type': 'vehicle_removed', 'id': vehicle['id'],
+                        'station_id': vehicle['station_id'], 'reason': 'expired'})
+            logger.info(f"Removed vehicle {vehicle['id']} (station {vehicle['station_id']}), "
+                        f"no CAM for {now - vehicle['last_seen']:.1f} s")
+
+def run_sweeper():
+    while True:
+        time.sleep(SWEEP_INTERVAL)
+        # Only take the state lock when a deadline is due
+        deadline = traffic_data['vehicles'].next_deadline()
+        if deadline is not None and deadline <= time.time():
+            sweep_expired_vehicles()
+
 # Normal traffic light cycle
 def update_normal_traffic_lights(current_time):
     cycle = (current_time // 30) % 2
@@ -523,16 +602,9 @@ def handle_emergency_vehicle():
 
 # Determine if a vehicle is close to the intersection
 def is_vehicle_near_intersection(vehicle, center, radius=50):
-    vehicle_pos = vehicle['position']
-    center_pos = center
-    
-    # Calculate distance between vehicle and intersection center
-    distance = gps_to_meters(
-        vehicle_pos['lat'], vehicle_pos['lng'],
-        center_pos['lat'], center_pos['lng']
-    )
-    
-    return distance < radius
+    # Squared distance in the cached local projection of the intersection
+    position = vehicle['position']
+    return projection_for(center).within(position['lat'], position['lng'], radius)
 
 # Get the traffic light for a given direction
 def get_traffic_light(direction):
@@ -542,99 +614,145 @@ def get_traffic_light(direction):
     return None
 
 # Send DENM message (simulate communication with vanetza)
+# DENMs are posted by background workers, so neither the simulation nor a
+# request handler ever waits on the network
+denm_dispatcher = DenmDispatcher(DENM_URL)
+denm_sequence_numbers = {}  # vehicle id -> sequenceNumber of its latest emergency event
+denm_events = set()         # vehicle ids with an emergency event still going on
+
+def denm_event_sequence(vehicle_id):
+    """sequenceNumber of the vehicle's ongoing emergency event; the first DENM starts a new event"""
+    with store.lock:
+        if vehicle_id not in denm_events:
+            denm_sequence_numbers[vehicle_id] = denm_sequence_numbers.get(vehicle_id, 0) + 1
+            denm_events.add(vehicle_id)
+        return denm_sequence_numbers[vehicle_id]
+
+def end_denm_event(vehicle_id):
+    """The vehicle's emergency event is over, its next DENM starts a new one. Call with the store lock held."""
+    denm_events.discard(vehicle_id)
+
 def send_denm_message(vehicle):
-    try:
-        # Prepare DENM message
-        denm_message = {
-            "management": {
-                "actionID": {
-                    "originatingStationID": vehicle['id'],
-                    "sequenceNumber": 1
-                },
-                "detectionTime": int(time.time()),
-                "referenceTime": int(time.time()),
-                "eventPosition": {
-                    "latitude": vehicle['position']['lat'] * 10000000,
-                    "longitude": vehicle['position']['lng'] * 10000000
-                }
+    """Queue the DENM of an emergency vehicle approaching; False if it was not queued"""
+    # Repeated DENMs of one event keep its actionID, so the dispatcher sends it once
+    sequence_number = denm_event_sequence(vehicle['id'])
+    denm_message = {
+        "management": {
+            "actionID": {
+                "originatingStationID": vehicle['id'],
+                "sequenceNumber": sequence_number
             },
-            "situation": {
-                "eventType": {
-                    "causeCode": 6,  # Emergency vehicle approaching
-                    "subCauseCode": 1
-                }
-            },
-            "location": {
-                "eventPosition": {
-                    "latitude": vehicle['position']['lat'] * 10000000,
-                    "longitude": vehicle['position']['lng'] * 10000000
-                },
-                "eventPositionHeading": vehicle['heading']
+            "detectionTime": int(time.time()),
+            "referenceTime": int(time.time()),
+            "eventPosition": {
+                "latitude": vehicle['position']['lat'] * 10000000,
+                "longitude": vehicle['position']['lng'] * 10000000
             }
+        },
+        "situation": {
+            "eventType": {
+                "causeCode": 6,  # Emergency vehicle approaching
+                "subCauseCode": 1
+            }
+        },
+        "location": {
+            "eventPosition": {
+                "latitude": vehicle['position']['lat'] * 10000000,
+                "longitude": vehicle['position']['lng'] * 10000000
+            },
+            "eventPositionHeading": vehicle['heading']
         }
-        
-        # Log the DENM message
-        logger.info(f"Sending DENM message for vehicle {vehicle['id']}")
-        
-        response = requests.post(
-            "http://localhost:3000/api/denm", 
-            json=denm_message, 
-            headers={"Content-Type": "application/json"}
-        )
-        
-        logger.info(f"DENM response: {response.status_code}")
-        return True
-    except Exception as e:
-        logger.error(f"Error sending DENM message: {str(e)}")
-        return False
+    }
+    
+    logger.info(f"Sending DENM message for vehicle {vehicle['id']}")
+    return denm_dispatcher.submit(denm_message)
 
 @app.route('/')
 def serve():
     return send_from_directory(app.static_folder, 'index.html')
 
-@app.route('/api/traffic', methods=['GET'])
-def get_traffic_data():
-    # Simulate movement and state changes
-    current_time = int(time.time())
-    traffic_data['timestamp'] = current_time
+def simulation_step(now, dt):
+    """
+    One tick of the simulation engine, with the store write lock held: emergency
+    detection, preemption of the traffic lights and movement of the simulated
+    vehicles. Returns the DENMs to queue once the lock is released.
+    """
+    denm_vehicles = []
+    traffic_data['timestamp'] = int(now)
+    emergency_before = (traffic_data['emergency_mode'], traffic_data['emergency_vehicle'])
     
     # Check if any emergency vehicles with emergency mode are near the intersection
-    for vehicle in traffic_data['vehicles']:
-        if 'station_id' not in vehicle:
-            vehicle['station_id'] = vehicle['id']
-        if vehicle['type'] == 'ambulance' and vehicle.get('emergency', False):
-            # Check if vehicle is approaching intersection and DENM hasn't been sent
-            if is_vehicle_near_intersection(vehicle, traffic_data['center'], 80) and not vehicle.get('denm_sent', False):
-                # Send DENM message when approaching intersection
-                vehicle['denm_sent'] = True
-                send_denm_message(vehicle)
-                
-            # If very close to intersection, activate emergency mode
-            if is_vehicle_near_intersection(vehicle, traffic_data['center']):
-                if not traffic_data['emergency_mode']:
-                    logger.info(f"Emergency vehicle {vehicle['id']} detected near intersection")
-                traffic_data['emergency_mode'] = True
-                traffic_data['emergency_vehicle'] = vehicle
-                break
+    for vehicle in traffic_data['vehicles'].emergency('ambulance'):
+        # Check if vehicle is approaching intersection and DENM hasn't been sent
+        if is_vehicle_near_intersection(vehicle, traffic_data['center'], 80) and not vehicle.get('denm_sent', False):
+            # Send DENM message when approaching intersection, once the state lock is released
+            vehicle['denm_sent'] = True
+            denm_vehicles.append(dict(vehicle, position=dict(vehicle['position'])))
+            
+        # If very close to intersection, activate emergency mode
+        if is_vehicle_near_intersection(vehicle, traffic_data['center']):
+            if not traffic_data['emergency_mode']:
+                logger.info(f"Emergency vehicle {vehicle['id']} detected near intersection")
+            traffic_data['emergency_mode'] = True
+            traffic_data['emergency_vehicle'] = vehicle
+            break
     else:
         # No emergency vehicles found, reset to normal mode
         if traffic_data['emergency_mode']:
             logger.info("No emergency vehicles near intersection, returning to normal mode")
-            # Reset DENM sent flag for all emergency vehicles
-            for vehicle in traffic_data['vehicles']:
-                if vehicle['type'] == 'ambulance':
-                    vehicle['denm_sent'] = False
+            # Reset DENM sent flag for all emergency vehicles, their next approach is a new event
+            for vehicle in traffic_data['vehicles'].of_type('ambulance'):
+                vehicle['denm_sent'] = False
+                end_denm_event(vehicle['id'])
                     
         traffic_data['emergency_mode'] = False
         traffic_data['emergency_vehicle'] = None
     
+    if (traffic_data['emergency_mode'], traffic_data['emergency_vehicle']) != emergency_before:
+        emit_emergency()
+    
     # Update traffic lights
     if traffic_data['emergency_mode']:
         handle_emergency_vehicle()
+        for light in traffic_data['traffic_lights']:
+            emit_traffic_light(light)
     
-    update_vehicle_positions()
-    
-    return jsonify(traffic_data)
+    # The fleet already has the new positions, so skip the fleet.sync() of emit_vehicle()
+    for vehicle in update_vehicle_positions(dt):
+        store.emit({'type': 'vehicle', 'vehicle': vehicle})
+
+    # Queued for the DENM dispatcher, which posts them back to this server
+    return [lambda vehicle=vehicle: send_denm_message(vehicle) for vehicle in denm_vehicles]
+
+# Ticks at a fixed rate, however many dashboards poll /api/traffic
+simulation = SimulationEngine(store, simulation_step, SIMULATION_INTERVAL)
+
+@app.route('/api/traffic', methods=['GET'])
+def get_traffic_data():
+    """
+    The traffic state, as kept up to date by the simulation engine and MQTT
+    ingestion. With ?since=<version>, only what changed after that version,
+    when the changelog still has it.
+    """
+    since = request.args.get('since', type=int)
+    # The latest published snapshot; the simulation and ingestion writers never wait for us
+    snapshot = store.current
+    changes = snapshot.changes_since(since) if since is not None else None
+    if changes is not None:
+        return jsonify(traffic_delta(snapshot, since, changes))
+    body = snapshot.encode(traffic_json)
+    return app.response_class(body, mimetype='application/json')
+
+@app.route('/api/stream', methods=['GET'])
+def stream_updates():
+    """
+    Server-sent events with the changes of the traffic state as they are
+    applied, at most one frame per ?interval= seconds (default 0.1)
+    """
+    interval = request.args.get('interval', DEFAULT_INTERVAL, type=float)
+    subscriber = push_hub.subscribe(interval)
+    return app.response_class(push_hub.stream(subscriber), mimetype='text/event-stream',
+                              headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @app.route('/api/emergency', methods=['POST'])
 def trigger_emergency():
@@ -642,18 +760,21 @@ def trigger_emergency():
     vehicle_id = data.get('vehicle_id')
     action = data.get('action', 'activate')
     
-    vehicle = next((v for v in traffic_data['vehicles'] if v['id'] == vehicle_id), None)
-    if not vehicle:
-        return jsonify({'status': 'error', 'message': f'Vehicle {vehicle_id} not found'}), 404
+    with store.write():
+        vehicle = traffic_data['vehicles'].get(vehicle_id)
+        if not vehicle:
+            return jsonify({'status': 'error', 'message': f'Vehicle {vehicle_id} not found'}), 404
     
-    if action == 'activate':
-        vehicle['emergency'] = True
-        message = f'Emergency mode activated for vehicle {vehicle_id}'
-    else:
-        vehicle['emergency'] = False
-        message = f'Emergency mode deactivated for vehicle {vehicle_id}'
+        if action == 'activate':
+            traffic_data['vehicles'].update(vehicle, emergency=True)
+            message = f'Emergency mode activated for vehicle {vehicle_id}'
+        else:
+            traffic_data['vehicles'].update(vehicle, emergency=False)
+            end_denm_event(vehicle_id)
+            message = f'Emergency mode deactivated for vehicle {vehicle_id}'
+        emit_vehicle(vehicle)
     
-    return jsonify({'status': 'success', 'message': message})
+        return jsonify({'status': 'success', 'message': message})
 
 @app.route('/api/denm', methods=['POST'])
 def receive_denm():
@@ -664,58 +785,62 @@ def receive_denm():
         data = request.get_json()
         logger.info(f"Received DENM message: {data}")
         
-        # Check if this is an emergency vehicle DENM
-        if 'management' in data and 'actionID' in data['management']:
-            action_id = data['management']['actionID']
+        with store.write():
+            # Check if this is an emergency vehicle DENM
+            if 'management' in data and 'actionID' in data['management']:
+                action_id = data['management']['actionID']
             
-            # Extract vehicle ID from actionID if available
-            vehicle_id = action_id.get('originatingStationID', None)
+                # Extract vehicle ID from actionID if available
+                vehicle_id = action_id.get('originatingStationID', None)
             
-            # Check if there's an emergency event
-            if 'situation' in data and 'eventType' in data['situation']:
-                event_type = data['situation']['eventType']
+                # Check if there's an emergency event
+                if 'situation' in data and 'eventType' in data['situation']:
+                    event_type = data['situation']['eventType']
                 
-                # Check for emergency vehicle approaching event
-                if (event_type.get('causeCode') == 6 and 
-                    event_type.get('subCauseCode') in [1, 2]):  # Emergency vehicle approaching
+                    # Check for emergency vehicle approaching event
+                    if (event_type.get('causeCode') == 6 and 
+                        event_type.get('subCauseCode') in [1, 2]):  # Emergency vehicle approaching
                     
-                    # Extract position if available
-                    if 'location' in data and 'eventPosition' in data['location']:
-                        position = data['location']['eventPosition']
-                        lat = position.get('latitude', 0) / 10000000  # Convert from decidegree
-                        lng = position.get('longitude', 0) / 10000000
+                        # Extract position if available
+                        if 'location' in data and 'eventPosition' in data['location']:
+                            position = data['location']['eventPosition']
+                            lat = position.get('latitude', 0) / 10000000  # Convert from decidegree
+                            lng = position.get('longitude', 0) / 10000000
                         
-                        # Find or create the emergency vehicle
-                        vehicle = next((v for v in traffic_data['vehicles'] if str(v['id']) == str(vehicle_id)), None)
+                            # Find or create the emergency vehicle
+                            vehicles = traffic_data['vehicles']
+                            vehicle = vehicles.get(str(vehicle_id))
                         
-                        if vehicle:
-                            # Update existing vehicle
-                            vehicle['position'] = {'lat': lat, 'lng': lng}
-                            vehicle['emergency'] = True
-                            vehicle['denm_sent'] = True
-                        else:
-                            # Create new emergency vehicle
-                            new_vehicle = {
-                                'id': f'v_{len(traffic_data["vehicles"]) + 1}',
-                                'vanetza_id': vehicle_id,
-                                'type': 'ambulance',
-                                'position': {'lat': lat, 'lng': lng},
-                                'heading': data['location'].get('eventPositionHeading', 0),
-                                'speed': 40,
-                                'emergency': True,
-                                'denm_sent': True
-                            }
-                            traffic_data['vehicles'].append(new_vehicle)
+                            if vehicle:
+                                # Update existing vehicle
+                                vehicle['position'] = {'lat': lat, 'lng': lng}
+                                vehicle['denm_sent'] = True
+                                vehicles.update(vehicle, emergency=True)
+                                emit_vehicle(vehicle)
+                            else:
+                                # Create new emergency vehicle
+                                new_vehicle = {
+                                    'id': vehicles.new_id('v_'),
+                                    'vanetza_id': vehicle_id,
+                                    'type': 'ambulance',
+                                    'position': {'lat': lat, 'lng': lng},
+                                    'heading': data['location'].get('eventPositionHeading', 0),
+                                    'speed': 40,
+                                    'emergency': True,
+                                    'denm_sent': True
+                                }
+                                vehicles.add(new_vehicle)
+                                emit_vehicle(new_vehicle)
                         
-                        return jsonify({
-                            'status': 'success', 
-                            'message': 'DENM processed, emergency vehicle detected'
-                        })
+                            return jsonify({
+                                'status': 'success', 
+                                'message': 'DENM processed, emergency vehicle detected'
+                            })
         
-        return jsonify({
-            'status': 'success', 
-            'message': 'DENM received but not an emergency vehicle notification'
-        })
+            return jsonify({
+                'status': 'success', 
+                'message': 'DENM received but not an emergency vehicle notification'
+            })
         
     except Exception as e:
         logger.error(f"Error processing DENM message: {str(e)}")
@@ -730,109 +855,36 @@ def change_vehicle_direction():
     if not vehicle_id or new_heading is None:
         return jsonify({'status': 'error', 'message': 'Missing vehicle_id or heading'}), 400
     
-    vehicle = next((v for v in traffic_data['vehicles'] if v['id'] == vehicle_id), None)
-    if not vehicle:
-        return jsonify({'status': 'error', 'message': f'Vehicle {vehicle_id} not found'}), 404
-    
-    # Update vehicle heading and adjust position for right side of road
-    vehicle['heading'] = new_heading
+    with store.write():
+        vehicle = traffic_data['vehicles'].get(vehicle_id)
+        if not vehicle:
+            return jsonify({'status': 'error', 'message': f'Vehicle {vehicle_id} not found'}), 404
     
-    # Reset position to be on the right side of the road
-    center = traffic_data['center']
-    offset = 0.0001
+        # Update vehicle heading and adjust position for right side of road
+        vehicle['heading'] = new_heading
     
-    if new_heading == 0:  # Northbound - right side is east
-        vehicle['position'] = {'lat': center['lat'] - 0.006, 'lng': center['lng'] + offset}
-    elif new_heading == 90:  # Eastbound - right side is south
-        vehicle['position'] = {'lat': center['lat'] - offset, 'lng': center['lng'] - 0.006}
-    elif new_heading == 180:  # Southbound - right side is west
-        vehicle['position'] = {'lat': center['lat'] + 0.006, 'lng': center['lng'] - offset}
-    elif new_heading == 270:  # Westbound - right side is north
-        vehicle['position'] = {'lat': center['lat'] + offset, 'lng': center['lng'] + 0.006}
+        # Reset position to be on the right side of the road
+        center = traffic_data['center']
+        offset = 0.0001
     
-    return jsonify({
-        'status': 'success', 
-        'message': f'Vehicle {vehicle_id} now heading {new_heading} degrees'
-    })
-
-def update_vehicle_positions():
-    """Update vehicle positions to move through the intersection"""
-    center = traffic_data['center']
+        if new_heading == 0:  # Northbound - right side is east
+            vehicle['position'] = {'lat': center['lat'] - 0.006, 'lng': center['lng'] + offset}
+        elif new_heading == 90:  # Eastbound - right side is south
+            vehicle['position'] = {'lat': center['lat'] - offset, 'lng': center['lng'] - 0.006}
+        elif new_heading == 180:  # Southbound - right side is west
+            vehicle['position'] = {'lat': center['lat'] + 0.006, 'lng': center['lng'] - offset}
+        elif new_heading == 270:  # Westbound - right side is north
+            vehicle['position'] = {'lat': center['lat'] + offset, 'lng': center['lng'] + 0.006}
+        emit_vehicle(vehicle)
     
-    for vehicle in traffic_data['vehicles']:
-        # Update position based on heading
-        if vehicle.get('cam_source', False):
-            # Don't update these vehicles' positions, they're controlled by CAM messages
-            continue
-        local_pos = gps_to_local(vehicle['position']['lat'], vehicle['position']['lng'], center['lat'], center['lng'])
-
-        heading = vehicle['heading']
-        
-        # Get the traffic light for this direction
-        direction_map = {0: 'NORTH', 90: 'EAST', 180: 'SOUTH', 270: 'WEST'}
-        direction = direction_map.get(heading)
-        light = get_traffic_light(direction)
-        
-        # Check if vehicle should stop at red light
-        if (light and light['state'] == 'RED' and not vehicle.get('emergency', False) and
-            is_vehicle_near_intersection(vehicle, center, 40) and
-            not is_vehicle_near_intersection(vehicle, center, 15)):
-            vehicle['waiting'] = True
-            continue
-        else:
-            vehicle['waiting'] = False
-            
-        if vehicle['waiting']:
-            continue
-            
-        # Calculate speed factor based on vehicle speed
-        speed_factor = 0.000065 * vehicle['speed'] / 30  # Scale factor for speed
-        
-        lane_offset = 0.0001
-        
-        if heading == 0:  # Northbound
-            # Move vehicle north
-            vehicle['position']['lat'] += speed_factor
-            
-            # Keep on right side (east side of north road)
-            vehicle['position']['lng'] = center['lng'] + lane_offset
-            
-            # If passed north edge, reset to south
-            if vehicle['position']['lat'] > center['lat'] + 0.008:
-                vehicle['position']['lat'] = center['lat'] - 0.008
-                
-        elif heading == 90:  # Eastbound
-            # Move vehicle east
-            vehicle['position']['lng'] += speed_factor
-            
-            # Keep on right side (south side of east road)
-            vehicle['position']['lat'] = center['lat'] - lane_offset
-            
-            # If passed east edge, reset to west
-            if vehicle['position']['lng'] > center['lng'] + 0.008:
-                vehicle['position']['lng'] = center['lng'] - 0.008
-                
-        elif heading == 180:  # Southbound
-            # Move vehicle south
-            vehicle['position']['lat'] -= speed_factor
-            
-            # Keep on right side (west side of south road)
-            vehicle['position']['lng'] = center['lng'] - lane_offset
-            
-            # If passed south edge, reset to north
-            if vehicle['position']['lat'] < center['lat'] - 0.008:
-                vehicle['position']['lat'] = center['lat'] + 0.008
-                
-        elif heading == 270:  # Westbound
-            # Move vehicle west
-            vehicle['position']['lng'] -= speed_factor
-            
-            # Keep on right side (north side of west road)
-            vehicle['position']['lat'] = center['lat'] + lane_offset
-            
-            # If passed west edge, reset to east
-            if vehicle['position']['lng'] < center['lng'] - 0.008:
-                vehicle['position']['lng'] = center['lng'] + 0.008
+        return jsonify({
+            'status': 'success', 
+            'message': f'Vehicle {vehicle_id} now heading {new_heading} degrees'
+        })
+
+def update_vehicle_positions(dt=1.0):
+    """Move the simulated vehicles through the intersection by dt seconds; returns those that changed"""
+    return fleet.step(dt, traffic_data['traffic_lights'])
 
 @app.route('/api/config', methods=['GET'])
 def get_config():
@@ -881,17 +933,27 @@ def get_road_network():
 
 @app.route('/api/vanetza_messages', methods=['GET'])
 def get_vanetza_messages():
+    """
+    Recent messages per type, with "seq", the latest sequence number. Pass it
+    back as ?since=<seq> to get only newer messages, or use ?since_ts=<unix time>.
+    """
     message_type = request.args.get('type', 'all')
+    since = request.args.get('since', type=int)
+    since_time = request.args.get('since_ts', type=float)
     
-    if message_type == 'all':
-        return jsonify(vanetza_messages)
-    elif message_type in vanetza_messages:
-        return jsonify({message_type: vanetza_messages[message_type]})
-    else:
+    if message_type != 'all' and message_type not in message_history:
         return jsonify({'error': f'Unknown message type: {message_type}'}), 400
+    
+    with store.read():
+        body = message_history.to_json(None if message_type == 'all' else [message_type], since, since_time)
+    return app.response_class(body, mimetype='application/json')
 
 
 if __name__ == '__main__':
     print("====================== RSU Server 1 ======================")
+    ingestion.start()
+    denm_dispatcher.start()
+    simulation.start()
+    threading.Thread(target=run_sweeper, name="vehicle sweeper", daemon=True).start()
     setup_mqtt_client()
     app.run(host='0.0.0.0', port=3000, debug=True)
\ No newline at end of file
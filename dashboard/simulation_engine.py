@@ -0,0 +1,72 @@
+"""
+Fixed-rate simulation loop for the dashboard.
+
+The engine calls step(now, dt) every interval seconds on its own thread, under
+the state store write lock, whatever the number of dashboards polling. dt is
+the time since the previous step, so simulated movement keeps its speed when a
+tick runs late. step() may return callables that need the lock released, such
+as posting a DENM back to the server; they run right after the step.
+"""
+import logging
+import threading
+import time
+
+TICK_INTERVAL = 0.1  # seconds
+
+logger = logging.getLogger("simulation")
+
+class SimulationEngine:
+    """Runs a simulation step at a fixed rate on a background thread"""
+
+    def __init__(self, store, step, interval=TICK_INTERVAL):
+        self.store = store
+        self.step = step
+        self.interval = interval
+        self._stopping = threading.Event()
+        self._thread = None
+        self.counters = {"ticks": 0, "overruns": 0, "max_tick_ms": 0.0}
+
+    def start(self):
+        if self._thread is None:
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name="simulation", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def tick(self, now, dt):
+        started = time.perf_counter()
+        with self.store.write():
+            after = self.step(now, dt) or []
+        for callback in after:
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"Error after simulation step: {e}", exc_info=True)
+        elapsed = (time.perf_counter() - started) * 1000
+        self.counters["ticks"] += 1
+        self.counters["max_tick_ms"] = max(self.counters["max_tick_ms"], elapsed)
+
+    def _run(self):
+        last = time.time()
+        next_tick = time.monotonic()
+        while not self._stopping.is_set():
+            now = time.time()
+            try:
+                self.tick(now, now - last)
+            except Exception as e:
+                logger.error(f"Simulation step failed: {e}", exc_info=True)
+            last = now
+            next_tick += self.interval
+            delay = next_tick - time.monotonic()
+            if delay < 0:
+                # Running behind: skip the missed ticks instead of bursting to catch up
+                self.counters["overruns"] += 1
+                next_tick = time.monotonic()
+                delay = 0
+            self._stopping.wait(delay)
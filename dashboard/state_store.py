@@ -0,0 +1,135 @@
+"""
+Versioned traffic state of the dashboard.
+
+All changes go through write(), which holds the store lock for one batch of
+changes. The MQTT ingestion worker is the writer for received messages and the
+simulation engine for simulated movement.
+
+Writers report changes that clients should hear about, such as a vehicle
+removed, with emit(event); listeners get (version, event), where version is
+the one the current write produces. A write that emitted events bumps the
+version once at the end; one that emitted none leaves it alone, so clients
+polling an idle dashboard keep their version. Events about an entity (a
+vehicle, traffic light, RSU or the emergency state) also go into a bounded
+changelog, so changes_since(version) tells which entities changed after a
+version a client already has, as long as the changelog reaches back that far.
+
+After each new version the writer publishes a Snapshot in store.current: a
+copy of the state made by freeze(data) and of the changelog. Snapshots are
+never changed afterwards, so request handlers read store.current without
+taking the lock the writers hold.
+"""
+import json
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+CHANGELOG_SIZE = 10000  # entity changes remembered for delta queries
+
+def event_key(event):
+    """Entity an event describes, None for events that are not about an entity"""
+    kind = event['type']
+    if kind == 'vehicle':
+        return ('vehicle', event['vehicle']['id'])
+    if kind == 'vehicle_removed':
+        return ('vehicle', event['id'])
+    if kind == 'traffic_light':
+        return ('traffic_light', event['light']['id'])
+    if kind == 'rsu':
+        return ('rsu', event['rsu']['id'])
+    if kind == 'emergency':
+        return ('emergency',)
+    return None
+
+def changes_in(changelog, forgotten_version, latest_version, version):
+    """entity key -> latest event after version, from (version, key, event) entries oldest first"""
+    if version < forgotten_version or version > latest_version:
+        return None
+    changes = {}
+    # Newest first, so the first event seen for an entity is its latest
+    for entry_version, key, event in reversed(changelog):
+        if entry_version <= version:
+            break
+        changes.setdefault(key, event)
+    return changes
+
+class Snapshot:
+    """The state at one version, as published by a writer. Never changed once published."""
+
+    def __init__(self, version, state, changelog, forgotten_version):
+        self.version = version
+        self.state = state
+        self.changelog = changelog    # tuple of (version, entity key, event)
+        self.forgotten_version = forgotten_version
+        self._encoded = None
+
+    def changes_since(self, version):
+        """As StateStore.changes_since(), for the entities changed up to this snapshot"""
+        return changes_in(self.changelog, self.forgotten_version, self.version, version)
+
+    def encode(self, build):
+        """JSON bytes of build(snapshot), encoded once per snapshot"""
+        # Two readers racing here both encode the same state, which is harmless
+        if self._encoded is None:
+            self._encoded = json.dumps(build(self)).encode()
+        return self._encoded
+
+class StateStore:
+    """A dict of dashboard state with a version that changes on every write that emits events"""
+
+    def __init__(self, data, freeze=dict, changelog_size=CHANGELOG_SIZE):
+        self.data = data
+        self.freeze = freeze
+        self.version = 0
+        self.lock = threading.RLock()
+        self.listeners = []
+        self.changelog = deque(maxlen=changelog_size)    # (version, entity key, event)
+        # Changes up to this version may have left the changelog
+        self.forgotten_version = 0
+        self._depth = 0
+        self._emitted = False
+        self.current = Snapshot(0, freeze(data), (), 0)
+
+    @contextmanager
+    def write(self):
+        """with store.write() as data: ... applies one batch of changes"""
+        with self.lock:
+            self._depth += 1
+            try:
+                yield self.data
+            finally:
+                self._depth -= 1
+            # A write nested in another one is part of the outer batch
+            if self._depth == 0 and self._emitted:
+                self._emitted = False
+                self.version += 1
+                self.current = Snapshot(self.version, self.freeze(self.data),
+                                        tuple(self.changelog), self.forgotten_version)
+
+    def add_listener(self, callback):
+        """Call callback(version, event) for every event emitted by a writer"""
+        self.listeners.append(callback)
+
+    def emit(self, event):
+        """Report a change of the current write; call with the write lock held"""
+        version = self.version + 1
+        self._emitted = True
+        key = event_key(event)
+        if key is not None:
+            if len(self.changelog) == self.changelog.maxlen:
+                self.forgotten_version = self.changelog[0][0]
+            self.changelog.append((version, key, event))
+        for listener in self.listeners:
+            listener(version, event)
+
+    def changes_since(self, version):
+        """
+        entity key -> latest event, for the entities changed after version; None
+        when the changelog no longer reaches back to it. Call with the lock held.
+        """
+        return changes_in(self.changelog, self.forgotten_version, self.version, version)
+
+    @contextmanager
+    def read(self):
+        with self.lock:
+            yield self.data
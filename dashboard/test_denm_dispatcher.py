@@ -0,0 +1,105 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from dashboard.denm_dispatcher import DenmDispatcher
+
+def denm(station_id, sequence_number):
+    return {'management': {'actionID': {'originatingStationID': station_id, 'sequenceNumber': sequence_number}}}
+
+@pytest.fixture
+def endpoint():
+    """Local DENM endpoint; set endpoint.delay to answer slowly"""
+    received = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers['Content-Length']))
+            time.sleep(server.delay)
+            received.append(json.loads(body))
+            self.send_response(200)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.delay = 0.0
+    server.received = received
+    server.url = f'http://127.0.0.1:{server.server_address[1]}/api/denm'
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+def test_duplicate_action_id_is_submitted_once(endpoint):
+    dispatcher = DenmDispatcher(endpoint.url).start()
+    try:
+        assert dispatcher.submit(denm('v1', 1))
+        assert not dispatcher.submit(denm('v1', 1))
+        assert dispatcher.submit(denm('v1', 2))
+        assert dispatcher.submit(denm('v2', 1))
+        assert wait_for(lambda: dispatcher.stats()['sent'] == 3)
+    finally:
+        dispatcher.stop()
+    actions = sorted((d['management']['actionID']['originatingStationID'],
+                      d['management']['actionID']['sequenceNumber']) for d in endpoint.received)
+    assert actions == [('v1', 1), ('v1', 2), ('v2', 1)]
+    assert dispatcher.stats()['duplicates'] == 1
+
+def test_action_id_is_forgotten_after_the_window(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr('dashboard.denm_dispatcher.time.monotonic', lambda: now[0])
+    dispatcher = DenmDispatcher('http://127.0.0.1:9/api/denm', dedup_window=60.0)
+    assert dispatcher.submit(denm('v1', 1))
+    now[0] += 30.0
+    assert not dispatcher.submit(denm('v1', 1))
+    now[0] += 31.0
+    assert dispatcher.submit(denm('v1', 1))
+
+def test_full_queue_drops_without_blocking():
+    dispatcher = DenmDispatcher('http://127.0.0.1:9/api/denm', max_queued=2)
+    assert dispatcher.submit(denm('v1', 1)) and dispatcher.submit(denm('v2', 1))
+    assert not dispatcher.submit(denm('v3', 1))
+    assert dispatcher.stats()['dropped'] == 1
+    # A dropped DENM was never sent, so it may be submitted again
+    dispatcher.queue.get_nowait()
+    assert dispatcher.submit(denm('v3', 1))
+
+def test_slow_endpoint_times_out(endpoint):
+    endpoint.delay = 1.0
+    dispatcher = DenmDispatcher(endpoint.url, workers=1, timeout=0.2, retries=1, retry_backoff=0.05).start()
+    try:
+        started = time.monotonic()
+        assert dispatcher.submit(denm('v1', 1))
+        # submit() never waits for the endpoint
+        assert time.monotonic() - started < 0.1
+        assert wait_for(lambda: dispatcher.stats()['failed'] == 1, timeout=3.0)
+        assert time.monotonic() - started < 1.0
+        stats = dispatcher.stats()
+        assert stats['retries'] == 1 and stats['sent'] == 0
+    finally:
+        dispatcher.stop()
+
+def test_unreachable_endpoint_gives_up():
+    dispatcher = DenmDispatcher('http://127.0.0.1:9/api/denm', workers=1, timeout=0.2,
+                                retries=2, retry_backoff=0.01).start()
+    try:
+        dispatcher.submit(denm('v1', 1))
+        assert wait_for(lambda: dispatcher.stats()['failed'] == 1)
+        assert dispatcher.stats()['retries'] == 2
+    finally:
+        dispatcher.stop()
@@ -0,0 +1,39 @@
+import json
+
+from dashboard.message_history import MessageHistory
+
+def filled_history():
+    history = MessageHistory({'cam': 3, 'denm': 2})
+    for i in range(5):
+        history.append('cam', json.dumps({'n': i}), timestamp=100.0 + i)
+    history.append('denm', b'{"d": 1}', timestamp=106.0)
+    return history
+
+def test_ring_buffer_keeps_last_messages_per_type():
+    history = filled_history()
+    assert [seq for seq, _, _ in history.entries('cam')] == [3, 4, 5]
+    assert [payload for _, _, payload in history.entries('denm')] == [b'{"d": 1}']
+    assert history.seq == 6
+
+def test_unknown_type_gets_default_capacity():
+    history = MessageHistory({}, default_capacity=2)
+    for i in range(3):
+        history.append('vam', b'{}')
+    assert 'vam' in history and history.types() == ['vam']
+    assert [seq for seq, _, _ in history.entries('vam')] == [2, 3]
+    assert history.entries('cpm') == []
+
+def test_entries_since_sequence_and_time():
+    history = filled_history()
+    assert [seq for seq, _, _ in history.entries('cam', since=4)] == [5]
+    assert history.entries('cam', since=6) == []
+    assert [seq for seq, _, _ in history.entries('cam', since_time=102.5)] == [4, 5]
+    # Both limits apply
+    assert [seq for seq, _, _ in history.entries('cam', since=4, since_time=102.5)] == [5]
+
+def test_to_json():
+    history = filled_history()
+    data = json.loads(history.to_json())
+    assert data == {'cam': [{'n': 2}, {'n': 3}, {'n': 4}], 'denm': [{'d': 1}], 'seq': 6}
+    assert json.loads(history.to_json(['cam'], since=4)) == {'cam': [{'n': 4}], 'seq': 6}
+    assert json.loads(history.to_json(['denm'], since=6)) == {'denm': [], 'seq': 6}
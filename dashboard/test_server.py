@@ -0,0 +1,33 @@
+import pytest
+
+from dashboard import server
+from dashboard.denm_dispatcher import DenmDispatcher, action_id
+
+@pytest.fixture
+def dispatcher(monkeypatch):
+    # Not started, so submitted DENMs stay queued
+    dispatcher = DenmDispatcher("http://127.0.0.1:9/api/denm")
+    monkeypatch.setattr(server, "denm_dispatcher", dispatcher)
+    return dispatcher
+
+def ambulance(vehicle_id):
+    return {'id': vehicle_id, 'type': 'ambulance', 'position': {'lat': 40.6335, 'lng': -8.6585}, 'heading': 180}
+
+def queued_action_ids(dispatcher):
+    return [action_id(dispatcher.queue.get_nowait()) for _ in range(dispatcher.queue.qsize())]
+
+def test_repeated_trigger_of_one_approach_is_submitted_once(dispatcher):
+    vehicle = ambulance('v_test_repeat')
+    assert server.send_denm_message(vehicle)
+    assert not server.send_denm_message(dict(vehicle, position={'lat': 40.6333, 'lng': -8.6585}))
+    assert dispatcher.stats()['submitted'] == 1
+    assert dispatcher.stats()['duplicates'] == 1
+    assert queued_action_ids(dispatcher) == [('v_test_repeat', 1)]
+
+def test_new_approach_is_a_new_event(dispatcher):
+    vehicle = ambulance('v_test_new_event')
+    assert server.send_denm_message(vehicle)
+    with server.store.write():
+        server.end_denm_event(vehicle['id'])
+    assert server.send_denm_message(vehicle)
+    assert queued_action_ids(dispatcher) == [('v_test_new_event', 1), ('v_test_new_event', 2)]
@@ -0,0 +1,89 @@
+import threading
+
+from dashboard.state_store import StateStore
+
+def vehicle_event(vehicle_id, lat):
+    return {'type': 'vehicle', 'vehicle': {'id': vehicle_id, 'position': {'lat': lat}}}
+
+def test_version_bumps_only_when_events_are_emitted():
+    store = StateStore({'timestamp': 0})
+    with store.write() as data:
+        data['timestamp'] = 1
+    assert store.version == 0
+    with store.write():
+        store.emit(vehicle_event('v1', 1.0))
+        store.emit(vehicle_event('v2', 2.0))
+    assert store.version == 1
+    # A write nested in another one is part of the same batch
+    with store.write():
+        with store.write():
+            store.emit(vehicle_event('v1', 1.5))
+        store.emit(vehicle_event('v2', 2.5))
+    assert store.version == 2
+
+def test_changes_since():
+    store = StateStore({})
+    with store.write():
+        store.emit(vehicle_event('v1', 1.0))
+        store.emit({'type': 'traffic_light', 'light': {'id': 'tl_1', 'state': 'RED'}})
+    with store.write():
+        store.emit(vehicle_event('v1', 2.0))
+        store.emit({'type': 'vehicle_removed', 'id': 'v2'})
+        store.emit({'type': 'message', 'message_type': 'cam', 'seq': 1, 'message': {}})
+    with store.read():
+        assert store.changes_since(2) == {}
+        changes = store.changes_since(1)
+        assert set(changes) == {('vehicle', 'v1'), ('vehicle', 'v2')}
+        assert changes[('vehicle', 'v1')]['vehicle']['position']['lat'] == 2.0
+        assert set(store.changes_since(0)) == {('vehicle', 'v1'), ('vehicle', 'v2'), ('traffic_light', 'tl_1')}
+        # A version the store has not reached yet
+        assert store.changes_since(3) is None
+    assert store.current.changes_since(1) == changes
+
+def test_changes_since_beyond_changelog():
+    store = StateStore({}, changelog_size=2)
+    for i in range(3):
+        with store.write():
+            store.emit(vehicle_event(f'v{i}', float(i)))
+    assert store.changes_since(0) is None
+    assert set(store.changes_since(1)) == {('vehicle', 'v1'), ('vehicle', 'v2')}
+    assert store.current.changes_since(0) is None
+
+def test_snapshot_is_not_changed_by_later_writes():
+    store = StateStore({'vehicles': {}}, freeze=lambda data: {'vehicles': dict(data['vehicles'])})
+    with store.write() as data:
+        data['vehicles']['v1'] = 1
+        store.emit(vehicle_event('v1', 1.0))
+    snapshot = store.current
+    with store.write() as data:
+        data['vehicles']['v2'] = 2
+        store.emit(vehicle_event('v2', 2.0))
+    assert snapshot.version == 1 and snapshot.state == {'vehicles': {'v1': 1}}
+    assert snapshot.changes_since(0) == {('vehicle', 'v1'): vehicle_event('v1', 1.0)}
+    assert store.current.version == 2 and store.current.state == {'vehicles': {'v1': 1, 'v2': 2}}
+
+def test_snapshot_encoded_once():
+    store = StateStore({'timestamp': 0})
+    builds = []
+    def build(snapshot):
+        builds.append(snapshot.version)
+        return dict(snapshot.state, version=snapshot.version)
+    assert store.current.encode(build) == store.current.encode(build) == b'{"timestamp": 0, "version": 0}'
+    assert builds == [0]
+
+def test_current_is_readable_while_a_writer_holds_the_lock():
+    store = StateStore({})
+    writing, release = threading.Event(), threading.Event()
+    def writer():
+        with store.write():
+            store.emit(vehicle_event('v1', 1.0))
+            writing.set()
+            release.wait(5)
+    thread = threading.Thread(target=writer)
+    thread.start()
+    writing.wait(5)
+    # The write in progress is not visible until it ends
+    assert store.current.version == 0
+    release.set()
+    thread.join(5)
+    assert store.current.version == 1
@@ -0,0 +1,144 @@
+"""
+Vehicles shown on the dashboard, indexed for constant-time lookups.
+
+The registry replaces the list in traffic_data['vehicles']: vehicles are the
+same dicts the frontend receives, kept in insertion order, and to_list() gives
+the JSON list. Lookups by dashboard id and by station id, and the sets of
+vehicles by type and with the emergency flag, are dict lookups instead of a
+scan over every vehicle. Changes to the indexed fields (station_id, type,
+emergency) must go through update() so the indexes stay in step.
+
+Vehicles that report themselves (CAMs) are touch()ed with the time they were
+last seen. With a ttl, expire() removes those not seen for ttl seconds. Each
+tracked vehicle has one deadline in a heap, moved forward only when it comes
+due, so an expire() call costs the deadlines due rather than a scan of the
+fleet and a touch() is a dict lookup.
+"""
+import heapq
+
+class VehicleRegistry:
+    """Vehicle dicts by dashboard id, with indexes by station id, type and emergency flag"""
+
+    def __init__(self, vehicles=(), ttl=None):
+        self.ttl = ttl              # seconds a touched vehicle lives without being seen again
+        self._vehicles = {}         # dashboard id -> vehicle
+        self._by_station = {}       # station id -> vehicle
+        self._by_type = {}          # type -> {dashboard id: vehicle}
+        self._emergency = {}        # dashboard id -> vehicle with the emergency flag set
+        self._expiry = []           # heap of (deadline, dashboard id), one per touched vehicle
+        self._deadlines = {}        # dashboard id -> its deadline in the heap
+        self._next_number = 1
+        for vehicle in vehicles:
+            self.add(vehicle)
+
+    def __len__(self):
+        return len(self._vehicles)
+
+    def __iter__(self):
+        return iter(list(self._vehicles.values()))
+
+    def __contains__(self, vehicle_id):
+        return vehicle_id in self._vehicles
+
+    def new_id(self, prefix):
+        """A dashboard id that was never used, e.g. new_id("v_cam_") -> "v_cam_4" """
+        while f"{prefix}{self._next_number}" in self._vehicles:
+            self._next_number += 1
+        vehicle_id = f"{prefix}{self._next_number}"
+        self._next_number += 1
+        return vehicle_id
+
+    # === Lookups ===
+
+    def get(self, vehicle_id):
+        return self._vehicles.get(vehicle_id)
+
+    def by_station(self, station_id):
+        return self._by_station.get(str(station_id))
+
+    def of_type(self, vehicle_type):
+        return list(self._by_type.get(vehicle_type, {}).values())
+
+    def emergency(self, vehicle_type=None):
+        """Vehicles with the emergency flag, optionally only of one type"""
+        if vehicle_type is None:
+            return list(self._emergency.values())
+        of_type = self._by_type.get(vehicle_type, {})
+        return [vehicle for vehicle_id, vehicle in self._emergency.items() if vehicle_id in of_type]
+
+    # === Changes ===
+
+    def add(self, vehicle):
+        """Register a vehicle dict; without a station id it is known by its dashboard id"""
+        vehicle.setdefault('station_id', vehicle['id'])
+        self._vehicles[vehicle['id']] = vehicle
+        self._index(vehicle)
+        return vehicle
+
+    def update(self, vehicle, **fields):
+        """Set fields of a registered vehicle, keeping the indexes in step"""
+        self._unindex(vehicle)
+        vehicle.update(fields)
+        self._index(vehicle)
+        return vehicle
+
+    def remove(self, vehicle_id):
+        vehicle = self._vehicles.pop(vehicle_id, None)
+        if vehicle is not None:
+            self._unindex(vehicle)
+            self._deadlines.pop(vehicle_id, None)
+        return vehicle
+
+    # === Expiry ===
+
+    def touch(self, vehicle, now):
+        """Record that a registered vehicle was seen at time now"""
+        vehicle['last_seen'] = now
+        vehicle_id = vehicle['id']
+        if self.ttl is not None and vehicle_id not in self._deadlines:
+            deadline = now + self.ttl
+            self._deadlines[vehicle_id] = deadline
+            heapq.heappush(self._expiry, (deadline, vehicle_id))
+
+    def next_deadline(self):
+        """Earliest time expire() may remove a vehicle, None if no vehicle is tracked"""
+        return self._expiry[0][0] if self._expiry else None
+
+    def expire(self, now):
+        """Remove and return the vehicles not seen for ttl seconds"""
+        removed = []
+        while self._expiry and self._expiry[0][0] <= now:
+            deadline, vehicle_id = heapq.heappop(self._expiry)
+            if self._deadlines.get(vehicle_id) != deadline:
+                continue            # removed since it was scheduled
+            deadline = self._vehicles[vehicle_id]['last_seen'] + self.ttl
+            if deadline > now:
+                # Seen since it was scheduled: wait for its new deadline
+                self._deadlines[vehicle_id] = deadline
+                heapq.heappush(self._expiry, (deadline, vehicle_id))
+            else:
+                removed.append(self.remove(vehicle_id))
+        return removed
+
+    def _index(self, vehicle):
+        vehicle_id = vehicle['id']
+        self._by_station[str(vehicle['station_id'])] = vehicle
+        self._by_type.setdefault(vehicle.get('type'), {})[vehicle_id] = vehicle
+        if vehicle.get('emergency', False):
+            self._emergency[vehicle_id] = vehicle
+
+    def _unindex(self, vehicle):
+        vehicle_id = vehicle['id']
+        station_id = str(vehicle['station_id'])
+        if self._by_station.get(station_id) is vehicle:
+            del self._by_station[station_id]
+        of_type = self._by_type.get(vehicle.get('type'))
+        if of_type is not None:
+            of_type.pop(vehicle_id, None)
+            if not of_type:
+                del self._by_type[vehicle.get('type')]
+        self._emergency.pop(vehicle_id, None)
+
+    def to_list(self):
+        """The vehicles as the JSON list the frontend expects"""
+        return list(self._vehicles.values())
@@ -0,0 +1,323 @@
+"""
+Many simulated OBUs in one process, for load-testing the RSU and the dashboard.
+
+obu_normal.py and obu_ambulance.py each drive one vehicle with their own MQTT
+client. This script drives every vehicle of a scenario file (see
+scenario.json) from one asyncio event loop and one MQTT connection:
+
+- Each group of the scenario gives a number of vehicles of one station type,
+  their CAM template, lanes and speed, and for emergency vehicles the DENM
+  template.
+- The vehicles live in NumPy arrays, one row per vehicle. Every step moves
+  them all at once along their approach (the lanes 1-4 of the single OBUs),
+  holds them at the stop line while their light is red, and sends them back
+  to the start of their lane once they leave the map.
+- Each vehicle sends its CAM every cam_interval seconds, with phases spread so
+  the CAMs do not all go out in the same step. An emergency vehicle sends a
+  DENM once per approach, when it gets within denm_distance of the center.
+- Light states come from the SPATEMs the RSU publishes on spatem_topics. Until
+  the first SPATEM arrives, every light counts as green.
+
+By default the messages go straight to the topics the RSU and the dashboard
+read (vanetza/out/...), and the SPATEMs are read straight from the topics the
+RSU writes (vanetza/in/spatem, vanetza/time/spatem), bypassing the Vanetza
+containers.
+
+    python3 -m fleet_obu.obu_fleet                     # scenario.json next to this script
+    python3 -m fleet_obu.obu_fleet my_scenario.json --duration 60
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+import numpy as np
+
+from common.geometry import INTERSECTION_CENTER, projection_for
+from common.mqtt_transport import shared_transport
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s: %(message)s')
+
+# === Configuration ===
+SCENARIO_FILE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "scenario.json")
+STEP = 0.1               # seconds between simulation steps
+CAM_MAX_AGE = 1.0        # seconds a CAM may wait for the broker before it is dropped as stale
+STATS_INTERVAL = 10.0    # seconds between statistics lines
+START_DISTANCE = {1: 300, 2: 500, 3: 300, 4: 500}  # meters from the center where each lane starts
+STOP_LINE = 25           # meters from the center where vehicles wait at a red light
+LANE_OFFSET = 3.0        # meters from the road axis to the right lane
+DENM_DISTANCE = 100      # meters from the center where emergency vehicles send their DENM
+# Periodic and emergency SPATEMs, as the RSU publishes them
+SPATEM_TOPICS = ["vanetza/in/spatem", "vanetza/time/spatem"]
+
+# Lane -> heading, as in the single OBUs: lane 1 starts north and drives south, ...
+LANE_HEADING = {1: 180, 2: 270, 3: 0, 4: 90}
+SIGNAL_GROUP_HEADING = {1: 0, 3: 90, 5: 180, 7: 270}
+HEADINGS = [0, 90, 180, 270]
+
+def load_json(filepath):
+    with open(filepath, "r") as file:
+        return json.load(file)
+
+# === Messages ===
+
+class CamEncoder:
+    """
+    CAM payloads of one template. The fields that are the same for every CAM are
+    encoded once; each CAM only formats the per-vehicle fields in front of them.
+    """
+    VARIABLE = ("stationID", "stationType", "latitude", "longitude", "heading", "speed", "generationDeltaTime")
+
+    def __init__(self, template):
+        constant = {k: v for k, v in template.items() if k not in self.VARIABLE}
+        encoded = json.dumps(constant)[1:-1]
+        self.constant = ", " + encoded if encoded else ""
+
+    def encode(self, station_id, station_type, lat, lng, heading, speed, now):
+        return (f'{{"stationID": {station_id}, "stationType": {station_type}, '
+                f'"latitude": {lat:.7f}, "longitude": {lng:.7f}, "heading": {heading}, '
+                f'"speed": {speed:.2f}, "generationDeltaTime": {int(now * 1000) % 65536}'
+                f'{self.constant}}}')
+
+def build_denm(template, station_id, sequence_number, lat, lng, station_type, now):
+    """A DENM for an emergency vehicle approaching, from the parsed template"""
+    management = dict(template.get("management", {}),
+                      actionID={"originatingStationID": station_id, "sequenceNumber": sequence_number},
+                      detectionTime=now, referenceTime=now, stationType=station_type)
+    management["eventPosition"] = dict(management.get("eventPosition", {}), latitude=lat, longitude=lng)
+    situation = dict(template.get("situation", {}), eventType={"causeCode": 6, "subCauseCode": 0})
+    return json.dumps(dict(template, management=management, situation=situation))
+
+def light_states(spatem):
+    """
+    {heading: "GREEN"/"RED"} from a SPATEM, either as the RSU publishes it or
+    wrapped in "fields"/"spat" as Vanetza delivers it to the single OBUs
+    """
+    if "fields" in spatem and "spat" in spatem["fields"]:
+        spatem = spatem["fields"]["spat"]
+    states = {}
+    for intersection in spatem.get("intersections", []):
+        for state in intersection.get("states", []):
+            heading = SIGNAL_GROUP_HEADING.get(state.get("signalGroup"))
+            if heading is not None and state.get("state-time-speed"):
+                states[heading] = "GREEN" if state["state-time-speed"][0].get("eventState") == 5 else "RED"
+    return states
+
+# === Fleet ===
+
+class VehicleFleet:
+    """The vehicles of a scenario as arrays, one row per vehicle"""
+
+    def __init__(self, scenario, base_dir, now):
+        self.projection = projection_for(scenario.get("center", INTERSECTION_CENTER))
+        rng = np.random.default_rng(scenario.get("seed"))
+        self.groups = []
+        columns = {name: [] for name in ("station_id", "group", "lane", "speed", "cam_interval", "emergency", "denm_distance")}
+        station_id = scenario.get("first_station_id", 1000)
+        for index, group in enumerate(scenario["groups"]):
+            lanes = group.get("lanes", [1, 2, 3, 4])
+            self.groups.append({
+                "name": group.get("name", f"group {index}"),
+                "station_type": group.get("station_type", 5),
+                "cam": CamEncoder(load_json(os.path.join(base_dir, group["template"]))),
+                "denm": load_json(os.path.join(base_dir, group["denm_template"])) if group.get("denm_template") else None,
+            })
+            for i in range(group["count"]):
+                columns["station_id"].append(station_id)
+                station_id += 1
+                columns["group"].append(index)
+                columns["lane"].append(lanes[i % len(lanes)])
+                columns["speed"].append(group.get("speed", 12.5))
+                columns["cam_interval"].append(group.get("cam_interval", 0.4))
+                columns["emergency"].append(bool(group.get("emergency", False)))
+                columns["denm_distance"].append(group.get("denm_distance", DENM_DISTANCE))
+        self.station_id = np.array(columns["station_id"], dtype=np.int64)
+        self.group = np.array(columns["group"], dtype=np.int64)
+        self.lane = np.array(columns["lane"], dtype=np.int64)
+        self.speed = np.array(columns["speed"], dtype=np.float64) * rng.uniform(0.9, 1.1, len(self.lane))
+        self.cam_interval = np.array(columns["cam_interval"], dtype=np.float64)
+        self.emergency = np.array(columns["emergency"], dtype=bool)
+        self.denm_distance = np.array(columns["denm_distance"], dtype=np.float64)
+        self.heading = np.array([LANE_HEADING[lane] for lane in self.lane], dtype=np.int64)
+        self.start = np.array([START_DISTANCE[lane] for lane in self.lane], dtype=np.float64)
+        # Signed distance to the center along the lane: positive while approaching
+        self.distance = rng.uniform(-self.start, self.start)
+        self.waiting = np.zeros(len(self.lane), dtype=bool)
+        self.denm_sent = self.distance < self.denm_distance
+        self.denm_sequence = np.zeros(len(self.lane), dtype=np.int64)
+        # Spread the CAMs of each vehicle over its interval
+        self.next_cam = now + rng.uniform(0, self.cam_interval)
+        # Direction of travel and to the right lane, per vehicle
+        radians = np.radians(self.heading)
+        self.forward = np.stack([np.sin(radians), np.cos(radians)])
+        self.right = np.stack([np.cos(radians), -np.sin(radians)])
+        self.red = {heading: False for heading in HEADINGS}
+
+    def __len__(self):
+        return len(self.lane)
+
+    def set_lights(self, states):
+        for heading, state in states.items():
+            self.red[heading] = state == "RED"
+
+    def step(self, dt):
+        """Move every vehicle dt seconds; returns the rows of the vehicles that left the map"""
+        red = np.zeros(len(self), dtype=bool)
+        for heading, is_red in self.red.items():
+            if is_red:
+                red |= self.heading == heading
+        distance = self.distance - self.speed * dt
+        # Vehicles before the stop line of a red light wait at it; emergency vehicles go on
+        hold = red & ~self.emergency & (self.distance >= STOP_LINE)
+        distance = np.where(hold & (distance < STOP_LINE), STOP_LINE, distance)
+        self.waiting = hold & (distance == STOP_LINE)
+        respawned = np.flatnonzero(distance < -self.start)
+        distance[respawned] = self.start[respawned]
+        self.denm_sent[respawned] = False
+        self.distance = distance
+        return respawned
+
+    def positions(self, rows):
+        """(lat, lng) of some vehicles"""
+        along = -self.distance[rows]
+        x = self.forward[0, rows] * along + self.right[0, rows] * LANE_OFFSET
+        y = self.forward[1, rows] * along + self.right[1, rows] * LANE_OFFSET
+        return self.projection.to_gps(x, y)
+
+    def due_cams(self, now):
+        """Rows of the vehicles whose CAM is due, scheduling their next one"""
+        rows = np.flatnonzero(self.next_cam <= now)
+        # A vehicle that fell more than an interval behind skips the missed CAMs, keeping its phase
+        missed = np.floor((now - self.next_cam[rows]) / self.cam_interval[rows])
+        self.next_cam[rows] += (missed + 1) * self.cam_interval[rows]
+        return rows
+
+    def due_denms(self):
+        """Rows of the emergency vehicles that just came within DENM distance"""
+        rows = np.flatnonzero(self.emergency & ~self.denm_sent &
+                              (self.distance > 0) & (self.distance < self.denm_distance))
+        self.denm_sent[rows] = True
+        self.denm_sequence[rows] += 1
+        return rows
+
+# === Simulator ===
+
+class FleetSimulator:
+    """Steps a VehicleFleet and publishes its CAMs and DENMs from one asyncio loop"""
+
+    def __init__(self, scenario, base_dir, transport):
+        self.scenario = scenario
+        self.transport = transport
+        self.step_interval = scenario.get("step", STEP)
+        self.cam_topic = scenario.get("cam_topic", "vanetza/out/cam")
+        self.denm_topic = scenario.get("denm_topic", "vanetza/out/denm")
+        self.fleet = VehicleFleet(scenario, base_dir, time.time())
+        self.counters = {"steps": 0, "cams": 0, "denms": 0, "overruns": 0, "max_step_ms": 0.0}
+
+    def on_spatem(self, loop, payload):
+        """MQTT callback, on the transport's network thread: hand the lights to the event loop"""
+        try:
+            states = light_states(json.loads(payload))
+        except ValueError as e:
+            logging.error(f"Invalid SPATEM: {e}")
+            return
+        loop.call_soon_threadsafe(self.fleet.set_lights, states)
+
+    def tick(self, now, dt):
+        fleet = self.fleet
+        fleet.step(dt)
+
+        rows = fleet.due_cams(now)
+        if len(rows):
+            lat, lng = fleet.positions(rows)
+            speed = np.where(fleet.waiting[rows], 0.0, fleet.speed[rows])
+            for station_id, group, heading, row_lat, row_lng, row_speed in zip(
+                    fleet.station_id[rows].tolist(), fleet.group[rows].tolist(),
+                    fleet.heading[rows].tolist(), lat.tolist(), lng.tolist(), speed.tolist()):
+                group = fleet.groups[group]
+                payload = group["cam"].encode(station_id, group["station_type"], row_lat, row_lng, heading, row_speed, now)
+                # A newer CAM of this station replaces one still waiting for the broker
+                self.transport.publish(self.cam_topic, payload, key=("cam", station_id), max_age=CAM_MAX_AGE)
+            self.counters["cams"] += len(rows)
+
+        rows = fleet.due_denms()
+        if len(rows):
+            lat, lng = fleet.positions(rows)
+            for row, row_lat, row_lng in zip(rows.tolist(), lat.tolist(), lng.tolist()):
+                group = fleet.groups[fleet.group[row]]
+                if group["denm"] is None:
+                    continue
+                station_id = int(fleet.station_id[row])
+                payload = build_denm(group["denm"], station_id, int(fleet.denm_sequence[row]),
+                                     row_lat, row_lng, group["station_type"], now)
+                self.transport.publish(self.denm_topic, payload)
+                self.counters["denms"] += 1
+                logging.info(f"Station {station_id} sent DENM {fleet.denm_sequence[row]} "
+                             f"{fleet.distance[row]:.1f} m from the intersection")
+        self.counters["steps"] += 1
+
+    async def run(self, duration=None):
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        next_step = started
+        last = time.time()
+        while duration is None or loop.time() - started < duration:
+            now = time.time()
+            tick_started = time.perf_counter()
+            self.tick(now, now - last)
+            self.counters["max_step_ms"] = max(self.counters["max_step_ms"], (time.perf_counter() - tick_started) * 1000)
+            last = now
+            next_step += self.step_interval
+            delay = next_step - loop.time()
+            if delay < 0:
+                # Running behind: skip the missed steps instead of bursting to catch up
+                self.counters["overruns"] += 1
+                next_step = loop.time()
+                delay = 0
+            await asyncio.sleep(delay)
+
+    async def report(self):
+        while True:
+            await asyncio.sleep(STATS_INTERVAL)
+            self.log_stats()
+
+    def log_stats(self):
+        counters = self.counters
+        logging.info(f"Fleet: {len(self.fleet)} vehicles, {int(self.fleet.waiting.sum())} waiting, "
+                     f"{counters['steps']} steps ({counters['overruns']} late, max {counters['max_step_ms']:.1f} ms), "
+                     f"{counters['cams']} CAMs, {counters['denms']} DENMs")
+
+async def main(scenario, base_dir, duration):
+    loop = asyncio.get_running_loop()
+    # Keyed CAMs coalesce per station, so the queue needs about one entry per vehicle
+    count = sum(group["count"] for group in scenario["groups"])
+    transport = shared_transport(scenario.get("client_id", "obu_fleet"), scenario.get("broker", "127.0.0.1"),
+                                 scenario.get("port", 1883), max_queue=count + 1000)
+    simulator = FleetSimulator(scenario, base_dir, transport)
+    for topic in scenario.get("spatem_topics", SPATEM_TOPICS):
+        transport.subscribe(topic, lambda topic, payload: simulator.on_spatem(loop, payload))
+    transport.start()
+    logging.info(f"Simulating {len(simulator.fleet)} vehicles in {len(simulator.fleet.groups)} group(s)")
+    reporter = asyncio.create_task(simulator.report())
+    try:
+        await simulator.run(duration)
+    finally:
+        reporter.cancel()
+        simulator.log_stats()
+        transport.log_stats()
+        transport.stop()
+
+# === Main ===
+if __name__ == "__main__":
+    print("====================== OBU Fleet ======================")
+    parser = argparse.ArgumentParser(description="Simulate many OBUs from a scenario file")
+    parser.add_argument("scenario", nargs="?", default=SCENARIO_FILE_PATH, help="scenario JSON file")
+    parser.add_argument("--duration", type=float, help="seconds to run, forever by default")
+    args = parser.parse_args()
+
+    scenario = load_json(args.scenario)
+    try:
+        asyncio.run(main(scenario, os.path.dirname(os.path.abspath(args.scenario)), args.duration))
+    except KeyboardInterrupt:
+        logging.info("Stopped by user")
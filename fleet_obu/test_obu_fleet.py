@@ -0,0 +1,124 @@
+import json
+import os
+
+import numpy as np
+
+from common.geometry import INTERSECTION_CENTER
+from fleet_obu.obu_fleet import (CAM_MAX_AGE, LANE_OFFSET, SCENARIO_FILE_PATH, SIGNAL_GROUP_HEADING, SPATEM_TOPICS,
+                                 STOP_LINE, FleetSimulator, VehicleFleet, light_states, load_json)
+from rsu.intersection_controller import IntersectionController
+
+def rsu_controller():
+    published = []
+    config = {"id": 1, "position": INTERSECTION_CENTER, "hot_reload": False}
+    controller = IntersectionController.from_config(config, lambda topic, payload, key: published.append((topic, payload)))
+    return controller, published
+
+def test_light_states_of_rsu_emergency_spatem():
+    controller, published = rsu_controller()
+    # An ambulance at the center: its signal group turns green right away
+    denm = {"management": {"actionID": {"originatingStationID": 99, "sequenceNumber": 1},
+                           "eventPosition": {"latitude": INTERSECTION_CENTER["lat"],
+                                             "longitude": INTERSECTION_CENTER["lng"]}},
+            "location": {"eventPositionHeading": 90}}
+    controller.handle_emergency_denm(denm)
+
+    assert len(published) == 1
+    topic, payload = published[0]
+    assert topic in SPATEM_TOPICS
+    green = SIGNAL_GROUP_HEADING[controller.emergency_target_signal]
+    expected = {heading: "GREEN" if heading == green else "RED" for heading in SIGNAL_GROUP_HEADING.values()}
+    assert light_states(json.loads(payload)) == expected
+
+def test_light_states_of_rsu_periodic_spatem():
+    controller, published = rsu_controller()
+    controller.publish_spatem()
+
+    topic, payload = published[0]
+    assert topic in SPATEM_TOPICS
+    assert set(light_states(json.loads(payload))) == {0, 90, 180, 270}
+
+def test_light_states_of_vanetza_spatem():
+    spat = {"intersections": [{"states": [{"signalGroup": 5, "state-time-speed": [{"eventState": 5}]}]}]}
+    assert light_states({"fields": {"spat": spat}}) == {180: "GREEN"}
+
+# === Fleet ===
+
+FLEET_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def small_scenario(cars=40, ambulances=4):
+    scenario = load_json(SCENARIO_FILE_PATH)
+    counts = {"cars": cars, "ambulances": ambulances}
+    scenario["groups"] = [dict(group, count=counts[group["name"]]) for group in scenario["groups"]]
+    return scenario
+
+class RecordingTransport:
+    def __init__(self):
+        self.published = []
+
+    def publish(self, topic, payload, qos=0, key=None, max_age=None):
+        self.published.append((topic, payload, key, max_age))
+        return True
+
+def test_red_light_holds_cars_at_the_stop_line():
+    fleet = VehicleFleet(small_scenario(), FLEET_DIR, 1000.0)
+    fleet.set_lights({heading: "RED" for heading in SIGNAL_GROUP_HEADING.values()})
+    approaching = fleet.distance >= STOP_LINE
+    for _ in range(600):
+        fleet.step(0.1)
+    cars = ~fleet.emergency
+    assert np.all(fleet.distance[cars & approaching] == STOP_LINE)
+    assert np.all(fleet.waiting[cars & approaching])
+    # Emergency vehicles drive through
+    assert not fleet.waiting[fleet.emergency].any()
+
+def test_green_light_lets_cars_through_and_respawn():
+    fleet = VehicleFleet(small_scenario(), FLEET_DIR, 1000.0)
+    fleet.set_lights({heading: "GREEN" for heading in SIGNAL_GROUP_HEADING.values()})
+    respawned = set()
+    for _ in range(1000):
+        respawned.update(fleet.step(0.1).tolist())
+    assert not fleet.waiting.any()
+    assert len(respawned) == len(fleet)
+    assert np.all(np.abs(fleet.distance) <= fleet.start)
+
+def test_one_denm_per_approach():
+    fleet = VehicleFleet(small_scenario(cars=0, ambulances=1), FLEET_DIR, 1000.0)
+    fleet.distance[:] = fleet.start
+    fleet.denm_sent[:] = False
+    denms = []
+    for _ in range(2 * int(2 * fleet.start[0] / (fleet.speed[0] * 0.1)) + 10):
+        fleet.step(0.1)
+        denms.extend(fleet.denm_sequence[fleet.due_denms()].tolist())
+    # Two approaches, each with its own sequence number
+    assert denms == [1, 2]
+
+def test_cams_are_spread_and_skip_missed_ones():
+    fleet = VehicleFleet(small_scenario(), FLEET_DIR, 1000.0)
+    counts = np.zeros(len(fleet), dtype=int)
+    for now in np.arange(1000.0, 1010.0, 0.1):
+        counts[fleet.due_cams(now)] += 1
+    expected = 10.0 / fleet.cam_interval
+    assert np.all(np.abs(counts - expected) <= 1)
+    # After a stall each vehicle sends one CAM, not a burst
+    assert len(fleet.due_cams(1020.0)) == len(fleet)
+    assert len(fleet.due_cams(1020.0)) == 0
+
+def test_positions_on_the_right_lane():
+    fleet = VehicleFleet(small_scenario(), FLEET_DIR, 1000.0)
+    rows = np.arange(len(fleet))
+    lat, lng = fleet.positions(rows)
+    x, y = fleet.projection.to_local(lat, lng)
+    assert np.allclose(np.hypot(x, y), np.hypot(fleet.distance, LANE_OFFSET))
+
+def test_tick_publishes_keyed_cams():
+    transport = RecordingTransport()
+    simulator = FleetSimulator(small_scenario(), FLEET_DIR, transport)
+    simulator.tick(simulator.fleet.next_cam.max(), 0.1)
+    cams = [entry for entry in transport.published if entry[0] == simulator.cam_topic]
+    assert len(cams) == len(simulator.fleet)
+    for topic, payload, key, max_age in cams:
+        cam = json.loads(payload)
+        assert key == ("cam", cam["stationID"])
+        assert max_age == CAM_MAX_AGE
+        assert cam["stationType"] in (5, 10)
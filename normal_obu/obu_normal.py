@@ -1,57 +1,49 @@
 import json
+import os
 import time
-import math
-import paho.mqtt.client as mqtt
 import logging
 
+from common.geometry import INTERSECTION_CENTER, projection_for
+from common.mqtt_transport import shared_transport
+
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s: %(message)s')
 
 # === Configuration ===
 MQTT_BROKER = "192.168.98.30"  
 MQTT_PORT = 1883
 CAM_MQTT_TOPIC = "vanetza/in/cam"
-CAM_FILE_PATH = "in_cam.json"
+CAM_FILE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "in_cam.json")
 SPATEM_MQTT_TOPIC = "vanetza/out/spatem"  
 PUBLISH_INTERVAL = 0.4
+CAM_MAX_AGE = 1.0  # seconds a CAM may wait for the broker before it is dropped as stale
 MAX_STOP_TIME = 10  
 
 # === Tracking ===
 current_lane = 1  
-INTERSECTION_CENTER = {"lat": 40.6329, "lng": -8.6585}
+INTERSECTION = projection_for(INTERSECTION_CENTER)
 INTERSECTION_THRESHOLD = 40
 STOPPING_DISTANCE = 25  
 
 # === Compute Start Positions ===
-def meters_to_lat(dm):
-    return (dm / 6371000) * (180 / math.pi)
-
-def meters_to_lng(dm, lat):
-    return (dm / (6371000 * math.cos(math.radians(lat)))) * (180 / math.pi)
-
 NS_START = 300
 EW_START = 500
 
 LANE_OFFSET = 0.00010
 
-position = {
-    1: {  # Northbound starts north of intersection
-        "lat": INTERSECTION_CENTER["lat"] + meters_to_lat(NS_START),
-        "lng": INTERSECTION_CENTER["lng"]
-    },
-    3: {  # Southbound starts south of intersection
-        "lat": INTERSECTION_CENTER["lat"] - meters_to_lat(NS_START),
-        "lng": INTERSECTION_CENTER["lng"]
-    },
-    2: {  # Eastbound starts east of intersection
-        "lat": INTERSECTION_CENTER["lat"],
-        "lng": INTERSECTION_CENTER["lng"] + meters_to_lng(EW_START, INTERSECTION_CENTER["lat"])
-    },
-    4: {  # Westbound starts west of intersection
-        "lat": INTERSECTION_CENTER["lat"],
-        "lng": INTERSECTION_CENTER["lng"] - meters_to_lng(EW_START, INTERSECTION_CENTER["lat"])
-    }
+# Lane -> start (x east, y north) in meters from the intersection center
+LANE_START = {
+    1: (0, NS_START),    # Northbound starts north of intersection
+    3: (0, -NS_START),   # Southbound starts south of intersection
+    2: (EW_START, 0),    # Eastbound starts east of intersection
+    4: (-EW_START, 0),   # Westbound starts west of intersection
 }
 
+def start_position(lane):
+    lat, lng = INTERSECTION.to_gps(*LANE_START[lane])
+    return {"lat": lat, "lng": lng}
+
+position = {lane: start_position(lane) for lane in LANE_START}
+
 speed_delta = 0.000045  
 stopped_at_light = False
 traffic_light_states = {
@@ -66,15 +58,9 @@ def load_json(filepath):
     with open(filepath, "r") as file:
         return json.load(file)
 
-def haversine_distance(lat1, lon1, lat2, lon2):
-    # Calculate distance in meters between two lat/lon pairs
-    R = 6371000  
-    phi1, phi2 = math.radians(lat1), math.radians(lat2)
-    dphi = math.radians(lat2 - lat1)
-    dlambda = math.radians(lon2 - lon1)
-    a = math.sin(dphi/2)**2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda/2)**2
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
-    return R * c
+def distance_to_intersection(pos):
+    # Meters from the intersection center, in its cached local projection
+    return INTERSECTION.distance(pos["lat"], pos["lng"])
 
 # === CAM ===
 def update_cam_position(cam_msg, lane):
@@ -119,22 +105,21 @@ def publish_cam():
     cam_msg["stationID"] = 3
 
     payload = json.dumps(cam_msg)
-    info = client.publish(CAM_MQTT_TOPIC, payload)
-    
-    if info.rc == mqtt.MQTT_ERR_SUCCESS:
+    # A newer CAM of this station replaces one still waiting for the broker
+    if transport.publish(CAM_MQTT_TOPIC, payload, key=("cam", cam_msg["stationID"]), max_age=CAM_MAX_AGE):
         status = "STOPPED" if stopped_at_light else "MOVING"
         print(f"Sent CAM message: pos=({cam_msg['latitude']:.7f}, {cam_msg['longitude']:.7f}) - {status}")
     else:
-        print(f"Failed to send CAM (rc={info.rc})")
+        print("Failed to send CAM")
 
 # === SPATEM Handler ===
-def on_message(client, userdata, msg):
+def on_spatem(topic, payload):
     global traffic_light_states, stopped_at_light
     
-    print(f" RECEIVED MESSAGE ON TOPIC: {msg.topic}")
+    print(f" RECEIVED MESSAGE ON TOPIC: {topic}")
     
     try:
-        spatem = json.loads(msg.payload.decode())
+        spatem = json.loads(payload.decode())
         print(f"SPATEM JSON: {json.dumps(spatem)}")
         
         signal_heading_map = {1: 0, 3: 90, 5: 180, 7: 270}
@@ -164,49 +149,16 @@ def on_message(client, userdata, msg):
         traceback.print_exc()
 
 # === MQTT Setup ===
-client = mqtt.Client(client_id=f"normal_obu_1", clean_session=False)
+# The transport connects and reconnects with backoff on its own thread; CAMs
+# published while the broker is unreachable wait in its outbound queue
+transport = shared_transport("normal_obu_1", MQTT_BROKER, MQTT_PORT, clean_session=False)
+transport.subscribe(SPATEM_MQTT_TOPIC, on_spatem)
 heading_map = {1: 0, 2: 90, 3: 180, 4: 270} 
 
-def on_connect(client, userdata, flags, rc):
-    if rc == 0:
-        logging.info(f"Connected to MQTT Broker at {MQTT_BROKER}:{MQTT_PORT}")
-        client.subscribe(SPATEM_MQTT_TOPIC, qos=0)
-        logging.info("Subscribed to SPATEM topic with QoS=0")
-    else:
-        logging.error(f"Failed to connect, return code {rc}")
-
-def on_disconnect(client, userdata, rc):
-    logging.warning(f"Disconnected from broker with code {rc}")
-    if rc != 0:
-        logging.info("Attempting to reconnect...")
-        time.sleep(2)
-        try:
-            client.reconnect()
-        except Exception as e:
-            logging.error(f"Reconnection failed: {e}")
-
-def ensure_connection():
-    """Ensure MQTT connection is active"""
-    if not client.is_connected():
-        logging.warning("Connection lost, attempting to reconnect...")
-        try:
-            client.reconnect()
-            time.sleep(1)
-        except Exception as e:
-            logging.error(f"Reconnection failed: {e}")
-            return False
-    return True
-
-client.on_connect = on_connect
-client.on_disconnect = on_disconnect
-client.on_message = on_message
-
-client.connect(MQTT_BROKER, MQTT_PORT, keepalive=60)
-
 # === Main Loop ===
 if __name__ == "__main__":
     print("====================== OBU Normal 1 ======================")
-    client.loop_start()
+    transport.start()
     
     try:
         last_lane_switch_time = time.time()
@@ -217,14 +169,8 @@ if __name__ == "__main__":
         logging.info(f"Listening for SPATEM on: {SPATEM_MQTT_TOPIC}")
         
         while True:
-            if not ensure_connection():
-                logging.warning("Not connected, skipping this cycle")
-                time.sleep(1)
-                continue
-            
             cam_pos = position[current_lane]
-            dist = haversine_distance(cam_pos["lat"], cam_pos["lng"],
-                                    INTERSECTION_CENTER["lat"], INTERSECTION_CENTER["lng"])
+            dist = distance_to_intersection(cam_pos)
             
             # Rest of your existing logic...
             if int(time.time() * 10) % 50 == 0:
@@ -276,15 +222,13 @@ if __name__ == "__main__":
                 last_lane_switch_time = current_time
                 print(f"Cycling to lane: {current_lane}")
                 
-                position[1]["lat"] = INTERSECTION_CENTER["lat"] + meters_to_lat(NS_START)
-                position[1]["lng"] = INTERSECTION_CENTER["lng"]
-                position[4]["lat"] = INTERSECTION_CENTER["lat"]
-                position[4]["lng"] = INTERSECTION_CENTER["lng"] - meters_to_lng(EW_START, INTERSECTION_CENTER["lat"])
+                position[1] = start_position(1)
+                position[4] = start_position(4)
             
             time.sleep(PUBLISH_INTERVAL)
             
     except KeyboardInterrupt:
         logging.info("Stopped by user")
     finally:
-        client.loop_stop()
-        client.disconnect()
\ No newline at end of file
+        transport.log_stats()
+        transport.stop()
\ No newline at end of file
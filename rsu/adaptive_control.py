@@ -0,0 +1,147 @@
+import math
+import time
+
+from common.geometry import projection_for
+from rsu.signal_plan import signal_group_for_heading
+
+# === Occupancy Tracking ===
+DETECTION_RADIUS = 150      # meters, CAMs further away are ignored
+QUEUE_SPEED = 1.0           # at or below this speed a vehicle counts as queued
+OBSERVATION_TTL = 3.0       # seconds a CAM keeps a vehicle on its approach
+
+# === Split Bounds ===
+MIN_GREEN = 5               # seconds, never shorten a green below this
+MAX_GREEN = 40              # seconds, never stretch a green beyond this
+SATURATION_HEADWAY = 2.0    # seconds between departures of a discharging queue
+STARTUP_LOST_TIME = 2.0     # seconds lost when a queue starts moving
+
+def cam_fields(cam_payload):
+    if "fields" in cam_payload and "cam" in cam_payload["fields"]:
+        return cam_payload["fields"]["cam"]
+    return cam_payload
+
+class ApproachOccupancy:
+    """
+    Rolling per-approach view of the vehicles around one intersection, built from
+    CAMs. Each station keeps only its latest observation, and observations older
+    than OBSERVATION_TTL are dropped. Vehicles are assigned to the signal group of
+    their direction of travel, as for emergency DENMs.
+    """
+
+    def __init__(self, position, radius=DETECTION_RADIUS, ttl=OBSERVATION_TTL):
+        self.position = position
+        self.radius = radius
+        self.ttl = ttl
+        self.projection = projection_for(position)
+        self._observations = {}
+
+    def update(self, cam_payload, now=None):
+        """Record a CAM. Returns False when the vehicle is not approaching this intersection."""
+        if now is None:
+            now = time.time()
+        cam = cam_fields(cam_payload)
+        station_id = cam.get("stationID")
+        lat, lng, heading = cam.get("latitude"), cam.get("longitude"), cam.get("heading")
+        if station_id is None or lat is None or lng is None or heading is None or heading == 3601:
+            return False
+
+        east, north = self.projection.to_local(lat, lng)
+        distance = math.hypot(east, north)
+        # Approaching when the intersection lies ahead, within 90 degrees of the heading
+        ahead = -(east * math.sin(math.radians(heading)) + north * math.cos(math.radians(heading)))
+        if distance > self.radius or ahead < 0:
+            self._observations.pop(station_id, None)
+            return False
+
+        speed = cam.get("speed", 0)
+        if speed == 16383:  # unavailable
+            speed = 0
+        self._observations[station_id] = (signal_group_for_heading(heading), distance, speed, now)
+        return True
+
+    def snapshot(self, now=None):
+        """signalGroup -> (queued, approaching) vehicle counts, dropping stale observations"""
+        if now is None:
+            now = time.time()
+        counts = {}
+        for station_id, (group, distance, speed, seen) in list(self._observations.items()):
+            if now - seen > self.ttl:
+                del self._observations[station_id]
+                continue
+            queued, moving = counts.get(group, (0, 0))
+            if speed <= QUEUE_SPEED:
+                queued += 1
+            else:
+                moving += 1
+            counts[group] = (queued, moving)
+        return counts
+
+# === Adaptive Splits ===
+
+def plan_phases(plan):
+    """Groups of the plan bundled into phases (same green start), in cycle order"""
+    phases = {}
+    for group, split in plan["groups"].items():
+        phases.setdefault(split["green_start"], []).append(group)
+    return [phases[start] for start in sorted(phases)]
+
+class AdaptiveSignalTiming:
+    """
+    Re-times a base plan at every cycle boundary from the approach occupancy. Each
+    phase gets the green needed to clear its busiest approach (queued plus
+    approaching vehicles at the saturation headway), bounded by MIN_GREEN and
+    MAX_GREEN. Phase order and yellow times come from the base plan, and the cycle
+    length follows from the new greens. Without any demand the base plan is kept.
+    """
+
+    def __init__(self, base_plan, min_green=MIN_GREEN, max_green=MAX_GREEN,
+                 headway=SATURATION_HEADWAY, startup_lost_time=STARTUP_LOST_TIME):
+        self.base_plan = base_plan
+        self.min_green = min_green
+        self.max_green = max_green
+        self.headway = headway
+        self.startup_lost_time = startup_lost_time
+        self.phases = plan_phases(base_plan)
+        self.cycle_end = None
+
+    def green_for(self, demand):
+        needed = self.startup_lost_time + self.headway * demand
+        return min(self.max_green, max(self.min_green, needed))
+
+    def next_plan(self, occupancy, start):
+        """Plan for the cycle that begins at start (epoch seconds)"""
+        counts = occupancy.snapshot(start)
+        groups = self.base_plan["groups"]
+        demand = [max(sum(counts.get(int(group), (0, 0))) for group in phase) for phase in self.phases]
+
+        if not any(demand):
+            return dict(self.base_plan, offset=start)
+
+        plan_groups = {}
+        green_start = 0.0
+        for phase, phase_demand in zip(self.phases, demand):
+            green = self.green_for(phase_demand)
+            yellow = max(groups[group].get("yellow", 0) for group in phase)
+            for group in phase:
+                plan_groups[group] = {"green_start": green_start, "green": green, "yellow": yellow}
+            green_start += green + yellow
+        return {"cycle": green_start, "offset": start, "groups": plan_groups}
+
+    def update(self, occupancy, now):
+        """New plan when a cycle boundary has passed since the last call, otherwise None"""
+        if self.cycle_end is None:
+            # Finish the base plan's current cycle before adapting
+            cycle = self.base_plan["cycle"]
+            offset = self.base_plan.get("offset", 0)
+            self.cycle_end = now - (now - offset) % cycle + cycle
+            return None
+        if now < self.cycle_end:
+            return None
+
+        plan = self.next_plan(occupancy, self.cycle_end)
+        self.cycle_end += plan["cycle"]
+        # After a long stall, restart the adapted cycle at the current time
+        if self.cycle_end <= now:
+            plan["offset"] = now
+            self.cycle_end = now + plan["cycle"]
+        return plan
@@ -0,0 +1,181 @@
+"""
+Fixed-cycle vs adaptive signal timing on a replayed CAM trace.
+
+The trace is a JSON lines file, one {"t": seconds, "cam": {...}} record per CAM.
+Each station's first CAM gives its approach (from the heading) and its free-flow
+arrival time at the stop line (from distance and speed). Both controllers are then
+run against the same arrivals with a point-queue model: queued vehicles leave one
+per saturation headway while their signal group is green, after a start-up loss.
+
+The trace only gives the arrivals. The adaptive controller does not see the trace
+CAMs: every CAM_INTERVAL it is fed CAMs synthesized from the simulated queues and
+approaching vehicles, i.e. from the model's ground truth, so its result is an upper
+bound on what real, sparser CAMs would allow.
+
+    python3 -m rsu.bench_adaptive                         # synthetic trace
+    python3 -m rsu.bench_adaptive --write-trace t.jsonl   # keep the synthetic trace
+    python3 -m rsu.bench_adaptive --trace t.jsonl         # replay a recorded trace
+"""
+import argparse
+import json
+import math
+import random
+import time
+
+from common.geometry import INTERSECTION_CENTER, projection_for
+from rsu.adaptive_control import ApproachOccupancy, AdaptiveSignalTiming, SATURATION_HEADWAY, STARTUP_LOST_TIME, cam_fields
+from rsu.signal_plan import DEFAULT_PLAN, GREEN, SignalPlanBank, signal_group_for_heading
+
+CENTER = INTERSECTION_CENTER
+GROUP_HEADING = {1: 0, 3: 90, 5: 180, 7: 270}
+STOP_LINE = 15       # meters from the intersection center
+QUEUE_SPACING = 7    # meters per queued vehicle
+APPROACH_SPEED = 13  # m/s in the synthetic trace
+STEP = 0.5           # simulation step, seconds
+CAM_INTERVAL = 1.0   # how often simulated vehicles send a CAM to the adaptive controller
+START = 1700000000   # epoch of the synthetic trace, a multiple of the default cycle
+
+def position_at(group, distance):
+    """lat/lng of a vehicle on the approach of group, distance meters before the center"""
+    heading = math.radians(GROUP_HEADING[group])
+    return projection_for(CENTER).to_gps(-distance * math.sin(heading), -distance * math.cos(heading))
+
+def make_cam(station_id, group, distance, speed):
+    lat, lng = position_at(group, distance)
+    return {"stationID": station_id, "stationType": 5, "latitude": lat, "longitude": lng,
+            "heading": GROUP_HEADING[group], "speed": speed}
+
+def synthetic_trace(flows, duration, seed):
+    """Poisson arrivals per approach, each vehicle seen twice as it enters detection range"""
+    rng = random.Random(seed)
+    records = []
+    station_id = 1000
+    for group, rate in flows.items():
+        t = START
+        while rate > 0:
+            t += rng.expovariate(rate / 3600)
+            if t >= START + duration:
+                break
+            station_id += 1
+            for k in range(2):
+                distance = 140 - k * APPROACH_SPEED
+                records.append({"t": t + k, "cam": make_cam(station_id, group, distance, APPROACH_SPEED)})
+    records.sort(key=lambda r: r["t"])
+    return records
+
+def load_trace(filepath):
+    with open(filepath, "r") as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+def arrivals_from_trace(records):
+    """(stop line arrival time, signal group, speed) per station, from its first CAM"""
+    seen = {}
+    for record in records:
+        cam = cam_fields(record["cam"])
+        station_id = cam.get("stationID")
+        if station_id in seen or cam.get("heading") in (None, 3601):
+            continue
+        east, north = projection_for(CENTER).to_local(cam["latitude"], cam["longitude"])
+        speed = cam.get("speed", 0)
+        if speed in (0, 16383):
+            speed = APPROACH_SPEED
+        distance = max(0.0, math.hypot(east, north) - STOP_LINE)
+        seen[station_id] = (record["t"] + distance / speed, signal_group_for_heading(cam["heading"]), speed)
+    return sorted(seen.values())
+
+def simulate(arrivals, duration, adaptive):
+    bank = SignalPlanBank(resolution=1e-6)
+    bank.add(1, DEFAULT_PLAN)
+    timing = AdaptiveSignalTiming(DEFAULT_PLAN) if adaptive else None
+    occupancy = ApproachOccupancy(CENTER)
+
+    start = arrivals[0][0] if arrivals else START
+    end = start + duration
+    queues = {group: [] for group in GROUP_HEADING}
+    approaching = []
+    green_since = {group: None for group in GROUP_HEADING}
+    next_departure = {group: 0.0 for group in GROUP_HEADING}
+    delays = []
+    max_queue = 0
+    next_cam = start
+    pending = list(reversed(arrivals))
+
+    t = start
+    while t < end:
+        # Vehicles inside detection range, then those that reached the stop line
+        while pending and pending[-1][0] - (140 - STOP_LINE) / pending[-1][2] <= t:
+            approaching.append(pending.pop())
+        for vehicle in [v for v in approaching if v[0] <= t]:
+            approaching.remove(vehicle)
+            queues[vehicle[1]].append(vehicle)
+        max_queue = max(max_queue, max(len(q) for q in queues.values()))
+
+        if timing is not None:
+            if t >= next_cam:
+                next_cam += CAM_INTERVAL
+                station_id = 0
+                for group, queue in queues.items():
+                    for i, _ in enumerate(queue):
+                        station_id += 1
+                        occupancy.update(make_cam(station_id, group, STOP_LINE + i * QUEUE_SPACING, 0), t)
+                for arrival, group, speed in approaching:
+                    station_id += 1
+                    occupancy.update(make_cam(station_id, group, STOP_LINE + (arrival - t) * speed, speed), t)
+            plan = timing.update(occupancy, t)
+            if plan is not None:
+                bank.update(1, plan)
+
+        states = bank.states(1, t)
+        for group, queue in queues.items():
+            if states[group][0] != GREEN:
+                green_since[group] = None
+                continue
+            if green_since[group] is None:
+                green_since[group] = t
+            if queue and t >= max(next_departure[group], green_since[group] + STARTUP_LOST_TIME):
+                arrival, _, _ = queue.pop(0)
+                delays.append(t - arrival)
+                next_departure[group] = t + SATURATION_HEADWAY
+        t += STEP
+
+    left = sum(len(q) for q in queues.values())
+    return {
+        "served": len(delays),
+        "throughput_vph": len(delays) * 3600 / duration,
+        "avg_delay_s": sum(delays) / len(delays) if delays else 0.0,
+        "max_queue": max_queue,
+        "left_queued": left,
+    }
+
+def parse_flows(text):
+    return {int(group): float(rate) for group, rate in (item.split("=") for item in text.split(","))}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--trace", help="JSON lines CAM trace to replay")
+    parser.add_argument("--write-trace", help="save the synthetic trace to this file")
+    parser.add_argument("--duration", type=float, default=3600, help="simulated seconds")
+    parser.add_argument("--flows", default="1=650,5=650,3=200,7=200",
+                        help="synthetic demand per signal group, vehicles/hour")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    if args.trace:
+        records = load_trace(args.trace)
+    else:
+        records = synthetic_trace(parse_flows(args.flows), args.duration, args.seed)
+        if args.write_trace:
+            with open(args.write_trace, "w") as file:
+                for record in records:
+                    file.write(json.dumps(record) + "\n")
+    arrivals = arrivals_from_trace(records)
+    print(f"{len(records)} CAMs, {len(arrivals)} vehicles over {args.duration:.0f} s")
+    print(f"adaptive occupancy: CAMs synthesized from the simulated queues every {CAM_INTERVAL:.0f} s, "
+          f"not the trace CAMs")
+
+    for name, adaptive in (("fixed", False), ("adaptive", True)):
+        started = time.perf_counter()
+        result = simulate(arrivals, args.duration, adaptive)
+        print(f"{name:>9}: avg delay {result['avg_delay_s']:6.1f} s  throughput {result['throughput_vph']:6.0f} veh/h  "
+              f"max queue {result['max_queue']:3d}  still queued {result['left_queued']:3d}  "
+              f"({time.perf_counter() - started:.1f} s)")
@@ -0,0 +1,305 @@
+import json
+import math
+import os
+import time
+import threading
+import logging
+
+from common.geometry import projection_for
+from rsu.adaptive_control import AdaptiveSignalTiming, ApproachOccupancy, cam_fields
+from rsu.message_templates import MessageTemplate, EncodedMessageCache, SpatemEncoder, build_cam, signal_groups
+from rsu.preemption import DEFAULT_SPEED, LaneMap, denm_position, fallback_target, preemption_window
+from rsu.signal_plan import DEFAULT_PLAN, GREEN, RED, SignalPlanBank, load_plan
+
+RSU_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# === Topics ===
+SPATEM_MQTT_TOPIC = "vanetza/time/spatem"
+SPATEM_MQTT_TOPIC2 = "vanetza/in/spatem"
+MAPEM_MQTT_TOPIC = "vanetza/time/mapem"
+CAM_MQTT_TOPIC = "vanetza/time/cam"
+
+EMERGENCY_STATION_TYPE = 10  # CAMs of emergency vehicles feed preemption
+EMERGENCY_VEHICLE_TTL = 10   # seconds a CAM is used to complete an emergency vehicle's DENM
+
+# Templates are shared between controllers that use the same file
+_templates = {}
+
+def get_template(filepath, hot_reload=True):
+    template = _templates.get(filepath)
+    if template is None:
+        template = _templates[filepath] = MessageTemplate(filepath, hot_reload=hot_reload)
+    return template
+
+class IntersectionController:
+    """
+    Signal control and message publishing for one intersection. The controller
+    does no I/O itself: messages go out through the publish(topic, payload, key)
+    callable, so many controllers can share one MQTT connection. The key,
+    (message type, intersection id), lets the transport replace a message that
+    is still waiting for the broker with a newer one of the same kind.
+    """
+
+    def __init__(self, intersection_id, publish, position,
+                 spatem_file=os.path.join(RSU_DIR, "rsu_spatem.json"),
+                 mapem_file=os.path.join(RSU_DIR, "rsu_mapem.json"),
+                 cam_file=os.path.join(RSU_DIR, "rsu_cam.json"),
+                 spatem_interval=0.6, mapem_interval=6.0, cam_interval=6.0, hot_reload=True,
+                 plan=None, plan_bank=None, adaptive=False, reference=None):
+        self.intersection_id = intersection_id
+        self.publish = publish
+        # position is where the RSU stands; reference is the intersection center, see below
+        self.position = position
+        self.spatem_interval = spatem_interval
+        self.mapem_interval = mapem_interval
+        self.cam_interval = cam_interval
+
+        self.spatem_template = get_template(spatem_file, hot_reload)
+        self.mapem_template = get_template(mapem_file, hot_reload)
+        self.cam_template = get_template(cam_file, hot_reload)
+        # The map geometry is static, so the MAPEM is serialized once per map revision
+        self.mapem_payload = EncodedMessageCache(self.mapem_template, intersection_id=intersection_id)
+        # SPATEM bytes are patched in place, only the changed signal group fields are re-encoded
+        self.spatem_encoder = SpatemEncoder(self.spatem_template, intersection_id=intersection_id)
+
+        # Ingress lanes of the MAPEM, for matching emergency vehicles to their signal group.
+        # Lane nodes are meters from the MAPEM refPoint or, when it is 0/0, from the lane
+        # reference. The lane reference is also where distances to the intersection
+        # are measured from: the configured one, else the refPoint, else the position.
+        self.lane_map = None
+        self._lane_map_version = None
+        self.reference = reference or self.get_lane_map().reference or position
+
+        # Normal operation follows the signal plan; controllers sharing a bank are evaluated together
+        self.plan_bank = plan_bank if plan_bank is not None else SignalPlanBank()
+        self.plan_bank.add(intersection_id, plan or DEFAULT_PLAN)
+
+        # Adaptive mode re-times the plan every cycle from the CAM-based approach occupancy
+        # around the lane reference. adaptive may be True or a dict of AdaptiveSignalTiming
+        # options (min_green, max_green, ...)
+        self.occupancy = ApproachOccupancy(self.reference)
+        self.adaptive = None
+        if adaptive:
+            options = adaptive if isinstance(adaptive, dict) else {}
+            self.adaptive = AdaptiveSignalTiming(plan or DEFAULT_PLAN, **options)
+
+        # DENMs arrive on the MQTT network thread while the scheduler publishes
+        self.lock = threading.Lock()
+        self.emergency_mode = False
+        self.emergency_mode_start = 0
+        self.emergency_mode_expiry = 0
+        self.emergency_target_signal = None
+        # The DENM and station behind the running preemption, re-predicted on each of its CAMs
+        self.emergency_denm = None
+        self.emergency_station = None
+        # stationID -> (lat, lng, heading, speed, time) of the last CAM of each emergency vehicle
+        self.emergency_vehicles = {}
+
+    @classmethod
+    def from_config(cls, config, publish, plan_bank=None):
+        """Build a controller from one entry of the intersections config"""
+        options = {key: config[key] for key in (
+            "spatem_file", "mapem_file", "cam_file",
+            "spatem_interval", "mapem_interval", "cam_interval", "hot_reload", "plan", "adaptive", "reference") if key in config}
+        if "plan_file" in config:
+            options["plan"] = load_plan(config["plan_file"])
+        return cls(config["id"], publish, config["position"], plan_bank=plan_bank, **options)
+
+    def tasks(self):
+        """(interval, callback, name) of every periodic job of this intersection"""
+        name = f"intersection {self.intersection_id}"
+        return [
+            (self.spatem_interval, self.publish_spatem, f"{name} SPATEM"),
+            (self.mapem_interval, self.publish_mapem, f"{name} MAPEM"),
+            (self.cam_interval, self.publish_cam, f"{name} CAM"),
+        ]
+
+    def refresh_templates(self):
+        for template in (self.spatem_template, self.mapem_template, self.cam_template):
+            template.refresh()
+
+    def distance_to(self, lat, lng):
+        """Distance in meters from the intersection center"""
+        return projection_for(self.reference).distance(lat, lng)
+
+    # === CAM Input ===
+
+    def handle_cam(self, cam_payload, now=None):
+        """
+        Feed a vehicle CAM into the approach occupancy and the emergency vehicle table.
+        A CAM of the emergency vehicle behind the running preemption re-predicts its window.
+        """
+        if now is None:
+            now = time.time()
+        cam = cam_fields(cam_payload)
+        payload = None
+        with self.lock:
+            if cam.get("stationType") == EMERGENCY_STATION_TYPE and cam.get("stationID") is not None:
+                speed = cam.get("speed")
+                heading = cam.get("heading")
+                previous = self.emergency_vehicles.get(cam["stationID"])
+                self.emergency_vehicles[cam["stationID"]] = (
+                    cam.get("latitude"), cam.get("longitude"),
+                    None if heading == 3601 else heading,
+                    None if speed == 16383 else speed,
+                    now,
+                )
+                if self.emergency_mode and cam["stationID"] == self.emergency_station:
+                    payload = self.repredict_preemption(previous, now)
+            updated = self.adaptive is not None and self.occupancy.update(cam_payload, now)
+
+        if payload is not None:
+            self.publish(SPATEM_MQTT_TOPIC, payload, ("spatem", self.intersection_id))
+        return updated
+
+    # === DENM ===
+
+    def get_lane_map(self):
+        if self._lane_map_version != self.mapem_template.version:
+            self.lane_map = LaneMap(self.mapem_template.document)
+            self._lane_map_version = self.mapem_template.version
+        return self.lane_map
+
+    def preemption_target(self, denm_payload, now, started=None):
+        """
+        (signalGroup, window start, window end) for the emergency vehicle of a DENM.
+        The vehicle is map-matched to an ingress lane of the MAPEM; the arrival at
+        the lane's stop line is predicted from the vehicle's last CAM speed, and the
+        window covers just that arrival. Without a lane match the signal group comes
+        from the heading and the distance from the intersection center. started is
+        the start of the window already running, if any.
+        """
+        station_id = denm_payload.get("management", {}).get("actionID", {}).get("originatingStationID")
+        lat, lng, heading, speed, seen = self.emergency_vehicles.get(station_id, (None, None, None, None, 0))
+        if now - seen > EMERGENCY_VEHICLE_TTL:
+            lat = lng = heading = speed = None
+
+        # The DENM position is the event position; a fresh CAM position is preferred
+        if lat is None or lng is None:
+            position = denm_position(denm_payload)
+            lat, lng = position if position is not None else (self.reference["lat"], self.reference["lng"])
+        if heading is None:
+            heading = denm_payload.get("location", {}).get("eventPositionHeading")
+        if not speed:
+            speed = DEFAULT_SPEED
+
+        match = None
+        lane_map = self.get_lane_map()
+        if heading is not None:
+            # Without a MAPEM reference point the lanes are relative to the lane reference
+            x, y = projection_for(lane_map.reference or self.reference).to_local(lat, lng)
+            match = lane_map.match(x, y, heading)
+        if match is not None:
+            lane_id, target_signal, distance = match
+            logging.info(f"Intersection {self.intersection_id} emergency vehicle on lane {lane_id}, "
+                         f"{distance:.0f} m from the stop line")
+        else:
+            target_signal, distance = fallback_target(heading or 0, self.distance_to(lat, lng))
+
+        start, end = preemption_window(distance, speed, now, started)
+        return target_signal, start, end
+
+    def repredict_preemption(self, previous, now):
+        """
+        Move the running preemption window to the arrival predicted from the emergency
+        vehicle's latest CAM; called with the lock held. A window that already started
+        keeps its start. Once the vehicle stops closing in on the intersection (it
+        passed the stop line) the window is left to expire. Returns the SPATEM
+        payload to publish when the window starts now.
+        """
+        if now >= self.emergency_mode_expiry:
+            return None
+        lat, lng = self.emergency_vehicles[self.emergency_station][:2]
+        if lat is None or lng is None:
+            return None
+        if previous is not None and previous[0] is not None and previous[1] is not None:
+            if self.distance_to(lat, lng) > self.distance_to(previous[0], previous[1]):
+                return None
+
+        started = self.emergency_mode_start <= now
+        target_signal, start, end = self.preemption_target(
+            self.emergency_denm, now, self.emergency_mode_start if started else None)
+        if target_signal != self.emergency_target_signal:
+            return None
+        self.emergency_mode_start = start
+        self.emergency_mode_expiry = end
+        logging.debug(f"Intersection {self.intersection_id} preemption of signal group {target_signal} "
+                      f"moved to {start - now:.1f} s for {end - start:.1f} s")
+        if started or start > now:
+            return None
+        return self.spatem_encoder.encode(self.update_spatem(now))
+
+    def handle_emergency_denm(self, denm_payload, now=None):
+        """
+        Preempt the signal group of the ambulance's lane for its predicted arrival
+        window: that group green and all others red. When the window has already
+        started the emergency SPATEM is published immediately.
+        """
+        if now is None:
+            now = time.time()
+
+        with self.lock:
+            target_signal, start, end = self.preemption_target(denm_payload, now)
+            if self.emergency_mode and self.emergency_target_signal == target_signal:
+                # A repeated DENM for the same approach never shortens a running preemption
+                start = min(start, self.emergency_mode_start)
+                end = max(end, self.emergency_mode_expiry)
+            self.emergency_mode = True
+            self.emergency_mode_start = start
+            self.emergency_mode_expiry = end
+            self.emergency_target_signal = target_signal
+            self.emergency_denm = denm_payload
+            self.emergency_station = denm_payload.get("management", {}).get("actionID", {}).get("originatingStationID")
+            logging.info(f"Intersection {self.intersection_id} preempting signal group {target_signal} "
+                         f"in {start - now:.1f} s for {end - start:.1f} s")
+            if start > now:
+                return
+            payload = self.spatem_encoder.encode(self.update_spatem(now))
+
+        # Publish the emergency SPATEM
+        self.publish(SPATEM_MQTT_TOPIC, payload, ("spatem", self.intersection_id))
+
+    # === CAM ===
+
+    def publish_cam(self):
+        cam_msg = build_cam(self.cam_template, self.position["lat"], self.position["lng"], station_type=15)
+        self.publish(CAM_MQTT_TOPIC, json.dumps(cam_msg), ("cam", self.intersection_id))
+
+    # === MAPEM ===
+
+    def publish_mapem(self):
+        self.publish(MAPEM_MQTT_TOPIC, self.mapem_payload.payload(), ("mapem", self.intersection_id))
+
+    # === SPATEM ===
+
+    def publish_spatem(self):
+        self.refresh_templates()
+        with self.lock:
+            payload = self.spatem_encoder.encode(self.update_spatem())
+        self.publish(SPATEM_MQTT_TOPIC2, payload, ("spatem", self.intersection_id))
+
+    def update_spatem(self, now=None):
+        """Current (eventState, minEndTime) of each signal group"""
+        if now is None:
+            now = time.time()
+
+        if self.emergency_mode and now < self.emergency_mode_expiry:
+            if now >= self.emergency_mode_start:
+                remaining = math.ceil(self.emergency_mode_expiry - now)
+                signal_states = {group: (RED, remaining) for group in signal_groups(self.spatem_template.document)}
+                signal_states[self.emergency_target_signal] = (GREEN, remaining)
+                return signal_states
+        else:
+            self.emergency_mode = False
+            self.emergency_target_signal = None
+            self.emergency_denm = None
+            self.emergency_station = None
+
+        if self.adaptive is not None:
+            plan = self.adaptive.update(self.occupancy, now)
+            if plan is not None:
+                self.plan_bank.update(self.intersection_id, plan)
+                greens = {group: split["green"] for group, split in plan["groups"].items()}
+                logging.debug(f"Intersection {self.intersection_id} next cycle {plan['cycle']:.0f} s, greens {greens}")
+
+        return self.plan_bank.states(self.intersection_id, now)
@@ -0,0 +1,223 @@
+"""
+Headless lane generation from a declarative intersection spec.
+
+A spec (see lane_spec.json) has named layouts and a list of intersections. A
+layout lists its lanes, each made of straight and arc segments in local meters
+(x east, y north, angles in degrees), plus the MAPEM lane attributes: laneID,
+ingress or egress, signalGroup and the lanes it connects to. Each intersection
+uses a layout with its own id and reference point; a "grid" entry expands to
+rows x cols intersections spaced a fixed distance apart.
+
+Every lane is built as one NumPy array and turned into a MAPEM laneSet once per
+layout, so generating hundreds of intersections costs little more than writing
+them out:
+
+    python3 -m rsu.lane_generation rsu/lane_spec.json --out-dir mapems
+"""
+import argparse
+import json
+import os
+import time
+import numpy as np
+
+from common.geometry import INTERSECTION_CENTER, LocalProjection
+
+POINT_SPACING = 0.5  # meters between lane nodes
+MANEUVERS = {
+    "straight": "maneuverStraightAllowed",
+    "left": "maneuverLeftAllowed",
+    "right": "maneuverRightAllowed",
+    "uturn": "maneuverUTurnAllowed",
+}
+
+# node-XY choice -> largest offset in centimeters it can carry (Offset-B10 ... Offset-B16)
+NODE_XY_RANGES = [
+    ("node-XY1", 511),
+    ("node-XY2", 1023),
+    ("node-XY3", 2047),
+    ("node-XY4", 4095),
+    ("node-XY5", 8191),
+    ("node-XY6", 32767),
+]
+
+# === Geometry ===
+
+def straight(start, end, spacing=POINT_SPACING):
+    """(n, 2) points from start to end, at most spacing apart"""
+    start, end = np.asarray(start, dtype=np.float64), np.asarray(end, dtype=np.float64)
+    num_points = int(np.ceil(np.linalg.norm(end - start) / spacing)) + 1
+    t = np.linspace(0.0, 1.0, num_points)[:, None]
+    return start + t * (end - start)
+
+def arc(center, radius, start_angle, end_angle, spacing=POINT_SPACING, clockwise=False):
+    """(n, 2) points along a circle arc, angles in radians"""
+    if clockwise:
+        if end_angle > start_angle:
+            end_angle -= 2 * np.pi
+    elif end_angle < start_angle:
+        end_angle += 2 * np.pi
+    num_points = int(np.ceil(abs(end_angle - start_angle) * radius / spacing)) + 1
+    angles = np.linspace(start_angle, end_angle, num_points)
+    return np.column_stack((center[0] + radius * np.cos(angles), center[1] + radius * np.sin(angles)))
+
+def build_lane(segments, spacing=POINT_SPACING):
+    """One (n, 2) array for a lane made of straight and arc segments"""
+    parts = []
+    for segment in segments:
+        if "straight" in segment:
+            s = segment["straight"]
+            parts.append(straight(s["start"], s["end"], spacing))
+        elif "arc" in segment:
+            a = segment["arc"]
+            parts.append(arc(a["center"], a["radius"], np.radians(a["start"]), np.radians(a["end"]),
+                             spacing, a.get("clockwise", False)))
+        else:
+            raise ValueError(f"Unknown lane segment {segment}")
+    return np.concatenate(parts)
+
+def build_layout(layout, spacing=POINT_SPACING):
+    """lane name -> (n, 2) points of every lane of a layout"""
+    return {lane["name"]: build_lane(lane["segments"], spacing) for lane in layout["lanes"]}
+
+# === MAPEM ===
+
+def maneuver(kind):
+    flags = ["caution", "goWithHalt", "maneuverLaneChangeAllowed", "maneuverLeftAllowed",
+             "maneuverLeftTurnOnRedAllowed", "maneuverNoStoppingAllowed", "maneuverRightAllowed",
+             "maneuverRightTurnOnRedAllowed", "maneuverStraightAllowed", "maneuverUTurnAllowed",
+             "reserved1", "yieldAllwaysRequired"]
+    allowed = MANEUVERS[kind]
+    return {flag: flag == allowed for flag in flags}
+
+def lane_attributes(ingress):
+    return {
+        "directionalUse": {"egressPath": not ingress, "ingressPath": ingress},
+        "laneType": {"vehicle": {
+            "hasIRbeaconCoverage": False,
+            "hovLaneUseOnly": False,
+            "isVehicleFlyOverLane": True,
+            "isVehicleRevocableLane": False,
+            "permissionOnRequest": False,
+            "restrictedFromPublicUse": False,
+            "restrictedToBusUse": False,
+            "restrictedToTaxiUse": False,
+        }},
+        "sharedWith": {
+            "busVehicleTraffic": False,
+            "cyclistVehicleTraffic": False,
+            "individualMotorizedVehicleTraffic": False,
+            "multipleLanesTreatedAsOneLane": False,
+            "otherNonMotorizedTrafficTypes": False,
+            "overlappingLaneDescriptionProvided": False,
+            "pedestriansTraffic": False,
+            "pedestrianTraffic": False,
+            "taxiVehicleTraffic": False,
+            "trackedVehicleTraffic": False,
+        },
+    }
+
+def xy_nodes(x, y):
+    """
+    MAPEM nodes of a lane as node-XY1..XY6 offsets in centimeters from the previous
+    node (the first one from the reference point), the smallest size that fits
+    """
+    # Deltas are taken between the rounded absolute positions so rounding never accumulates
+    cx = np.rint(np.asarray(x) * 100).astype(np.int64)
+    cy = np.rint(np.asarray(y) * 100).astype(np.int64)
+    dx = np.diff(cx, prepend=0)
+    dy = np.diff(cy, prepend=0)
+    size = np.maximum(np.abs(dx), np.abs(dy))
+    limits = np.array([limit for _, limit in NODE_XY_RANGES])
+    choice = np.searchsorted(limits, size)
+    if (choice >= len(limits)).any():
+        raise ValueError("Node offset exceeds node-XY6 (327.67 m), add intermediate nodes")
+    return [{"delta": {NODE_XY_RANGES[c][0]: {"x": a, "y": b}}}
+            for c, a, b in zip(choice.tolist(), dx.tolist(), dy.tolist())]
+
+def mapem_lane(lane, nodes):
+    connections = []
+    for connection in lane.get("connectsTo", []):
+        entry = {"connectingLane": {"lane": connection["lane"], "maneuver": maneuver(connection.get("maneuver", "straight"))}}
+        if lane.get("ingress") and "signalGroup" in lane:
+            entry["signalGroup"] = lane["signalGroup"]
+        connections.append(entry)
+    return {
+        "laneID": lane["laneID"],
+        "nodeList": {"nodes": nodes},
+        "laneAttributes": lane_attributes(bool(lane.get("ingress"))),
+        "connectsTo": connections,
+    }
+
+def build_lane_set(layout, spacing=POINT_SPACING):
+    lanes = build_layout(layout, spacing)
+    return [mapem_lane(lane, xy_nodes(lanes[lane["name"]][:, 0], lanes[lane["name"]][:, 1])) for lane in layout["lanes"]]
+
+def mapem_intersection(intersection, layout, lane_set):
+    reference = intersection.get("reference")
+    return {
+        "id": {"id": intersection["id"]},
+        "laneSet": lane_set,
+        "laneWidth": layout.get("lane_width", 2),
+        # Without a reference the node offsets are relative to the origin of the local frame
+        "refPoint": {"lat": reference["lat"], "long": reference["lng"]} if reference else {"lat": 0, "long": 0},
+        "revision": intersection.get("revision", 1),
+        "speedLimits": [{"speed": layout.get("speed_limit", 30), "type": 5}],
+    }
+
+# === Spec ===
+
+def load_spec(filepath):
+    with open(filepath, "r") as file:
+        return json.load(file)
+
+def expand_intersections(spec):
+    """Intersection entries of the spec, with every grid entry expanded"""
+    for entry in spec["intersections"]:
+        if "grid" not in entry:
+            yield entry
+            continue
+        grid = entry["grid"]
+        projection = LocalProjection.around(grid["origin"])
+        next_id = grid.get("first_id", 1)
+        for row in range(grid["rows"]):
+            for col in range(grid["cols"]):
+                lat, lng = projection.to_gps(col * grid["spacing"], row * grid["spacing"])
+                yield {"id": next_id, "layout": grid["layout"], "reference": {"lat": lat, "lng": lng}}
+                next_id += 1
+
+def generate(spec):
+    """(intersection entry, MAPEM) of every intersection in the spec; lane sets are built once per layout"""
+    spacing = spec.get("point_spacing", POINT_SPACING)
+    lane_sets = {}
+    for intersection in expand_intersections(spec):
+        name = intersection["layout"]
+        layout = spec["layouts"][name]
+        if name not in lane_sets:
+            lane_sets[name] = build_lane_set(layout, spacing)
+        mapem = {
+            "intersections": [mapem_intersection(intersection, layout, lane_sets[name])],
+            "msgIssueRevision": spec.get("msgIssueRevision", 1),
+        }
+        yield intersection, mapem
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate MAPEMs from an intersection spec")
+    parser.add_argument("spec", help="intersection spec JSON, see lane_spec.json")
+    parser.add_argument("--out-dir", default="mapems", help="one mapem_<id>.json per intersection is written here")
+    parser.add_argument("--indent", type=int, default=None, help="indent the JSON output")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    os.makedirs(args.out_dir, exist_ok=True)
+    config = []
+    for intersection, mapem in generate(load_spec(args.spec)):
+        filepath = os.path.join(args.out_dir, f"mapem_{intersection['id']}.json")
+        with open(filepath, "w") as file:
+            file.write(json.dumps(mapem, indent=args.indent))
+        reference = intersection.get("reference", INTERSECTION_CENTER)
+        config.append({"id": intersection["id"], "position": reference, "reference": reference, "mapem_file": filepath})
+
+    # Intersections config for rsu_publisher.py (python3 -m rsu.rsu_publisher <out-dir>/intersections.json)
+    with open(os.path.join(args.out_dir, "intersections.json"), "w") as file:
+        json.dump(config, file, indent=4)
+    print(f"Generated {len(config)} MAPEMs in {args.out_dir} in {time.perf_counter() - started:.2f} s")
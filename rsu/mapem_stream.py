@@ -0,0 +1,114 @@
+"""
+Streaming MAPEM builder.
+
+Reads lane geometry one lane at a time and writes the MAPEM JSON straight to the
+output file, so memory stays at one lane however large the map is. Input is a
+lane geometry bundle (memory-mapped, see common/lane_geometry.py) or a JSON lines
+file with one lane per line:
+
+    {"name": "L1", "x": [...], "y": [...]}     # optional: laneID, ingress, signalGroup, connectsTo
+
+Lane attributes come from the line itself or from the matching lane of a layout
+in an intersection spec (see lane_generation.py). Nodes are written as
+
+    latlon  node-LatLon with absolute lat/lon degrees, from the exact WGS84 ENU
+            frame at the reference point
+    xy      node-XY1..XY6 offsets in centimeters from the previous node (the
+            first one from the reference point), the smallest size that fits
+
+Without --ref the refPoint is 0/0 and xy nodes are relative to the lane
+reference of the RSU controller; latlon nodes always need one.
+
+    python3 -m rsu.mapem_stream rsu/lane_geometry --spec rsu/lane_spec.json --ref 40.6329,-8.6585 --nodes xy -o mapem.json
+"""
+import argparse
+import json
+import os
+import numpy as np
+
+from common.geometry import EnuProjection
+from common.lane_geometry import LaneGeometry
+from rsu.lane_generation import mapem_lane, xy_nodes
+
+# === Input ===
+
+def iter_bundle_lanes(directory):
+    """(lane entry, x, y) per lane of a lane geometry bundle"""
+    geometry = LaneGeometry.load(directory)
+    for name in geometry.names:
+        x, y = geometry.xy(name)
+        yield {"name": name}, x, y
+
+def iter_jsonl_lanes(filepath):
+    """(lane entry, x, y) per line of a JSON lines lane file"""
+    with open(filepath, "r") as file:
+        for line in file:
+            if not line.strip():
+                continue
+            lane = json.loads(line)
+            yield lane, np.asarray(lane.pop("x"), dtype=np.float64), np.asarray(lane.pop("y"), dtype=np.float64)
+
+def iter_lanes(path):
+    return iter_bundle_lanes(path) if os.path.isdir(path) else iter_jsonl_lanes(path)
+
+# === Nodes ===
+
+def latlon_nodes(x, y, projection):
+    lat, lon = projection.to_gps(x, y)
+    return [{"delta": {"node-LatLon": {"lon": lo, "lat": la}}} for la, lo in zip(lat.tolist(), lon.tolist())]
+
+# === Output ===
+
+def write_mapem(file, lanes, intersection_id=1, reference=None, node_format="xy",
+                layout=None, lane_width=2, speed_limit=30, revision=1):
+    """Write one MAPEM, lane by lane, from an iterable of (lane entry, x, y)"""
+    if node_format == "latlon" and reference is None:
+        raise ValueError(f"{node_format} nodes need a reference point")
+    projection = EnuProjection.around(reference) if node_format == "latlon" else None
+    spec_lanes = {lane["name"]: lane for lane in (layout or {}).get("lanes", [])}
+
+    file.write('{"intersections": [{"id": {"id": %d}, "laneSet": [' % intersection_id)
+    count = 0
+    for lane, x, y in lanes:
+        if node_format == "latlon":
+            nodes = latlon_nodes(x, y, projection)
+        else:
+            nodes = xy_nodes(x, y)
+        count += 1
+        if count > 1:
+            file.write(", ")
+        # Attributes on the input line win over those of the spec layout
+        lane = dict(spec_lanes.get(lane.get("name"), {}), **lane)
+        lane.setdefault("laneID", count)
+        file.write(json.dumps(mapem_lane(lane, nodes)))
+    ref_point = {"lat": reference["lat"], "long": reference["lng"]} if reference else {"lat": 0, "long": 0}
+    file.write('], "laneWidth": %s, "refPoint": %s, "revision": %d, "speedLimits": [{"speed": %s, "type": 5}]}], '
+               '"msgIssueRevision": %d}' % (json.dumps(lane_width), json.dumps(ref_point), revision,
+                                            json.dumps(speed_limit), revision))
+    return count
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build a MAPEM from lane geometry, one lane at a time")
+    parser.add_argument("lanes", help="lane geometry bundle directory or JSON lines lane file")
+    parser.add_argument("-o", "--output", default="mapem.json")
+    parser.add_argument("--id", type=int, default=1, help="intersection id")
+    parser.add_argument("--ref", default=None, help="reference point as lat,lng")
+    parser.add_argument("--nodes", choices=("latlon", "xy"), default="xy")
+    parser.add_argument("--spec", default=None, help="intersection spec with the lane attributes")
+    parser.add_argument("--layout", default=None, help="layout of the spec (default: the first one)")
+    args = parser.parse_args()
+
+    reference = None
+    if args.ref:
+        lat, lng = (float(value) for value in args.ref.split(","))
+        reference = {"lat": lat, "lng": lng}
+    layout = {}
+    if args.spec:
+        with open(args.spec, "r") as file:
+            spec = json.load(file)
+        layout = spec["layouts"][args.layout or next(iter(spec["layouts"]))]
+
+    with open(args.output, "w") as file:
+        count = write_mapem(file, iter_lanes(args.lanes), args.id, reference, args.nodes, layout,
+                            layout.get("lane_width", 2), layout.get("speed_limit", 30))
+    print(f"Wrote {count} lanes to {args.output}")
@@ -0,0 +1,218 @@
+import hashlib
+import json
+import os
+import time
+import logging
+
+# === Message Templates ===
+# Each message file is parsed once at startup. The parsed document is shared and
+# must be treated as read-only: the builders below copy only the containers on
+# the path to the fields they patch, everything else is reused as-is.
+
+def generation_delta_time(now=None):
+    """generationDeltaTime as used by the CAM (ms modulo 65536)"""
+    if now is None:
+        now = time.time()
+    return int(now * 1000) % 65536
+
+def _file_signature(filepath):
+    stat = os.stat(filepath)
+    return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+class MessageTemplate:
+    """A JSON message file parsed once, optionally reloaded when it changes on disk"""
+
+    def __init__(self, filepath, hot_reload=False, check_interval=1.0):
+        self.filepath = filepath
+        self.hot_reload = hot_reload
+        self.check_interval = check_interval
+        self.document = None
+        self.digest = None
+        self.version = 0
+        self._signature = None
+        self._last_check = 0.0
+        self.load()
+
+    def load(self):
+        # Stat before reading so a write that races the read is picked up next check
+        signature = _file_signature(self.filepath)
+        with open(self.filepath, "rb") as file:
+            raw = file.read()
+        self.document = json.loads(raw)
+        self.digest = hashlib.sha1(raw).hexdigest()
+        self._signature = signature
+        self.version += 1
+
+    def refresh(self):
+        """Reload the file if hot reload is enabled and it changed. Returns True on reload."""
+        if not self.hot_reload:
+            return False
+
+        now = time.monotonic()
+        if now - self._last_check < self.check_interval:
+            return False
+        self._last_check = now
+
+        try:
+            signature = _file_signature(self.filepath)
+        except OSError as e:
+            logging.warning(f"Cannot stat template {self.filepath}: {e}")
+            return False
+        if signature == self._signature:
+            return False
+
+        try:
+            self.load()
+        except (OSError, ValueError) as e:
+            # Keep serving the previous document until the file is valid again
+            logging.error(f"Failed to reload template {self.filepath}, keeping previous version: {e}")
+            self._signature = signature
+            return False
+
+        logging.info(f"Reloaded template {self.filepath} (version {self.version})")
+        return True
+
+def with_intersection_id(doc, intersection_id):
+    """Copy of a SPATEM/MAPEM document with every intersection's id replaced"""
+    if intersection_id is None:
+        return doc
+    doc = dict(doc)
+    doc["intersections"] = [dict(intr, id={"id": intersection_id}) for intr in doc.get("intersections", [])]
+    return doc
+
+class EncodedMessageCache:
+    """
+    Serialized payload of a template whose content does not change between publishes.
+    The bytes are rebuilt only when the file content or the revision field changes.
+    """
+
+    def __init__(self, template, revision_field="msgIssueRevision", intersection_id=None):
+        self.template = template
+        self.revision_field = revision_field
+        self.intersection_id = intersection_id
+        self.rebuilds = 0
+        self._key = None
+        self._payload = None
+
+    def key(self):
+        return (self.template.digest, self.template.document.get(self.revision_field))
+
+    def payload(self):
+        key = self.key()
+        if key != self._key:
+            doc = with_intersection_id(self.template.document, self.intersection_id)
+            self._payload = json.dumps(doc).encode()
+            self._key = key
+            self.rebuilds += 1
+            logging.info(f"Encoded {self.template.filepath} ({len(self._payload)} bytes, "
+                         f"{self.revision_field}={key[1]})")
+        return self._payload
+
+class SpatemEncoder:
+    """
+    Incremental SPATEM serializer. The template is encoded once with a placeholder
+    in place of every eventState and minEndTime, and split into byte segments
+    around them. Each encode only re-renders the slots whose value changed.
+    Signal groups missing from signal_states keep the value they were last
+    encoded with (initially the template's).
+    """
+
+    _SLOT = "@@slot{}@@"
+
+    def __init__(self, template, intersection_id=None):
+        self.template = template
+        self.intersection_id = intersection_id
+        self._template_version = None
+        self._build()
+
+    def _build(self):
+        doc = with_intersection_id(self.template.document, self.intersection_id)
+        slot_values = []
+        self._event_slots = {}
+        self._end_slots = {}
+
+        def slot(value):
+            slot_values.append(value)
+            return self._SLOT.format(len(slot_values) - 1)
+
+        layout = dict(doc)
+        intersections = []
+        for intr in doc.get("intersections", []):
+            intr = dict(intr)
+            states = []
+            for state in intr.get("states", []):
+                group = state.get("signalGroup")
+                state = dict(state)
+                sts_list = []
+                for sts in state.get("state-time-speed", []):
+                    event_slot = slot(sts.get("eventState"))
+                    end_slot = slot(sts.get("timing", {}).get("minEndTime", 0))
+                    self._event_slots.setdefault(group, []).append(len(slot_values) - 2)
+                    self._end_slots.setdefault(group, []).append(len(slot_values) - 1)
+                    sts_list.append(dict(sts, eventState=event_slot, timing={"minEndTime": end_slot}))
+                state["state-time-speed"] = sts_list
+                states.append(state)
+            intr["states"] = states
+            intersections.append(intr)
+        layout["intersections"] = intersections
+
+        # Split the encoded layout so that parts[2 * i + 1] holds the value of slot i
+        text = json.dumps(layout)
+        parts = []
+        for i, value in enumerate(slot_values):
+            marker = json.dumps(self._SLOT.format(i))
+            before, found, text = text.partition(marker)
+            if not found or marker in text:
+                raise ValueError(f"SPATEM template {self.template.filepath} clashes with slot marker {marker}")
+            parts.append(before.encode())
+            parts.append(json.dumps(value).encode())
+        parts.append(text.encode())
+
+        self._parts = parts
+        self._values = slot_values
+        self._payload = b"".join(parts)
+        self._template_version = self.template.version
+
+    def _set(self, slots, value):
+        changed = False
+        for i in slots:
+            if self._values[i] != value:
+                self._values[i] = value
+                self._parts[2 * i + 1] = json.dumps(value).encode()
+                changed = True
+        return changed
+
+    def encode(self, signal_states):
+        """Encoded SPATEM bytes for signal_states (signalGroup -> (eventState, minEndTime))"""
+        if self._template_version != self.template.version:
+            self._build()
+
+        changed = False
+        for group, (event_state, min_end_time) in signal_states.items():
+            if group in self._event_slots:
+                changed |= self._set(self._event_slots[group], event_state)
+                changed |= self._set(self._end_slots[group], min_end_time)
+        if changed:
+            self._payload = b"".join(self._parts)
+        return self._payload
+
+# === Builders ===
+
+def signal_groups(spatem_doc):
+    """All signalGroup ids present in a SPATEM document"""
+    groups = []
+    for intr in spatem_doc.get("intersections", []):
+        for state in intr.get("states", []):
+            group = state.get("signalGroup")
+            if group is not None and group not in groups:
+                groups.append(group)
+    return groups
+
+def build_cam(template, latitude, longitude, station_type, now=None):
+    """Build a CAM from the template with the given position and station type"""
+    cam_msg = dict(template.document)
+    cam_msg["stationType"] = station_type
+    cam_msg["latitude"] = latitude
+    cam_msg["longitude"] = longitude
+    cam_msg["generationDeltaTime"] = generation_delta_time(now)
+    return cam_msg
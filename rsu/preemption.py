@@ -0,0 +1,126 @@
+import logging
+import math
+
+from common.geometry import EnuProjection
+from common.lane_index import LaneIndex
+from rsu.signal_plan import signal_group_for_heading
+
+# === Preemption Settings ===
+MATCH_TOLERANCE = 4.0       # meters between a vehicle and a lane centerline
+HEADING_TOLERANCE = 60      # degrees between the vehicle heading and the lane direction
+DEFAULT_SPEED = 10.0        # m/s, when no CAM of the emergency vehicle was seen
+LEAD_TIME = 4.0             # seconds of green before the predicted arrival at the stop line
+CLEARANCE_TIME = 3.0        # seconds of green after the predicted arrival
+MAX_PREEMPTION = 30.0       # seconds, upper bound of a single preemption window
+MIN_PREEMPTION = 2.0        # seconds, safety minimum of a preemption window
+STOP_LINE_DISTANCE = 15.0   # meters from the center, when no lane matched
+MAX_LANE_DISTANCE = 2000.0  # meters, lanes with nodes further from the reference point are ignored
+
+def denm_position(denm_payload):
+    """(lat, lng) of the DENM event position, or None"""
+    position = denm_payload.get("management", {}).get("eventPosition", {})
+    lat, lng = position.get("latitude"), position.get("longitude")
+    if lat is None or lng is None:
+        return None
+    # Some senders use the ASN.1 unit of 1e-7 degrees
+    if abs(lat) > 90 or abs(lng) > 180:
+        lat, lng = lat / 10000000, lng / 10000000
+    return lat, lng
+
+def lane_nodes(lane, projection=None):
+    """
+    (x, y) node coordinates of a MAPEM lane in meters from the reference point, or
+    None when the lane cannot be placed. node-XY offsets are in centimeters from the
+    previous node; node-LatLon are absolute lat/lon degrees, placed with the
+    projection around the refPoint, so they need one.
+    """
+    nodes = []
+    x = y = 0.0
+    for node in lane.get("nodeList", {}).get("nodes", []):
+        delta = node.get("delta", {})
+        latlon = delta.get("node-LatLon")
+        if latlon is not None:
+            if projection is None:
+                return None
+            x, y = (float(v) for v in projection.to_local(latlon["lat"], latlon["lon"]))
+        else:
+            offset = next((value for key, value in delta.items() if key.startswith("node-XY")), None)
+            if offset is None:
+                continue
+            x, y = x + offset["x"] / 100, y + offset["y"] / 100
+        nodes.append((x, y))
+    return nodes
+
+def lane_signal_group(lane):
+    for connection in lane.get("connectsTo", []):
+        if "signalGroup" in connection:
+            return connection["signalGroup"]
+    return None
+
+class LaneMap:
+    """
+    Ingress lanes of a MAPEM in a LaneIndex, for matching a vehicle position to
+    the lane it is on, its signal group and the distance left along the lane to
+    the stop line (the last node of an ingress lane).
+    """
+
+    def __init__(self, mapem_doc):
+        lanes = {}
+        self.groups = {}
+        # node-XY lanes are relative to the MAPEM reference point; a 0/0 refPoint means none,
+        # and they are relative to the controller's lane reference. node-LatLon lanes need
+        # a refPoint. Each controller publishes its own MAPEM, so only the first
+        # intersection is used.
+        self.reference = None
+        projection = None
+        for intr in mapem_doc.get("intersections", [])[:1]:
+            ref = intr.get("refPoint", {})
+            if ref.get("lat") or ref.get("long"):
+                self.reference = {"lat": ref["lat"], "lng": ref["long"]}
+                projection = EnuProjection.around(self.reference)
+            for lane in intr.get("laneSet", []):
+                if not lane.get("laneAttributes", {}).get("directionalUse", {}).get("ingressPath"):
+                    continue
+                group = lane_signal_group(lane)
+                nodes = lane_nodes(lane, projection)
+                if nodes is None:
+                    logging.warning(f"MAPEM lane {lane['laneID']} has node-LatLon nodes but no refPoint, ignored")
+                    continue
+                if group is None or len(nodes) < 2:
+                    continue
+                # Bad geometry would spread the lanes over thousands of km
+                if max(math.hypot(x, y) for x, y in nodes) > MAX_LANE_DISTANCE:
+                    logging.warning(f"MAPEM lane {lane['laneID']} lies over {MAX_LANE_DISTANCE:.0f} m "
+                                    f"from the reference point, ignored")
+                    continue
+                lanes[lane["laneID"]] = nodes
+                self.groups[lane["laneID"]] = group
+        self.index = LaneIndex(lanes, max_distance=MATCH_TOLERANCE) if lanes else None
+
+    def match(self, x, y, heading=None):
+        """
+        Nearest ingress lane to (x, y) within MATCH_TOLERANCE, ignoring lanes running
+        against the heading. Returns (laneID, signalGroup, distance to stop line) or None.
+        """
+        if self.index is None:
+            return None
+        match = self.index.nearest(x, y, heading=heading, heading_tolerance=HEADING_TOLERANCE)
+        if match is None:
+            return None
+        return match.lane, self.groups[match.lane], match.remaining
+
+def preemption_window(distance_to_stop, speed, now, started=None):
+    """
+    (start, end) of the green needed for a vehicle distance_to_stop meters from the
+    stop line: from LEAD_TIME before the predicted arrival to CLEARANCE_TIME after
+    it, at least MIN_PREEMPTION and at most MAX_PREEMPTION long. started is the
+    start of a window already running for the vehicle.
+    """
+    eta = distance_to_stop / max(speed, 0.1)
+    start = started if started is not None else now + max(0.0, eta - LEAD_TIME)
+    end = min(max(now + eta + CLEARANCE_TIME, start + MIN_PREEMPTION), start + MAX_PREEMPTION)
+    return start, end
+
+def fallback_target(heading, distance_to_center):
+    """Heading-based signal group and distance to the stop line, when no lane matched"""
+    return signal_group_for_heading(heading), max(0.0, distance_to_center - STOP_LINE_DISTANCE)
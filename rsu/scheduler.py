@@ -0,0 +1,126 @@
+import collections
+import heapq
+import itertools
+import time
+import logging
+
+JITTER_SAMPLES = 10000
+
+class PeriodicTask:
+    def __init__(self, interval, callback, name, due):
+        self.interval = interval
+        self.callback = callback
+        self.name = name
+        self.due = due
+        self.runs = 0
+        self.missed = 0
+        self.errors = 0
+        self.max_lateness = 0.0
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, int(round(p / 100 * len(sorted_values))) - 1))
+    return sorted_values[rank]
+
+class Scheduler:
+    """
+    Runs periodic tasks from a single thread. Tasks are kept in a heap ordered
+    by their next deadline, so each tick only touches the tasks that are due.
+
+    Deadlines are absolute ticks on the monotonic clock (first run + k * interval),
+    so the time spent in callbacks or sleeping late never shifts later ticks.
+    A task that falls more than a whole interval behind skips the ticks it missed
+    instead of firing them in a burst, and the skipped ticks are counted.
+    """
+
+    def __init__(self, clock=time.monotonic, sleep=time.sleep):
+        self.clock = clock
+        self.sleep = sleep
+        self.tasks = []
+        self._heap = []
+        self._seq = itertools.count()
+        self._running = False
+        # How late each run started relative to its deadline, in seconds
+        self.lateness = collections.deque(maxlen=JITTER_SAMPLES)
+
+    def add(self, interval, callback, name=None, delay=0.0):
+        """Run callback every interval seconds, the first time after delay seconds"""
+        task = PeriodicTask(interval, callback, name or getattr(callback, "__name__", "task"),
+                            self.clock() + delay)
+        self.tasks.append(task)
+        heapq.heappush(self._heap, (task.due, next(self._seq), task))
+        return task
+
+    def add_staggered(self, jobs):
+        """
+        Add (interval, callback, name) jobs, spreading the first run of jobs with the
+        same interval evenly over that interval so they do not all fire at once.
+        """
+        by_interval = {}
+        for job in jobs:
+            by_interval.setdefault(job[0], []).append(job)
+        for interval, group in by_interval.items():
+            for i, (interval, callback, name) in enumerate(group):
+                self.add(interval, callback, name, delay=interval * i / len(group))
+
+    def run_pending(self):
+        """Run every task that is due. Returns the time until the next one."""
+        while self._heap:
+            due, _, task = self._heap[0]
+            now = self.clock()
+            if due > now:
+                return due - now
+            heapq.heappop(self._heap)
+
+            lateness = now - due
+            self.lateness.append(lateness)
+            task.max_lateness = max(task.max_lateness, lateness)
+            try:
+                task.callback()
+            except Exception as e:
+                task.errors += 1
+                logging.error(f"Task {task.name} failed: {e}")
+            task.runs += 1
+
+            # Next absolute tick, skipping the ones already in the past
+            missed = int(lateness // task.interval)
+            if missed:
+                task.missed += missed
+                logging.debug(f"Task {task.name} missed {missed} deadline(s), {lateness * 1000:.1f} ms late")
+            task.due = due + (missed + 1) * task.interval
+            heapq.heappush(self._heap, (task.due, next(self._seq), task))
+        return None
+
+    def run_forever(self):
+        self._running = True
+        while self._running:
+            wait = self.run_pending()
+            if wait is None:
+                break
+            self.sleep(wait)
+
+    def stop(self):
+        self._running = False
+
+    def stats(self):
+        """Run counters over all tasks and start-time jitter percentiles in milliseconds"""
+        samples = sorted(self.lateness)
+        return {
+            "tasks": len(self.tasks),
+            "runs": sum(task.runs for task in self.tasks),
+            "missed": sum(task.missed for task in self.tasks),
+            "errors": sum(task.errors for task in self.tasks),
+            "jitter_p50_ms": percentile(samples, 50) * 1000,
+            "jitter_p95_ms": percentile(samples, 95) * 1000,
+            "jitter_p99_ms": percentile(samples, 99) * 1000,
+            "jitter_max_ms": (samples[-1] if samples else 0.0) * 1000,
+        }
+
+    def log_stats(self):
+        stats = self.stats()
+        logging.info(
+            f"Scheduler: {stats['runs']} runs, {stats['missed']} missed deadlines, {stats['errors']} errors, "
+            f"jitter p50={stats['jitter_p50_ms']:.2f} ms p95={stats['jitter_p95_ms']:.2f} ms "
+            f"p99={stats['jitter_p99_ms']:.2f} ms max={stats['jitter_max_ms']:.2f} ms")
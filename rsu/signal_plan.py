@@ -0,0 +1,170 @@
+import json
+import math
+import threading
+import numpy as np
+
+# === Event States ===
+RED = 3     # stop-And-Remain
+GREEN = 5   # permissive-Movement-Allowed
+YELLOW = 7  # permissive-clearance
+
+# Fixed-time plan used when an intersection has none configured: a 20 s cycle
+# aligned to the wall clock, east/west (3, 7) green first, then north/south (1, 5)
+DEFAULT_PLAN = {
+    "cycle": 20,
+    "offset": 0,
+    "groups": {
+        "1": {"green_start": 10, "green": 10},
+        "3": {"green_start": 0, "green": 10},
+        "5": {"green_start": 10, "green": 10},
+        "7": {"green_start": 0, "green": 10},
+    },
+}
+
+def signal_group_for_heading(heading):
+    """Signal group controlling traffic that travels with the given heading (degrees)"""
+    heading = heading % 360
+    if heading >= 315 or heading < 45:
+        return 1   # NORTH
+    elif heading < 135:
+        return 3   # EAST
+    elif heading < 225:
+        return 5   # SOUTH
+    else:
+        return 7   # WEST
+
+def load_plan(filepath):
+    with open(filepath, "r") as file:
+        return json.load(file)
+
+def validate_plan(plan):
+    cycle = plan["cycle"]
+    if cycle <= 0:
+        raise ValueError(f"Signal plan cycle must be positive, got {cycle}")
+    for group, split in plan["groups"].items():
+        if split["green"] + split.get("yellow", 0) > cycle:
+            raise ValueError(f"Signal group {group}: green + yellow exceeds the {cycle} s cycle")
+
+def _plan_rows(plan):
+    return [(
+        int(group),
+        float(plan["cycle"]),
+        float(plan.get("offset", 0)),
+        float(split["green_start"]),
+        float(split["green"]),
+        float(split.get("yellow", 0)),
+    ) for group, split in plan["groups"].items()]
+
+class SignalPlanBank:
+    """
+    Fixed-time signal plans of many intersections stored as flat NumPy arrays,
+    one entry per signal group. evaluate(t) computes the eventState and
+    minEndTime of every group of every intersection in one vectorized pass.
+
+    Each plan has a cycle length and offset (seconds, relative to the epoch) and
+    per group a green start within the cycle, a green duration and an optional
+    yellow duration. Outside green and yellow a group is red.
+
+    The bank is shared between threads (plans are re-timed on the scheduler
+    thread, emergency SPATEMs are evaluated on the MQTT thread), so every method
+    holds its lock.
+    """
+
+    def __init__(self, resolution=0.05):
+        # Results are reused for calls within the same resolution bucket, so a
+        # scheduler tick that publishes many intersections evaluates once
+        self.resolution = resolution
+        self._slices = {}
+        self._rows = []
+        self._arrays = None
+        self._cache_bucket = None
+        self._cache = None
+        # Reentrant: update() falls back to add(), which calls remove()
+        self._lock = threading.RLock()
+
+    def add(self, key, plan):
+        """Register the plan of intersection key (replacing any previous plan)"""
+        validate_plan(plan)
+        with self._lock:
+            if key in self._slices:
+                self.remove(key)
+            start = len(self._rows)
+            self._rows.extend(_plan_rows(plan))
+            self._slices[key] = (start, len(self._rows))
+            self._invalidate()
+
+    def update(self, key, plan):
+        """Replace the plan of intersection key, in place when it has the same number of groups"""
+        with self._lock:
+            start, end = self._slices.get(key, (0, -1))
+            if end - start != len(plan["groups"]):
+                self.add(key, plan)
+                return
+            validate_plan(plan)
+            rows = _plan_rows(plan)
+            self._rows[start:end] = rows
+            if self._arrays is not None:
+                # Patch the built arrays instead of rebuilding them for every group
+                a = np.array(rows, dtype=np.float64)
+                self._arrays["group"][start:end] = a[:, 0].astype(np.int64)
+                self._arrays["cycle"][start:end] = a[:, 1]
+                self._arrays["offset"][start:end] = a[:, 2]
+                self._arrays["green_start"][start:end] = a[:, 3]
+                self._arrays["green_end"][start:end] = a[:, 3] + a[:, 4]
+                self._arrays["yellow_end"][start:end] = a[:, 3] + a[:, 4] + a[:, 5]
+            self._cache_bucket = None
+
+    def remove(self, key):
+        with self._lock:
+            start, end = self._slices.pop(key)
+            del self._rows[start:end]
+            width = end - start
+            for other, (s, e) in self._slices.items():
+                if s >= end:
+                    self._slices[other] = (s - width, e - width)
+            self._invalidate()
+
+    def _invalidate(self):
+        self._arrays = None
+        self._cache_bucket = None
+
+    def _build(self):
+        rows = np.array(self._rows, dtype=np.float64).reshape(-1, 6)
+        self._arrays = {
+            "group": rows[:, 0].astype(np.int64),
+            "cycle": rows[:, 1],
+            "offset": rows[:, 2],
+            "green_start": rows[:, 3],
+            "green_end": rows[:, 3] + rows[:, 4],
+            "yellow_end": rows[:, 3] + rows[:, 4] + rows[:, 5],
+        }
+
+    def evaluate(self, t):
+        """(eventState, minEndTime) arrays over all signal groups at time t (epoch seconds)"""
+        with self._lock:
+            if self._arrays is None:
+                self._build()
+            a = self._arrays
+            # Position inside the cycle, measured from the start of the group's green
+            pos = np.mod(t - a["offset"] - a["green_start"], a["cycle"])
+            green_len = a["green_end"] - a["green_start"]
+            yellow_len = a["yellow_end"] - a["green_start"]
+
+            in_green = pos < green_len
+            in_yellow = ~in_green & (pos < yellow_len)
+            event_state = np.where(in_green, GREEN, np.where(in_yellow, YELLOW, RED))
+            state_end = np.where(in_green, green_len, np.where(in_yellow, yellow_len, a["cycle"]))
+            min_end_time = np.ceil(state_end - pos).astype(np.int64)
+            return event_state, min_end_time
+
+    def states(self, key, t):
+        """signalGroup -> (eventState, minEndTime) for one intersection"""
+        bucket = math.floor(t / self.resolution)
+        with self._lock:
+            if bucket != self._cache_bucket:
+                event_state, min_end_time = self.evaluate(t)
+                self._cache = (event_state.tolist(), min_end_time.tolist(), self._arrays["group"].tolist())
+                self._cache_bucket = bucket
+            event_state, min_end_time, groups = self._cache
+            start, end = self._slices[key]
+        return {groups[i]: (event_state[i], min_end_time[i]) for i in range(start, end)}
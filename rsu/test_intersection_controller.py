@@ -0,0 +1,59 @@
+import math
+
+from common.geometry import INTERSECTION_CENTER, projection_for
+from rsu.intersection_controller import IntersectionController
+from rsu.preemption import MIN_PREEMPTION, lane_nodes
+
+EMERGENCY_STATION = 99
+
+def emergency_controller():
+    published = []
+    config = {"id": 1, "position": INTERSECTION_CENTER, "hot_reload": False}
+    controller = IntersectionController.from_config(config, lambda *args: published.append(args))
+    return controller, published
+
+def ingress_approach(controller, before_stop=20.0):
+    """GPS position before_stop meters before the stop line of an ingress lane, and the lane heading"""
+    lane = next(lane for lane in controller.mapem_template.document["intersections"][0]["laneSet"]
+                if lane["laneAttributes"]["directionalUse"]["ingressPath"])
+    nodes = lane_nodes(lane)
+    (x0, y0), (x1, y1) = nodes[0], nodes[-1]
+    length = math.hypot(x1 - x0, y1 - y0)
+    x, y = x1 - (x1 - x0) * before_stop / length, y1 - (y1 - y0) * before_stop / length
+    heading = math.degrees(math.atan2(x1 - x0, y1 - y0)) % 360
+    return projection_for(controller.reference).to_gps(x, y), heading
+
+def emergency_cam(lat, lng, heading, speed):
+    return {"stationID": EMERGENCY_STATION, "stationType": 10, "latitude": lat, "longitude": lng,
+            "heading": heading, "speed": speed}
+
+def emergency_denm(lat, lng):
+    return {"management": {"actionID": {"originatingStationID": EMERGENCY_STATION, "sequenceNumber": 1},
+                           "eventPosition": {"latitude": lat, "longitude": lng}}}
+
+def test_close_fast_ambulance_gets_a_short_green():
+    controller, published = emergency_controller()
+    (lat, lng), heading = ingress_approach(controller, before_stop=20.0)
+    now = 1000.0
+    controller.handle_cam(emergency_cam(lat, lng, heading, 20.0), now)
+    controller.handle_emergency_denm(emergency_denm(lat, lng), now)
+
+    # 20 m at 20 m/s: green right away, until CLEARANCE_TIME after the arrival
+    assert controller.emergency_mode
+    assert controller.emergency_mode_start == now
+    green = controller.emergency_mode_expiry - controller.emergency_mode_start
+    assert MIN_PREEMPTION <= green < 10.0
+    assert len(published) == 1
+
+def test_green_ends_after_predicted_arrival():
+    controller, _ = emergency_controller()
+    (lat, lng), heading = ingress_approach(controller, before_stop=20.0)
+    now = 1000.0
+    controller.handle_cam(emergency_cam(lat, lng, heading, 20.0), now)
+    controller.handle_emergency_denm(emergency_denm(lat, lng), now)
+    expiry = controller.emergency_mode_expiry
+
+    controller.update_spatem(expiry - 0.1)
+    assert controller.emergency_mode
+    controller.update_spatem(expiry + 0.1)
+    assert not controller.emergency_mode
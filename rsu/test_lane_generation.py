@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+
+from common.geometry import LocalProjection
+from rsu.lane_generation import NODE_XY_RANGES, arc, build_lane, expand_intersections, generate, straight, xy_nodes
+
+def test_straight_spacing():
+    points = straight((0, 0), (10, 0), spacing=0.5)
+    assert len(points) == 21
+    assert np.allclose(np.diff(points[:, 0]), 0.5)
+    # Spacing is an upper bound when the length is not a multiple of it
+    points = straight((0, 0), (0, 1.2), spacing=0.5)
+    assert len(points) == 4 and np.hypot(*np.diff(points, axis=0).T).max() <= 0.5
+
+@pytest.mark.parametrize("clockwise", [False, True])
+def test_arc(clockwise):
+    start, end = (0.0, np.pi / 2) if not clockwise else (np.pi / 2, 0.0)
+    points = arc((0, 0), 10, start, end, spacing=0.5, clockwise=clockwise)
+    assert np.allclose(np.hypot(points[:, 0], points[:, 1]), 10)
+    assert np.allclose(points[0], (10 * np.cos(start), 10 * np.sin(start)))
+    assert np.allclose(points[-1], (10 * np.cos(end), 10 * np.sin(end)))
+    assert np.hypot(*np.diff(points, axis=0).T).max() <= 0.5
+
+def test_build_lane_joins_segments():
+    lane = build_lane([{"straight": {"start": [0, -20], "end": [0, -10]}},
+                       {"arc": {"center": [10, -10], "radius": 10, "start": 180, "end": 90, "clockwise": True}}])
+    assert np.allclose(lane[0], (0, -20)) and np.allclose(lane[-1], (10, 0))
+    with pytest.raises(ValueError):
+        build_lane([{"spiral": {}}])
+
+def test_xy_nodes_sizes_and_round_trip():
+    x = np.array([1.234, 1.244, 9.0, 30.0, 300.0])
+    y = np.array([-2.0, -2.0, -2.0, 50.0, 50.0])
+    nodes = xy_nodes(x, y)
+    assert [next(iter(node["delta"])) for node in nodes] == ["node-XY1", "node-XY1", "node-XY2", "node-XY5", "node-XY6"]
+    # Offsets add up to the rounded positions, whatever the number of nodes
+    cx = np.cumsum([node["delta"][next(iter(node["delta"]))]["x"] for node in nodes])
+    assert list(cx) == list(np.rint(x * 100).astype(int))
+    many = np.linspace(0, 100, 3001)
+    total = sum(next(iter(node["delta"].values()))["x"] for node in xy_nodes(many, np.zeros_like(many)))
+    assert total == 10000
+
+def test_xy_nodes_offset_too_large():
+    limit = NODE_XY_RANGES[-1][1] / 100
+    with pytest.raises(ValueError):
+        xy_nodes([0.0, limit + 1], [0.0, 0.0])
+
+def test_grid_expansion():
+    spec = {"intersections": [
+        {"id": 99, "layout": "x", "reference": {"lat": 40.0, "lng": -8.0}},
+        {"grid": {"origin": {"lat": 40.6, "lng": -8.6}, "rows": 2, "cols": 3, "spacing": 200,
+                  "layout": "x", "first_id": 10}},
+    ]}
+    entries = list(expand_intersections(spec))
+    assert [entry["id"] for entry in entries] == [99, 10, 11, 12, 13, 14, 15]
+    projection = LocalProjection.around({"lat": 40.6, "lng": -8.6})
+    x, y = projection.to_local(entries[6]["reference"]["lat"], entries[6]["reference"]["lng"])
+    assert (x, y) == pytest.approx((400, 200))
+
+def test_lane_set_built_once_per_layout():
+    layout = {"lanes": [{"name": "in", "laneID": 1, "ingress": True, "signalGroup": 1,
+                         "segments": [{"straight": {"start": [0, -30], "end": [0, -5]}}],
+                         "connectsTo": [{"lane": 2}]},
+                        {"name": "out", "laneID": 2, "segments": [{"straight": {"start": [0, 5], "end": [0, 30]}}]}]}
+    spec = {"layouts": {"x": layout},
+            "intersections": [{"grid": {"origin": {"lat": 40.6, "lng": -8.6}, "rows": 1, "cols": 3,
+                                        "spacing": 100, "layout": "x"}}]}
+    mapems = [mapem for _, mapem in generate(spec)]
+    assert len(mapems) == 3
+    lane_sets = [mapem["intersections"][0]["laneSet"] for mapem in mapems]
+    assert lane_sets[0] is lane_sets[1] is lane_sets[2]
+    assert [mapem["intersections"][0]["id"]["id"] for mapem in mapems] == [1, 2, 3]
+    ingress = lane_sets[0][0]
+    assert ingress["laneAttributes"]["directionalUse"] == {"egressPath": False, "ingressPath": True}
+    assert ingress["connectsTo"][0]["signalGroup"] == 1
+    assert ingress["connectsTo"][0]["connectingLane"]["maneuver"]["maneuverStraightAllowed"]
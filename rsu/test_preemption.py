@@ -0,0 +1,101 @@
+import io
+import json
+import math
+import os
+import numpy as np
+import pytest
+
+from common.geometry import INTERSECTION_CENTER, projection_for
+from rsu.lane_generation import build_layout, generate, load_spec
+from rsu.mapem_stream import write_mapem
+from rsu.preemption import CLEARANCE_TIME, LEAD_TIME, MAX_PREEMPTION, MIN_PREEMPTION, LaneMap, preemption_window
+
+RSU_DIR = os.path.dirname(os.path.abspath(__file__))
+REFERENCE = {"lat": 40.64, "lng": -8.65}
+
+SPEC = load_spec(os.path.join(RSU_DIR, "lane_spec.json"))
+LAYOUT_NAME = next(iter(SPEC["layouts"]))
+LAYOUT = SPEC["layouts"][LAYOUT_NAME]
+POINTS = build_layout(LAYOUT, SPEC.get("point_spacing", 0.5))
+
+def generated_mapem(reference):
+    entry = dict(id=1, layout=LAYOUT_NAME, **({"reference": reference} if reference else {}))
+    return next(generate(dict(SPEC, intersections=[entry])))[1]
+
+def streamed_mapem(node_format, reference):
+    file = io.StringIO()
+    lanes = ((lane, POINTS[lane["name"]][:, 0], POINTS[lane["name"]][:, 1]) for lane in LAYOUT["lanes"])
+    write_mapem(file, lanes, 1, reference, node_format, LAYOUT)
+    return json.loads(file.getvalue())
+
+def assert_round_trip(lane_map, layout=LAYOUT, points=POINTS):
+    """A GPS position 2 m before the stop line of every ingress lane matches that lane"""
+    # Positions are relative to the refPoint, or to the controller's lane reference
+    projection = projection_for(lane_map.reference or INTERSECTION_CENTER)
+    ingress = [lane for lane in layout["lanes"] if lane.get("ingress")]
+    assert ingress
+    for lane in ingress:
+        lane_points = points[lane["name"]]
+        x, y = lane_points[-5]
+        dx, dy = lane_points[-4] - lane_points[-6]
+        heading = math.degrees(math.atan2(dx, dy)) % 360
+        remaining = float(np.hypot(*np.diff(lane_points[-5:], axis=0).T).sum())
+        lat, lng = projection.to_gps(float(x), float(y))
+        match = lane_map.match(*projection.to_local(lat, lng), heading=heading)
+        assert match is not None, lane["name"]
+        assert match[:2] == (lane["laneID"], lane["signalGroup"])
+        assert match[2] == pytest.approx(remaining, abs=0.05)
+
+@pytest.mark.parametrize("reference", [None, REFERENCE])
+def test_lane_generation_round_trip(reference):
+    mapem = generated_mapem(reference)
+    nodes = mapem["intersections"][0]["laneSet"][0]["nodeList"]["nodes"]
+    assert all(key.startswith("node-XY") for node in nodes for key in node["delta"])
+    assert_round_trip(LaneMap(mapem))
+
+@pytest.mark.parametrize("node_format, reference", [("latlon", REFERENCE), ("xy", None), ("xy", REFERENCE)])
+def test_mapem_stream_round_trip(node_format, reference):
+    lane_map = LaneMap(streamed_mapem(node_format, reference))
+    assert lane_map.reference == reference
+    assert_round_trip(lane_map)
+
+def test_mapem_stream_latlon_needs_reference():
+    with pytest.raises(ValueError):
+        streamed_mapem("latlon", None)
+
+def test_latlon_near_zero_reference():
+    # Absolute nodes around a refPoint close to lat/lon 0 are still degrees
+    assert_round_trip(LaneMap(streamed_mapem("latlon", {"lat": 0.0001, "lng": 0.0002})))
+
+def test_latlon_without_ref_point_is_ignored():
+    mapem = streamed_mapem("latlon", REFERENCE)
+    mapem["intersections"][0]["refPoint"] = {"lat": 0, "long": 0}
+    lane_map = LaneMap(mapem)
+    assert lane_map.index is None
+    assert lane_map.match(0.0, 0.0) is None
+
+def test_rsu_mapem_lanes():
+    with open(os.path.join(RSU_DIR, "rsu_mapem.json"), "r") as file:
+        lane_map = LaneMap(json.load(file))
+    assert lane_map.reference == INTERSECTION_CENTER
+    assert lane_map.groups == {1: 1, 3: 3, 5: 5, 7: 7}
+
+def test_preemption_window_covers_predicted_arrival():
+    # 100 m at 10 m/s: green from 4 s before the arrival to 3 s after it
+    start, end = preemption_window(100.0, 10.0, 1000.0)
+    assert start == pytest.approx(1000.0 + 10.0 - LEAD_TIME)
+    assert end == pytest.approx(1000.0 + 10.0 + CLEARANCE_TIME)
+
+def test_preemption_window_of_close_fast_vehicle_is_short():
+    start, end = preemption_window(10.0, 20.0, 1000.0)
+    assert start == 1000.0
+    assert MIN_PREEMPTION <= end - start < 10.0
+
+def test_preemption_window_bounds():
+    start, end = preemption_window(0.0, 50.0, 1000.0)
+    assert end - start == pytest.approx(CLEARANCE_TIME)
+    start, end = preemption_window(0.0, 50.0, 1000.0, started=999.5)
+    assert start == 999.5 and end - start >= MIN_PREEMPTION
+    # A slow vehicle cannot hold a running window open past MAX_PREEMPTION
+    start, end = preemption_window(100.0, 1.0, 1000.0, started=990.0)
+    assert end - start == pytest.approx(MAX_PREEMPTION)
@@ -0,0 +1,73 @@
+import pytest
+
+from rsu.scheduler import Scheduler
+
+class FakeClock:
+    def __init__(self, now=100.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+def test_deadlines_do_not_drift():
+    clock = FakeClock()
+    scheduler = Scheduler(clock, clock.sleep)
+    starts = []
+    def callback():
+        starts.append(clock.now)
+        # Time spent in the callback does not shift the next deadline
+        clock.now += 0.3
+        if len(starts) == 5:
+            scheduler.stop()
+    scheduler.add(1.0, callback)
+    scheduler.run_forever()
+    assert starts == [100.0, 101.0, 102.0, 103.0, 104.0]
+
+def test_missed_ticks_are_skipped():
+    clock = FakeClock()
+    scheduler = Scheduler(clock, clock.sleep)
+    starts = []
+    task = scheduler.add(1.0, lambda: starts.append(clock.now))
+    scheduler.run_pending()
+    # A stall of 3.5 intervals: one late run, not a burst of four
+    clock.now += 3.5
+    assert scheduler.run_pending() == 0.5
+    assert starts == [100.0, 103.5]
+    assert task.missed == 2
+    assert task.due == 104.0
+    clock.now = 104.0
+    scheduler.run_pending()
+    assert starts == [100.0, 103.5, 104.0]
+    assert scheduler.stats()["missed"] == 2
+
+def test_late_run_within_an_interval_misses_nothing():
+    clock = FakeClock()
+    scheduler = Scheduler(clock, clock.sleep)
+    task = scheduler.add(1.0, lambda: None, delay=1.0)
+    clock.now = 101.9
+    scheduler.run_pending()
+    assert task.runs == 1 and task.missed == 0
+    assert task.due == 102.0
+    assert task.max_lateness == pytest.approx(0.9)
+
+def test_staggered_first_runs():
+    clock = FakeClock()
+    scheduler = Scheduler(clock, clock.sleep)
+    scheduler.add_staggered([(0.6, lambda: None, "a"), (0.6, lambda: None, "b"), (0.6, lambda: None, "c"),
+                             (6.0, lambda: None, "mapem")])
+    dues = {task.name: task.due - 100.0 for task in scheduler.tasks}
+    assert dues == pytest.approx({"a": 0.0, "b": 0.2, "c": 0.4, "mapem": 0.0})
+
+def test_failing_task_keeps_running():
+    clock = FakeClock()
+    scheduler = Scheduler(clock, clock.sleep)
+    def fail():
+        raise RuntimeError("broken")
+    task = scheduler.add(1.0, fail)
+    scheduler.run_pending()
+    clock.now += 1.0
+    scheduler.run_pending()
+    assert task.runs == 2 and task.errors == 2
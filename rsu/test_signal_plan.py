@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+
+from rsu.signal_plan import DEFAULT_PLAN, GREEN, RED, YELLOW, SignalPlanBank, signal_group_for_heading
+
+def baseline_states(now):
+    """The hard-coded alternating pattern the RSU used before signal plans"""
+    cycle = (int(now) // 10) % 2
+    pattern = [3, 5, 3, 5] if cycle == 0 else [5, 3, 5, 3]
+    return {group: (pattern[i], 10 - (int(now) % 10)) for i, group in enumerate([1, 3, 5, 7])}
+
+def reference_state(plan, group, t):
+    """(eventState, minEndTime) of one group, computed directly from the plan"""
+    split = plan["groups"][str(group)]
+    pos = (t - plan.get("offset", 0) - split["green_start"]) % plan["cycle"]
+    green, yellow = split["green"], split["green"] + split.get("yellow", 0)
+    if pos < green:
+        return GREEN, int(np.ceil(green - pos))
+    if pos < yellow:
+        return YELLOW, int(np.ceil(yellow - pos))
+    return RED, int(np.ceil(plan["cycle"] - pos))
+
+PLAN_WITH_YELLOW = {
+    "cycle": 45,
+    "offset": 7,
+    "groups": {
+        "1": {"green_start": 0, "green": 18, "yellow": 3},
+        "3": {"green_start": 21, "green": 20, "yellow": 4},
+        "5": {"green_start": 0, "green": 18, "yellow": 3},
+        "7": {"green_start": 21, "green": 20, "yellow": 4},
+    },
+}
+
+@pytest.mark.parametrize("start", [0.0, 1.7e9])
+def test_default_plan_matches_baseline_phases(start):
+    bank = SignalPlanBank(resolution=0.01)
+    bank.add(1, DEFAULT_PLAN)
+    for t in start + np.arange(0.0, 60.0, 0.25):
+        assert bank.states(1, t) == baseline_states(t), t
+
+def test_many_intersections_in_one_pass():
+    bank = SignalPlanBank(resolution=0.01)
+    plans = {1: DEFAULT_PLAN, 2: PLAN_WITH_YELLOW, 3: dict(PLAN_WITH_YELLOW, offset=30)}
+    for key, plan in plans.items():
+        bank.add(key, plan)
+    for t in 1.7e9 + np.arange(0.0, 90.0, 0.5):
+        for key, plan in plans.items():
+            expected = {group: reference_state(plan, group, t) for group in (1, 3, 5, 7)}
+            assert bank.states(key, t) == expected, (key, t)
+
+def test_update_and_remove_keep_other_intersections():
+    bank = SignalPlanBank(resolution=0.01)
+    bank.add(1, DEFAULT_PLAN)
+    bank.add(2, DEFAULT_PLAN)
+    bank.add(3, PLAN_WITH_YELLOW)
+    bank.states(1, 0.0)
+    # In place, the arrays are patched instead of rebuilt
+    bank.update(2, PLAN_WITH_YELLOW)
+    bank.remove(1)
+    t = 1.7e9 + 12.3
+    expected = {group: reference_state(PLAN_WITH_YELLOW, group, t) for group in (1, 3, 5, 7)}
+    assert bank.states(2, t) == expected
+    assert bank.states(3, t) == expected
+    with pytest.raises(KeyError):
+        bank.states(1, t)
+
+def test_invalid_plan():
+    with pytest.raises(ValueError):
+        SignalPlanBank().add(1, {"cycle": 10, "groups": {"1": {"green_start": 0, "green": 9, "yellow": 3}}})
+
+def test_signal_group_for_heading():
+    assert [signal_group_for_heading(h) for h in (0, 44, 45, 134, 135, 224, 225, 314, 315, 359, -90)] == \
+        [1, 1, 3, 3, 5, 5, 7, 7, 1, 1, 7]
@@ -1,8 +1,11 @@
 #!/bin/bash
 
+# The Python components are packages run with -m from the repository root
+cd "$(dirname "$0")"
+
 # Start Dashboard Server
 echo "Starting Dashboard Server..."
-gnome-terminal -- bash -c "export TEST_NO_AMBULANCE=1; cd dashboard && python3 server.py; exec bash"
+gnome-terminal -- bash -c "export TEST_NO_AMBULANCE=1; python3 -m dashboard.server; exec bash"
 gnome-terminal -- bash -c "cd dashboard && cd app && npm run start; exec bash"
 
 # sleep for 5 seconds
@@ -11,16 +14,16 @@ sleep 8
 
 # Start RSU Publisher
 echo "Starting RSU Publisher..."
-gnome-terminal -- bash -c "cd rsu && python3 rsu_publisher.py; exec bash"
+gnome-terminal -- bash -c "python3 -m rsu.rsu_publisher; exec bash"
 
 sleep 3
 
 # Start Normal OBU
 echo "Starting Normal OBU..."
-gnome-terminal -- bash -c "cd normal_obu && python3 obu_normal.py; exec bash"
+gnome-terminal -- bash -c "python3 -m normal_obu.obu_normal; exec bash"
 
 sleep 3
 
 # Start Ambulance OBU
 echo "Starting Ambulance OBU..."
-gnome-terminal -- bash -c "cd ambulance_obu && python3 obu_ambulance.py; exec bash"
\ No newline at end of file
+gnome-terminal -- bash -c "python3 -m ambulance_obu.obu_ambulance; exec bash"
\ No newline at end of file